@@ -0,0 +1,81 @@
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from myapp.roles import auth_state
+
+ROLES_CLAIM = 'roles'
+EPOCH_CLAIM = 'epoch'
+
+
+def stamp_claims(token, user):
+    """Кладет в токен имя, роли и эпоху пользователя"""
+    _, epoch, roles = auth_state(user.pk)
+    token['username'] = user.get_username()
+    token[ROLES_CLAIM] = roles
+    token[EPOCH_CLAIM] = epoch
+    return token
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return stamp_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """Access-токен копирует claims из refresh-токена - роли и эпоха перечитываются заново"""
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        user = get_user_model().objects.get(**{api_settings.USER_ID_FIELD: access[api_settings.USER_ID_CLAIM]})
+        data['access'] = str(stamp_claims(access, user))
+        return data
+
+
+class StatelessUser(TokenUser):
+    """
+    TOKEN_USER_CLASS для StatelessJWTAuthentication. Пользователь из подписанных claims токена: id, имя и роли без запроса к базе.
+    Атрибуты, которых нет в токене (email, date_joined, ...), берутся из полного
+    пользователя - он загружается один раз при первом таком обращении.
+    """
+
+    @cached_property
+    def _roles(self):
+        # myapp.roles.user_roles берет роли отсюда
+        return frozenset(self.token.get(ROLES_CLAIM, ()))
+
+    @cached_property
+    def db_user(self):
+        return get_user_model().objects.get(pk=self.pk)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.db_user, name)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Аутентификация без загрузки User на каждый запрос - для частых чтений
+    (корзина, история заказов, отчеты). Вместо строки пользователя сверяется эпоха
+    из общего кэша (myapp.roles.auth_state): блокировка, смена пароля или ролей отзывают
+    токен сразу после коммита во всех процессах, клиент получает 401 и обновляет токен.
+    С кэшем в памяти процесса эпоха сверяется по базе. Токены, выданные без claims, проверяются
+    как в JWTAuthentication (по базе). В ORM передавать request.user.pk, а не сам объект.
+    """
+
+    def get_user(self, validated_token):
+        if EPOCH_CLAIM not in validated_token:
+            return JWTAuthentication.get_user(self, validated_token)
+        user = super().get_user(validated_token)
+        is_active, epoch, _ = auth_state(user.pk)
+        if not is_active or epoch != validated_token[EPOCH_CLAIM]:
+            raise AuthenticationFailed('Токен отозван, получите новый', code='token_revoked')
+        return user
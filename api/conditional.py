@@ -0,0 +1,67 @@
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from myapp.generations import get_generation
+
+
+def conditional_get(validators):
+    """
+    Условный GET для методов APIView/ViewSet.
+    validators(view, request, *args, **kwargs) -> (etag, last_modified) считается
+    до сериализации; при совпадении If-None-Match / If-Modified-Since сразу отдается 304.
+    """
+    def decorator(method):
+        @wraps(method)
+        def inner(view, request, *args, **kwargs):
+            etag, last_modified = validators(view, request, *args, **kwargs)
+            etag = quote_etag(etag) if etag else None
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+
+            if request.method in ('GET', 'HEAD') and 200 <= response.status_code < 300:
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+                if timestamp:
+                    response.headers.setdefault('Last-Modified', http_date(timestamp))
+            return response
+        return inner
+    return decorator
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def generation_validators(namespace, *extra):
+    """
+    Валидаторы списка по поколению пространства ключей (myapp/generations.py) - без запроса
+    к базе. Поколение сдвигается при любом изменении и удалении, поэтому только ETag:
+    Last-Modified по max(updated_at) удаления не замечает.
+    """
+    return make_etag(namespace, get_generation(namespace), *extra), None
+
+
+def queryset_validators(queryset, *extra):
+    """
+    Валидаторы небольшого списка (заказы пользователя) одним запросом: max(updated_at)
+    и число строк. Только ETag: после удаления max(updated_at) может не измениться.
+    """
+    stats = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+    if not stats['count']:
+        return make_etag('empty', *extra), None
+    return make_etag(stats['last_modified'].isoformat(), stats['count'], *extra), None
+
+
+def object_validators(queryset, *extra):
+    """Валидаторы одного объекта по updated_at; (None, None), если объекта нет"""
+    last_modified = queryset.order_by().values_list('updated_at', flat=True).first()
+    if last_modified is None:
+        return None, None
+    return make_etag(last_modified.isoformat(), *extra), last_modified
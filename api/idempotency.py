@@ -0,0 +1,113 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from myapp.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_TTL = 60 * 60 * 24
+MAX_KEY_LENGTH = 255
+
+
+def _scope_digest(request, key):
+    # Ключ действует в пределах пользователя и эндпоинта: одинаковые UUID разных клиентов не пересекаются
+    user_id = request.user.pk if request.user.is_authenticated else ''
+    return hashlib.sha256(f'{user_id}:{request.method}:{request.path}:{key}'.encode()).hexdigest()
+
+
+def _request_hash(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _cache_key(digest):
+    return f'idempotency:{digest}'
+
+
+def _stored(digest):
+    """(request_hash, status_code, data) первого ответа: из кэша за O(1), иначе из таблицы"""
+    stored = cache.get(_cache_key(digest))
+    if stored is None:
+        now = timezone.now()
+        row = (IdempotencyKey.objects
+               .filter(key=digest, status_code__isnull=False, expires_at__gt=now)
+               .values_list('request_hash', 'status_code', 'response', 'expires_at').first())
+        if row is not None:
+            *stored, expires_at = row
+            stored = tuple(stored)
+            # В кэше ответ живет не дольше строки
+            cache.set(_cache_key(digest), stored, max(int((expires_at - now).total_seconds()), 1))
+    return stored
+
+
+def _replay(stored, request_hash):
+    stored_hash, status_code, data = stored
+    if stored_hash != request_hash:
+        return Response({'error': 'Idempotency-Key уже использован с другим телом запроса'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(data, status=status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(method):
+    """
+    Идемпотентность POST/PUT/DELETE методов APIView по заголовку Idempotency-Key.
+    Первый запрос выполняется в одной транзакции с записью ключа, и его ответ
+    сохраняется в таблицу и кэш; повтор с тем же ключом получает сохраненный ответ,
+    не трогая заказы и корзины. Параллельный дубликат ждет коммита первого на
+    уникальном индексе и тоже получает его ответ. Ответы 5xx не запоминаются.
+    Без заголовка метод работает как обычно.
+    """
+    @wraps(method)
+    def inner(view, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return method(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'Idempotency-Key длиннее {MAX_KEY_LENGTH} символов'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        digest = _scope_digest(request, key)
+        request_hash = _request_hash(request)
+        stored = _stored(digest)
+        if stored is not None:
+            return _replay(stored, request_hash)
+
+        with transaction.atomic():
+            now = timezone.now()
+            # Истекший ключ, который еще не удалила purge_idempotency_keys, не должен давать 409
+            IdempotencyKey.objects.filter(key=digest, expires_at__lte=now).delete()
+            try:
+                with transaction.atomic():
+                    IdempotencyKey.objects.create(key=digest, request_hash=request_hash,
+                                                  expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL))
+            except IntegrityError:
+                # Такой же запрос только что завершился в другом процессе
+                stored = _stored(digest)
+                if stored is None:
+                    return Response({'error': 'Запрос с этим Idempotency-Key еще выполняется'},
+                                    status=status.HTTP_409_CONFLICT)
+                return _replay(stored, request_hash)
+
+            response = method(view, request, *args, **kwargs)
+            if response.status_code >= 500:
+                # Ключ откатывается вместе с транзакцией: повтор выполнит запрос заново
+                transaction.set_rollback(True)
+                return response
+
+            IdempotencyKey.objects.filter(key=digest).update(status_code=response.status_code,
+                                                             response=response.data)
+            stored = (request_hash, response.status_code, response.data)
+            transaction.on_commit(lambda: cache.set(_cache_key(digest), stored, IDEMPOTENCY_TTL))
+        return response
+    return inner
+
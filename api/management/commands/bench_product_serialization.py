@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import ProductSerializer, PRODUCT_VALUES_FIELDS, serialize_product_rows
+from myapp.models import Product
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает ProductSerializer и быстрый путь serialize_product_rows на N строках'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        self.stdout.write(f"{'rows':>8} {'serializer r/s':>15} {'fast r/s':>12} {'speedup':>8} identical")
+
+        for count in options['rows']:
+            try:
+                # Тестовые строки создаются во временной транзакции и откатываются
+                with transaction.atomic():
+                    Product.objects.bulk_create(
+                        Product(name=f'Bench {i}', description='Описание', price=f'{i % 5000}.99')
+                        for i in range(count)
+                    )
+                    products = Product.objects.order_by('id')
+
+                    slow = self._measure(options['repeat'], lambda: ProductSerializer(
+                        products.with_images(), many=True).data)
+                    fast = self._measure(options['repeat'], lambda: serialize_product_rows(
+                        products.values(*PRODUCT_VALUES_FIELDS)))
+
+                    identical = renderer.render(slow[1]) == renderer.render(fast[1])
+                    total = len(slow[1])
+                    self.stdout.write(
+                        f'{total:>8} {total / slow[0]:>15.0f} {total / fast[0]:>12.0f} '
+                        f'{slow[0] / fast[0]:>7.1f}x {identical}'
+                    )
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def _measure(self, repeat, build):
+        best, data = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = build()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, data
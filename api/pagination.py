@@ -0,0 +1,67 @@
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from myapp.pagination import DEFAULT_SORT, PRODUCT_SORT_FIELDS, KeysetPaginator
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная пагинация для API поверх myapp.pagination.KeysetPaginator.
+    ?sort=price|-price|discount|name|id, ?cursor=..., ?page_size=...
+    """
+    cursor_query_param = 'cursor'
+    sort_query_param = 'sort'
+    sort_fields = PRODUCT_SORT_FIELDS
+    default_sort = DEFAULT_SORT
+    page_size = 20
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get('page_size', self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(
+            queryset,
+            sort=request.query_params.get(self.sort_query_param),
+            per_page=self.get_page_size(request),
+            sort_fields=self.sort_fields,
+            default_sort=self.default_sort,
+        )
+        self.page = paginator.get_page(request.query_params.get(self.cursor_query_param))
+        return list(self.page.object_list)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class OrderKeysetPagination(KeysetPagination):
+    """История заказов: новые сверху, курсор по (created_at, id). ?sort=created - от старых к новым"""
+    sort_fields = {'created': 'created_at'}
+    default_sort = '-created'
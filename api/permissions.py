@@ -1,17 +1,19 @@
 from rest_framework.permissions import BasePermission
 
+from myapp.roles import CLIENT, MANAGER, has_role
+
 
 class IsManager(BasePermission):
     """
-    Доступ только из группы Manager
+    Доступ только из группы Manager (роли из кэша, myapp/roles.py)
     """
 
     def has_permission(self,request,view):
-        return request.user.groups.filter(name='manager').exists()
+        return has_role(request.user, MANAGER)
 
 class IsClient(BasePermission):
     """
-    Доступ только из группы Client
+    Доступ только из группы Client (роли из кэша, myapp/roles.py)
     """
     def has_permission(self,request,view):
-        return request.user.groups.filter(name='client').exists()
\ No newline at end of file
+        return has_role(request.user, CLIENT)
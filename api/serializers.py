@@ -1,6 +1,9 @@
+from decimal import Decimal
+
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 
-from myapp.models import Product, Category, OrderItem, Order, Cart, CartItem
+from myapp.models import Product, Category, OrderItem, Order, Cart, CartItem, ProductImage, ArchivedOrder
 from django.contrib.auth.models import User
 
 
@@ -20,7 +23,8 @@ class ProductSerializer(serializers.Serializer):
     category = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(), required=False, allow_null=True
     )
-    image = serializers.ImageField(required=False, allow_null=True)
+    # Главное изображение; при with_images() берется из подгруженных изображений без запросов
+    image = serializers.ImageField(source='get_main_image', read_only=True)
 
     def validate_price(self, value):
         if value <= 0:
@@ -37,14 +41,58 @@ class ProductSerializer(serializers.Serializer):
         instance.in_stock = validated_data.get('in_stock', instance.in_stock)
         instance.category = validated_data.get('category', instance.category)
 
-
-        image = validated_data.get('image')
-        if image is not None:
-            instance.image = image
-
         instance.save()
         return instance
 
+# Быстрый read-only путь для больших списков: строки .values() вместо моделей и полей DRF.
+# Вывод побайтно совпадает с ProductSerializer(many=True).data.
+PRODUCT_VALUES_FIELDS = ('id', 'name', 'description', 'price', 'in_stock', 'category_id', 'discount_percent')
+
+_price_field = ProductSerializer().fields['price']
+
+# (ключ ответа, ключ строки, преобразование) в порядке полей ProductSerializer
+PRODUCT_FIELD_MAP = (
+    ('id', 'id', None),
+    ('name', 'name', str),
+    ('description', 'description', str),
+    ('price', 'price', _price_field.to_representation),
+    ('in_stock', 'in_stock', None),
+    ('category', 'category_id', None),
+)
+
+
+def main_image_names(product_ids):
+    """{product_id: путь главного изображения} одним запросом (DISTINCT ON)"""
+    if not product_ids:
+        return {}
+    rows = (ProductImage.objects.filter(product_id__in=product_ids)
+            .order_by('product_id', '-is_main', 'order', 'id')
+            .distinct('product_id')
+            .values_list('product_id', 'image'))
+    return dict(rows)
+
+
+def serialize_product_rows(rows, context=None):
+    """rows - словари из Product.objects.values(*PRODUCT_VALUES_FIELDS)"""
+    rows = list(rows)
+    request = (context or {}).get('request')
+    images = main_image_names([row['id'] for row in rows])
+
+    data = []
+    for row in rows:
+        item = {}
+        for key, source, convert in PRODUCT_FIELD_MAP:
+            value = row[source]
+            item[key] = convert(value) if convert is not None and value is not None else value
+        image = images.get(row['id'])
+        if image:
+            url = default_storage.url(image)
+            image = request.build_absolute_uri(url) if request is not None else url
+        item['image'] = image or None
+        data.append(item)
+    return data
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     class Meta:
@@ -110,6 +158,38 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'total_amount', 'created_at']
 
 
+class ArchivedOrderItemSerializer(serializers.Serializer):
+    """Позиция из снимка ArchivedOrder.items: товар мог измениться или быть удален, поэтому только id и название"""
+    product = serializers.SerializerMethodField()
+    quantity = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    total = serializers.SerializerMethodField()
+
+    def get_product(self, obj):
+        return {'id': obj['product_id'], 'name': obj['name']}
+
+    def get_total(self, obj):
+        return Decimal(obj['price']) * obj['quantity']
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'user', 'phone_number', 'customer_name',
+                  'total_amount', 'created_at', 'items']
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Краткая строка истории заказов (?view=summary), и для Order, и для ArchivedOrder; item_count - аннотация"""
+    item_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'total_amount', 'item_count', 'created_at']
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     total_price = serializers.ReadOnlyField()
@@ -139,6 +219,24 @@ class UpdateCartItemSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1)
 
 
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'remove', 'set'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=999, default=1)
+
+    def validate(self, attrs):
+        # 0 допустим только для set - там он удаляет позицию
+        if attrs['op'] != 'set' and attrs['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Для add и remove количество должно быть не меньше 1.'})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+    # Повтор заказа: сначала очистить корзину
+    clear = serializers.BooleanField(default=False)
+
+
 
 class CheckoutSerializer(serializers.Serializer):
     phone_number = serializers.CharField(max_length=20)
@@ -1,11 +1,14 @@
+from unittest import mock
 from http import client
 
-from django.test import TestCase
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
 from decimal import Decimal
 from myapp.models import Product
 from rest_framework import status
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework_simplejwt.tokens import AccessToken
 
 from .serializers import ProductSerializer
@@ -130,4 +133,853 @@ class SimpleJWTTest(APITestCase):
 
         response = self.client.get('/api/products/',HTTP_AURHORIZATION=f' barer{token}')
 
-        self.assertEqual(response.status_code, 401)
\ No newline at end of file
+        self.assertEqual(response.status_code, 401)
+
+class ProductSearchAPITest(APITestCase):
+    def setUp(self):
+        Product.objects.create(name='Смартфон Pixel', description='Отличная камера', price='500.00')
+        Product.objects.create(name='Ноутбук Lenovo', description='Для работы', price='900.00')
+
+    def test_full_text_search_uses_morphology(self):
+        response = self.client.get('/api/products/search/', {'q': 'камеры'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['name'] for p in response.data['results']], ['Смартфон Pixel'])
+
+    def test_typo_falls_back_to_trigram(self):
+        response = self.client.get('/api/products/search/', {'q': 'Lenova'})
+        self.assertEqual([p['name'] for p in response.data['results']], ['Ноутбук Lenovo'])
+
+
+class ProductListCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(username='manager', password='pass123')
+        self.manager.groups.add(Group.objects.create(name='manager'))
+        self.client.force_authenticate(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(name='Phone', price='500.00')
+
+    def test_list_is_cached_until_catalog_changes(self):
+        self.assertEqual(self.client.get('/api/products/').data[0]['price'], '500.00')
+
+        with self.assertNumQueries(0):  # роли IsManager - из кэша
+            self.client.get('/api/products/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/products/{self.product.id}/discount', {'discount_percent': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/products/update/{self.product.id}/', {'price': '450.00'}, format='json')
+
+        self.assertEqual(self.client.get('/api/products/').data[0]['price'], '450.00')
+
+    def test_delete_invalidates_list(self):
+        self.assertEqual(len(self.client.get('/api/products/').data), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertEqual(self.client.get('/api/products/').data, [])
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Phone', price='500.00')
+
+    def test_unchanged_list_returns_304_without_body(self):
+        response = self.client.get('/api/catalog/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):  # поколение каталога - из кэша, без агрегата по товарам
+            response = self.client.get('/api/catalog/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).delete()
+        response = self.client.get('/api/catalog/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_has_no_last_modified(self):
+        # max(updated_at) не меняется при удалении - по нему список отдал бы 304 после удаления
+        response = self.client.get('/api/catalog/products/')
+        self.assertNotIn('Last-Modified', response)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        response = self.client.get('/api/catalog/products/', HTTP_IF_MODIFIED_SINCE='Wed, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_if_modified_since(self):
+        response = self.client.get(f'/api/catalog/products/{self.product.id}/')
+        last_modified = response['Last-Modified']
+
+        response = self.client.get(f'/api/catalog/products/{self.product.id}/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get('/api/catalog/products/999999/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FastProductSerializationTest(APITestCase):
+    def test_fast_path_is_byte_identical(self):
+        from myapp.models import Category, ProductImage
+        from rest_framework.renderers import JSONRenderer
+        from .serializers import PRODUCT_VALUES_FIELDS, serialize_product_rows
+
+        category = Category.objects.create(name='Phones')
+        phone = Product.objects.create(name='Phone', description='', price='500.5', category=category)
+        Product.objects.create(name='Без фото', description='Текст "в кавычках"', price='0.99', in_stock=False)
+        ProductImage.objects.create(product=phone, image='product_images/a.png', order=0)
+        ProductImage.objects.create(product=phone, image='product_images/main.png', is_main=True, order=1)
+
+        products = Product.objects.order_by('id')
+        slow = ProductSerializer(products.with_images(), many=True).data
+        fast = serialize_product_rows(products.values(*PRODUCT_VALUES_FIELDS))
+        self.assertEqual(JSONRenderer().render(fast), JSONRenderer().render(slow))
+
+
+class ExportAPITest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='pass123')
+        self.client.force_authenticate(self.user)
+
+    def test_orders_export_streams_only_own_orders(self):
+        from myapp.models import Order, OrderItem
+
+        product = Product.objects.create(name='Phone', price='100.00')
+        other = User.objects.create_user(username='other', password='pass123')
+        for user in (self.user, other):
+            order = Order.objects.create(user=user, phone_number='1', total_amount='200.00')
+            OrderItem.objects.create(order=order, product=product, quantity=2, price='100.00')
+
+        response = self.client.get('/api/orders/export/', {'fmt': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn('"line_total": "200.00"', lines[0])
+
+    def test_products_export_requires_manager(self):
+        response = self.client.get('/api/products/export/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CartTotalsTest(APITestCase):
+    def setUp(self):
+        from myapp.models import Cart, CartItem
+
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='pass123')
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        # Товар со скидкой и без: раньше сумма падала на float + Decimal
+        for i in range(5):
+            product = Product.objects.create(name=f'P{i}', price='99.99', discount_percent=15 if i % 2 else 0)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=i + 1)
+
+    def test_totals_are_decimal_and_query_count_is_constant(self):
+        response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # 9 шт. x 99.99 + 6 шт. x 84.99 (скидка 15%, округление до копеек)
+        self.assertEqual(Decimal(str(response.data['total_price'])), Decimal('1409.85'))
+        self.assertEqual(response.data['total_quantity'], 15)
+        self.assertEqual(Decimal(str(response.data['items'][1]['price_per_item'])), Decimal('84.99'))
+
+        # корзина, итоги из кэша, позиции с товарами, изображения
+        with self.assertNumQueries(3):
+            self.client.get('/api/cart/')
+
+    def test_summary_invalidated_on_item_change(self):
+        self.assertEqual(self.client.get('/api/cart/summary/').data['total_quantity'], 15)
+        self.cart.items.first().delete()
+        self.assertEqual(self.client.get('/api/cart/summary/').data['total_quantity'], 14)
+
+    def test_price_change_reaches_summary_and_checkout_total(self):
+        self.assertEqual(Decimal(str(self.client.get('/api/cart/summary/').data['total_price'])),
+                         Decimal('1409.85'))
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in Product.objects.filter(discount_percent=0):
+                product.price = Decimal('50.00')
+                product.save()
+        # 9 шт. x 50.00 + 6 шт. x 84.99
+        self.assertEqual(Decimal(str(self.client.get('/api/cart/summary/').data['total_price'])),
+                         Decimal('959.94'))
+
+        response = self.client.post('/api/orders/checkout/', {'phone_number': '+7900'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        from myapp.models import Order
+        order = Order.objects.get(pk=response.data['order_id'])
+        self.assertEqual(order.total_amount, sum(item.price * item.quantity for item in order.items.all()))
+        self.assertEqual(order.total_amount, Decimal('959.94'))
+
+
+class CartBatchTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='pass123')
+        self.client.force_authenticate(self.user)
+        self.a = Product.objects.create(name='A', price='10.00')
+        self.b = Product.objects.create(name='B', price='20.00')
+
+    def quantities(self):
+        from myapp.models import CartItem
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_batch_applies_operations_in_order(self):
+        self.client.post('/api/cart/add/', {'product_id': self.a.id, 'quantity': 5}, format='json')
+        response = self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'add', 'product_id': self.b.id, 'quantity': 2},
+            {'op': 'add', 'product_id': self.b.id, 'quantity': 1},
+            {'op': 'remove', 'product_id': self.a.id, 'quantity': 2},
+            {'op': 'set', 'product_id': self.b.id, 'quantity': 7},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.quantities(), {self.a.id: 3, self.b.id: 7})
+        self.assertEqual(response.data['total_quantity'], 10)
+
+        self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'set', 'product_id': self.a.id, 'quantity': 0},
+        ]}, format='json')
+        self.assertEqual(self.quantities(), {self.b.id: 7})
+
+    def test_zero_quantity_only_for_set(self):
+        from myapp.cart import upsert_cart_items, user_cart_id
+        for op in ('add', 'remove'):
+            response = self.client.post('/api/cart/batch/', {'operations': [
+                {'op': op, 'product_id': self.a.id, 'quantity': 0},
+            ]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        upsert_cart_items(user_cart_id(self.user), {self.a.id: 0, self.b.id: -1})
+        self.assertEqual(self.quantities(), {})
+
+    def test_unknown_product_rejects_whole_batch(self):
+        response = self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'add', 'product_id': self.a.id},
+            {'op': 'add', 'product_id': 999999},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['product_ids'], [999999])
+        self.assertEqual(self.quantities(), {})
+
+    def test_add_is_single_statement_upsert(self):
+        self.client.post('/api/cart/add/', {'product_id': self.a.id}, format='json')
+        # поиск корзины + INSERT ... ON CONFLICT
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/cart/add/', {'product_id': self.a.id, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.quantities(), {self.a.id: 3})
+        response = self.client.post('/api/cart/add/', {'product_id': 999999}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CartConcurrentAddTest(TransactionTestCase):
+    def test_parallel_adds_do_not_lose_updates(self):
+        import threading
+        from django.db import connection
+        from myapp.cart import upsert_cart_items
+        from myapp.models import Cart
+
+        user = User.objects.create_user(username='client', password='pass123')
+        product = Product.objects.create(name='A', price='10.00')
+        cart = Cart.objects.create(user=user)
+
+        def worker():
+            for _ in range(5):
+                upsert_cart_items(cart.id, {product.id: 1})
+            connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cart.items.get().quantity, 40)
+
+
+class StockReservationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='pass123')
+        self.client.force_authenticate(self.user)
+        self.hot = Product.objects.create(name='Hot', price='10.00', stock=5)
+        self.plain = Product.objects.create(name='Plain', price='20.00')
+
+    def add(self, product, quantity):
+        self.client.post('/api/cart/add/', {'product_id': product.id, 'quantity': quantity}, format='json')
+
+    def checkout(self):
+        return self.client.post('/api/orders/checkout/', {'phone_number': '+7900'}, format='json')
+
+    def stock(self):
+        self.hot.refresh_from_db()
+        return self.hot.stock
+
+    def test_reserve_then_checkout(self):
+        self.add(self.hot, 3)
+        self.add(self.plain, 1)
+        response = self.client.post('/api/cart/reserve/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.stock(), 2)
+
+        # Резерв приводится к корзине: уменьшили количество - разница вернулась на склад
+        self.client.post('/api/cart/remove/', {'product_id': self.hot.id, 'quantity': 1}, format='json')
+        self.client.post('/api/cart/reserve/')
+        self.assertEqual(self.stock(), 3)
+
+        self.assertEqual(self.checkout().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(), 3)
+        from myapp.models import StockReservation
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_without_reservation_decrements(self):
+        self.add(self.hot, 5)
+        self.assertEqual(self.checkout().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(), 0)
+        self.assertFalse(self.hot.in_stock)
+
+    def test_oversell_is_rejected(self):
+        from myapp.models import Order
+        self.add(self.hot, 6)
+        response = self.checkout()
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['product_ids'], [self.hot.id])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), 5)
+
+    def test_expired_reservations_are_released(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from myapp.models import StockReservation
+        from myapp.stock import release_expired_reservations
+
+        self.add(self.hot, 4)
+        self.client.post('/api/cart/reserve/')
+        self.assertEqual(release_expired_reservations(), 0)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertEqual(self.stock(), 5)
+
+
+class StockConcurrentCheckoutTest(TransactionTestCase):
+    def test_hot_product_is_not_oversold(self):
+        import threading
+        from django.db import connection
+        from rest_framework.test import APIClient
+        from myapp.models import Cart, CartItem, Order
+
+        product = Product.objects.create(name='Hot', price='10.00', stock=3)
+        users = []
+        for i in range(8):
+            user = User.objects.create_user(username=f'buyer{i}', password='pass123')
+            CartItem.objects.create(cart=Cart.objects.create(user=user), product=product, quantity=1)
+            users.append(user)
+        statuses = []
+
+        def worker(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            statuses.append(client.post('/api/orders/checkout/', {'phone_number': '+7900'}, format='json').status_code)
+            connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(sorted(statuses), [201] * 3 + [409] * 5)
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual((product.stock, product.in_stock), (0, False))
+
+
+class IdempotencyKeyTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='pass123')
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name='A', price='10.00')
+
+    def add(self, key, quantity=1):
+        return self.client.post('/api/cart/add/', {'product_id': self.product.id, 'quantity': quantity},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_add_is_applied_once(self):
+        from myapp.models import CartItem
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add('k1', 2)
+        # Повтор отдается из кэша, без запросов к БД
+        with self.assertNumQueries(0):
+            response = self.add('k1', 2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+
+        # Без кэша ответ берется из таблицы; новый ключ - новая операция
+        cache.clear()
+        self.assertEqual(self.add('k1', 2)['Idempotent-Replayed'], 'true')
+        self.add('k2', 2)
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+
+    def test_expired_key_can_be_reused(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from myapp.models import CartItem, IdempotencyKey
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add('k1', 2)
+        # Срок вышел, а почасовая очистка строку еще не удалила
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        cache.clear()
+        response = self.add('k1', 2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_retried_checkout_creates_one_order(self):
+        from myapp.models import Order
+        self.add('add', 1)
+        first = self.client.post('/api/orders/checkout/', {'phone_number': '+7900'}, format='json',
+                                 HTTP_IDEMPOTENCY_KEY='order-1')
+        retry = self.client.post('/api/orders/checkout/', {'phone_number': '+7900'}, format='json',
+                                 HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data['order_id'], first.data['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_other_body(self):
+        self.add('k1', 1)
+        self.assertEqual(self.add('k1', 5).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_keys_are_scoped_per_user(self):
+        from myapp.models import CartItem
+        self.add('k1', 1)
+        other = User.objects.create_user(username='other', password='pass123')
+        self.client.force_authenticate(other)
+        self.assertNotIn('Idempotent-Replayed', self.add('k1', 1))
+        self.assertEqual(CartItem.objects.filter(cart__user=other).get().quantity, 1)
+
+
+class OrderHistoryTest(APITestCase):
+    def setUp(self):
+        from myapp.models import Order, OrderItem
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='pass123')
+        self.client.force_authenticate(self.user)
+        products = [Product.objects.create(name=f'P{i}', price='10.00') for i in range(3)]
+        self.orders = []
+        for i in range(7):
+            order = Order.objects.create(user=self.user, phone_number='+7900', total_amount='10.00')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price='10.00') for product in products[:i % 3 + 1]
+            ])
+            self.orders.append(order)
+
+    def test_cursor_walks_newest_first(self):
+        ids, url = [], '/api/orders/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [order.id for order in reversed(self.orders)])
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        counts = []
+        for size in (1, 7):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/orders/', {'page_size': size})
+            self.assertEqual(len(response.data['results']), size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(len(response.data['results'][0]['items']), 1)
+        self.assertEqual(response.data['results'][0]['items'][0]['product']['name'], 'P0')
+
+    def test_summary_view(self):
+        response = self.client.get('/api/orders/', {'view': 'summary'})
+        row = response.data['results'][0]
+        self.assertEqual(set(row), {'id', 'status', 'total_amount', 'item_count', 'created_at'})
+        self.assertEqual(row['item_count'], 1)
+        self.assertEqual([row['item_count'] for row in response.data['results']], [1, 3, 2, 1, 3, 2, 1])
+
+
+class OrderArchiveTest(APITestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from myapp.models import Order, OrderItem
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='pass123')
+        self.client.force_authenticate(self.user)
+        product = Product.objects.create(name='Phone', price='10.00')
+
+        self.old = Order.objects.create(user=self.user, phone_number='+7900', total_amount='20.00', status='completed')
+        self.fresh = Order.objects.create(user=self.user, phone_number='+7900', total_amount='10.00', status='completed')
+        OrderItem.objects.create(order=self.old, product=product, quantity=2, price='10.00')
+        OrderItem.objects.create(order=self.fresh, product=product, quantity=1, price='10.00')
+        Order.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - timedelta(days=400))
+
+    def test_archived_orders_are_read_only_on_request(self):
+        from myapp.archive import archive_orders
+        from myapp.models import Order
+
+        self.assertEqual(archive_orders(), 1)
+        self.assertEqual(list(Order.objects.values_list('id', flat=True)), [self.fresh.id])
+
+        response = self.client.get('/api/orders/')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.fresh.id])
+
+        response = self.client.get('/api/orders/', {'archived': 1})
+        row = response.data['results'][0]
+        self.assertEqual(row['id'], self.old.id)
+        self.assertEqual(row['items'][0]['product']['name'], 'Phone')
+        self.assertEqual(row['items'][0]['quantity'], 2)
+
+        response = self.client.get('/api/orders/', {'archived': 1, 'view': 'summary'})
+        self.assertEqual(response.data['results'][0]['item_count'], 1)
+
+        self.assertEqual(self.client.get(f'/api/orders/{self.old.id}/').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(f'/api/orders/{self.old.id}/', {'archived': 1})
+        self.assertEqual(response.data['total_amount'], '20.00')
+
+    def test_export_moves_old_months_to_files(self):
+        import gzip
+        import json
+        import os
+        import tempfile
+        from django.utils import timezone
+        from myapp.archive import archive_orders, export_archive
+        from myapp.models import ArchivedOrder
+
+        archive_orders()
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(export_archive(directory, before=timezone.now()), 1)
+            [name] = os.listdir(directory)
+            with gzip.open(os.path.join(directory, name), 'rt', encoding='utf-8') as archive:
+                rows = [json.loads(line) for line in archive]
+        self.assertEqual([row['id'] for row in rows], [self.old.id])
+        self.assertFalse(ArchivedOrder.objects.exists())
+
+
+class SalesRollupTest(APITestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from myapp.models import Category, Order, OrderItem
+        cache.clear()
+        self.manager = User.objects.create_user(username='manager', password='pass123')
+        self.manager.groups.add(Group.objects.create(name='manager'))
+        self.client.force_authenticate(self.manager)
+
+        phones = Category.objects.create(name='Телефоны')
+        self.phone = Product.objects.create(name='Phone', price='100.00', category=phones)
+        self.case = Product.objects.create(name='Case', price='10.00', category=phones)
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+
+        def order(lines, days_ago=0, order_status='new'):
+            created = Order.objects.create(user=self.manager, phone_number='+7900', status=order_status,
+                                           total_amount=sum(p * q for _, q, p in lines))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=created, product=product, quantity=quantity, price=price)
+                for product, quantity, price in lines
+            ])
+            Order.objects.filter(pk=created.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+            return created
+
+        order([(self.phone, 1, Decimal('100.00')), (self.case, 2, Decimal('10.00'))], days_ago=1,
+              order_status='completed')
+        order([(self.phone, 2, Decimal('90.00'))], days_ago=1, order_status='cancelled')
+        self.open_order = order([(self.phone, 1, Decimal('100.00'))])
+
+    def sales(self, product, day):
+        from myapp.models import DailyProductSales
+        return DailyProductSales.objects.filter(product=product, day=day).values_list('revenue', 'units', 'orders').first()
+
+    def test_rebuild_and_incremental_refresh(self):
+        from myapp.rollups import rebuild_sales_rollups, refresh_sales_rollups
+
+        from datetime import timedelta
+        from django.utils import timezone
+        from myapp.models import Order
+
+        Order.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        rebuild_sales_rollups()
+        self.assertEqual(self.sales(self.phone, self.yesterday), (Decimal('100.00'), 1, 1))
+        self.assertEqual(self.sales(self.phone, self.today), (Decimal('100.00'), 1, 1))
+
+        # Отмена заказа сдвигает updated_at - пересчитывается только его день
+        self.open_order.status = 'cancelled'
+        self.open_order.save()
+        self.assertEqual(refresh_sales_rollups(), [self.today])
+        self.assertIsNone(self.sales(self.phone, self.today))
+        self.assertEqual(self.sales(self.phone, self.yesterday), (Decimal('100.00'), 1, 1))
+
+    def test_scattered_days_recomputed_by_ranges(self):
+        from datetime import timedelta
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from myapp.models import DailyProductSales
+        from myapp.rollups import recompute_days
+
+        old_day = self.today - timedelta(days=90)
+        stale = DailyProductSales.objects.create(day=self.today - timedelta(days=30), product=self.case,
+                                                 revenue=1, units=1, orders=1)
+        with CaptureQueriesContext(connection) as queries:
+            recompute_days([self.today, old_day, self.yesterday])
+        # Два отрезка (старый день и вчера-сегодня), промежуток между ними не трогается
+        self.assertEqual(sum(q['sql'].startswith('DELETE') for q in queries.captured_queries), 4)
+        self.assertTrue(DailyProductSales.objects.filter(pk=stale.pk).exists())
+        self.assertEqual(self.sales(self.phone, self.yesterday), (Decimal('100.00'), 1, 1))
+        self.assertEqual(self.sales(self.phone, self.today), (Decimal('100.00'), 1, 1))
+
+    def test_first_refresh_rebuilds_outside_watermark_lock(self):
+        from django.db import connection
+        from myapp.models import RollupWatermark
+        from myapp.rollups import refresh_sales_rollups
+
+        depth = len(connection.atomic_blocks)
+        with mock.patch('myapp.rollups.rebuild_sales_rollups') as rebuild:
+            rebuild.side_effect = lambda: self.assertEqual(len(connection.atomic_blocks), depth)
+            self.assertIsNone(refresh_sales_rollups())
+        rebuild.assert_called_once_with()
+        self.assertTrue(RollupWatermark.objects.filter(name='sales').exists())
+
+    def test_archived_orders_stay_in_rollups(self):
+        from django.utils import timezone
+        from myapp.archive import archive_orders
+        from myapp.rollups import rebuild_sales_rollups
+
+        archive_orders(before=timezone.now())
+        rebuild_sales_rollups()
+        self.assertEqual(self.sales(self.case, self.yesterday), (Decimal('20.00'), 2, 1))
+
+    def test_report_api(self):
+        from myapp.rollups import rebuild_sales_rollups
+        rebuild_sales_rollups()
+
+        response = self.client.get('/api/reports/sales/', {'group': 'product'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['name'], row['revenue'], row['units']) for row in response.data['results']],
+                         [('Phone', Decimal('200.00'), 2), ('Case', Decimal('20.00'), 2)])
+
+        response = self.client.get('/api/reports/sales/', {'daily': 1, 'date_from': self.yesterday.isoformat()})
+        self.assertEqual([(row['day'], row['orders']) for row in response.data['results']],
+                         [(self.yesterday, 1), (self.today, 1)])
+
+        response = self.client.get('/api/reports/sales/', {'group': 'product', 'limit': -1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.client.force_authenticate(User.objects.create_user(username='client', password='pass123'))
+        self.assertEqual(self.client.get('/api/reports/sales/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProductChangesTest(APITransactionTestCase):
+    """Транзакционный тест: лента отдает только закоммиченные транзакции"""
+
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(username='manager', password='pass123')
+        self.manager.groups.add(Group.objects.create(name='manager'))
+        self.client.force_authenticate(self.manager)
+
+    def feed(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get('/api/products/changes/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_created_updated_deleted_since_cursor(self):
+        start = self.feed(cursor='now')['next']
+        phone = Product.objects.create(name='Phone', price='100.00')
+        case = Product.objects.create(name='Case', price='10.00')
+
+        page = self.feed(start, limit=1)
+        self.assertTrue(page['has_more'])
+        self.assertEqual([(row['product_id'], row['action']) for row in page['results']], [(phone.id, 'created')])
+        self.assertEqual(page['results'][0]['product']['name'], 'Phone')
+        page = self.feed(page['next'])
+        self.assertEqual([(row['product_id'], row['action']) for row in page['results']], [(case.id, 'created')])
+        cursor = page['next']
+
+        # Пустая страница не двигает курсор
+        self.assertEqual(self.feed(cursor), {'results': [], 'next': cursor, 'has_more': False})
+
+        phone.price = Decimal('90.00')
+        phone.save()
+        Product.objects.filter(pk=phone.pk).update(search_vector=None)  # не поле карточки - не изменение
+        case_id = case.id
+        case.delete()
+        page = self.feed(cursor)
+        self.assertEqual([(row['product_id'], row['action']) for row in page['results']],
+                         [(phone.id, 'updated'), (case_id, 'deleted')])
+        self.assertEqual(page['results'][0]['product']['price'], '90.00')
+        self.assertIsNone(page['results'][1]['product'])
+
+    def test_bulk_update_without_updated_at_is_logged(self):
+        start = self.feed(cursor='now')['next']
+        phone = Product.objects.create(name='Phone', price='100.00', stock=5)
+        cursor = self.feed(start)['next']
+
+        Product.objects.filter(pk=phone.pk).update(price=Decimal('80.00'))
+        Product.objects.filter(pk=phone.pk).update(stock=4)  # остаток без смены наличия - не изменение
+        page = self.feed(cursor)
+        self.assertEqual([(row['product_id'], row['action']) for row in page['results']], [(phone.id, 'updated')])
+        self.assertEqual(page['results'][0]['product']['price'], '80.00')
+
+    def test_since_is_cursor_alias(self):
+        start = self.feed(cursor='now')['next']
+        phone = Product.objects.create(name='Phone', price='100.00')
+        page = self.feed(since=start)
+        self.assertEqual([(row['product_id'], row['action']) for row in page['results']], [(phone.id, 'created')])
+        self.assertEqual(self.feed(since=page['next'])['results'], [])
+
+    def test_bad_cursor_and_permissions(self):
+        self.assertEqual(self.client.get('/api/products/changes/', {'cursor': 'abc'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(User.objects.create_user(username='client', password='pass123'))
+        self.assertEqual(self.client.get('/api/products/changes/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class RoleCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='pass123')
+        self.manager_group = Group.objects.create(name='manager')
+
+    @mock.patch('myapp.roles.cache_is_shared', return_value=True)
+    def test_roles_cached_and_invalidated_on_membership_change(self, _):
+        from myapp.roles import has_role, user_roles
+
+        self.assertFalse(has_role(self.user, 'manager'))
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(user_roles(user), frozenset())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager_group.user_set.add(self.user)
+        self.assertTrue(has_role(User.objects.get(pk=self.user.pk), 'manager'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.groups.remove(self.manager_group)
+        self.assertFalse(has_role(user, 'manager'))
+
+    def test_process_local_cache_reads_roles_per_request(self):
+        from myapp.roles import has_role
+
+        self.manager_group.user_set.add(self.user)
+        self.assertTrue(has_role(User.objects.get(pk=self.user.pk), 'manager'))
+        # Удаление из группы в другом процессе: сброс кэша здесь не выполняется
+        User.groups.through.objects.filter(user_id=self.user.pk).delete()
+        self.assertFalse(has_role(User.objects.get(pk=self.user.pk), 'manager'))
+
+    def test_permission_follows_group(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/reports/sales/').status_code, status.HTTP_403_FORBIDDEN)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.manager_group)
+        self.assertEqual(self.client.get('/api/reports/sales/').status_code, status.HTTP_200_OK)
+
+
+class StatelessJWTTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='pass123')
+        self.user.groups.add(Group.objects.create(name='manager'))
+
+    def login(self):
+        response = self.client.post('/api/token/', {'username': 'buyer', 'password': 'pass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    @mock.patch('myapp.roles.cache_is_shared', return_value=True)
+    def test_claims_replace_user_lookup(self, _):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        tokens = self.login()
+        self.assertEqual(AccessToken(tokens['access'])['roles'], ['manager'])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.client.get('/api/cart/summary/')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/reports/sales/').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/api/cart/summary/').status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'auth_user' in query['sql']])
+
+    def test_deactivation_revokes_token(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get('/api/cart/summary/').status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/cart/summary/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_role_change_requires_refresh(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.clear()
+        self.assertEqual(self.client.get('/api/reports/sales/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+        refreshed = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}).data['access']
+        self.assertEqual(AccessToken(refreshed)['roles'], [])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refreshed}')
+        self.assertEqual(self.client.get('/api/reports/sales/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_revocation_without_in_process_invalidation(self):
+        # Блокировка в другом процессе: сигналы и сброс кэша здесь не выполняются.
+        # В тестах кэш - LocMemCache, поэтому эпоха сверяется по базе
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get('/api/reports/sales/').status_code, status.HTTP_200_OK)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get('/api/reports/sales/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @mock.patch('myapp.roles.cache_is_shared', return_value=True)
+    def test_shared_cache_entry_expires_within_minutes(self, _):
+        from myapp.roles import AUTH_STATE_TTL, auth_state
+
+        with mock.patch('myapp.roles.cache') as shared:
+            shared.get.return_value = None
+            auth_state(self.user.pk)
+        self.assertEqual(shared.set.call_args.args[2], AUTH_STATE_TTL)
+        self.assertLessEqual(AUTH_STATE_TTL, 5 * 60)
+
+    def test_token_without_claims_falls_back_to_db(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(self.client.get('/api/cart/summary/').status_code, status.HTTP_200_OK)
+
+
+class ProductImportJobTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user(username='manager', password='pass123')
+        self.manager.groups.add(Group.objects.create(name='manager'))
+        self.client.force_authenticate(self.manager)
+
+    def test_job_status_is_stored_in_database(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from myapp.tasks import import_products_task
+        upload = SimpleUploadedFile('catalog.ndjson', b'{"sku": "A-1", "name": "Phone", "price": "10"}\n{oops\n')
+        with mock.patch('api.views.import_products_task') as task:
+            response = self.client.post('/api/products/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data['job_id']
+
+        cache.clear()  # статус не зависит от кэша
+        self.assertEqual(self.client.get(f'/api/products/import/{job_id}/').data['status'], 'queued')
+
+        import_products_task(*task.delay.call_args.args)
+        data = self.client.get(f'/api/products/import/{job_id}/').data
+        self.assertEqual((data['status'], data['upserted'], data['errors']), ('done', 1, 1))
+        self.assertEqual(self.client.get('/api/products/import/missing/').status_code, status.HTTP_404_NOT_FOUND)
@@ -9,16 +9,31 @@ from api.views import (test_api, ProductDetailAPIView, ProductListAPIView, Produ
                        set_cookie_example, get_cookie_example, ProductDeleteAPIView, ProductUpdateAPIView,
                        RegisterAPIView,SetDiscountAPIView,
                        OrderDetailAPIView, OrderCheckoutAPIView,CartClearAPIView, CartRemoveAPIView,
-                       CartAddAPIView, CartDetailAPIView, CartUpdateAPIView, OrderListAPIView)
+                       CartAddAPIView, CartDetailAPIView, CartSummaryAPIView, CartBatchAPIView, CartUpdateAPIView,
+                       CartReserveAPIView, OrderListAPIView)
 
+from api.views import (CategoryViewSet, ProductViewSet, ProductSearchAPIView, ProductExportAPIView,
+                       OrderExportAPIView, ProductImportAPIView, ProductImportStatusAPIView, SalesReportAPIView,
+                       ProductChangesAPIView)
+
+from rest_framework.routers import SimpleRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+router = SimpleRouter()
+router.register('catalog/products', ProductViewSet, basename='catalog-product')
+router.register('catalog/categories', CategoryViewSet, basename='catalog-category')
+
 
 
 urlpatterns = [
     path('test/', test_api),
     path('products/<int:pk>/', ProductDetailAPIView.as_view(), name='product-detail'),
     path('products/', ProductListAPIView.as_view(), name='product-list'),
+    path('products/search/', ProductSearchAPIView.as_view(), name='product-search'),
+    path('products/changes/', ProductChangesAPIView.as_view(), name='product-changes'),
+    path('products/export/', ProductExportAPIView.as_view(), name='product-export'),
+    path('products/import/', ProductImportAPIView.as_view(), name='product-import'),
+    path('products/import/<str:job_id>/', ProductImportStatusAPIView.as_view(), name='product-import-status'),
     path('products/create/', ProductCreateAPIView.as_view(), name='product-create'),
     path('products/delete/<int:product_id>/', ProductDeleteAPIView.as_view(), name='product-delete'),
     path('products/update/<int:product_id>/', ProductUpdateAPIView.as_view(), name='product-update'),
@@ -35,13 +50,20 @@ urlpatterns = [
 
     # Корзина
     path('cart/', CartDetailAPIView.as_view(), name='cart-detail'),
+    path('cart/summary/', CartSummaryAPIView.as_view(), name='cart-summary'),
     path('cart/add/', CartAddAPIView.as_view(), name='cart-add'),
+    path('cart/batch/', CartBatchAPIView.as_view(), name='cart-batch'),
     path('cart/remove/', CartRemoveAPIView.as_view(), name='cart-remove'),
     path('cart/clear/', CartClearAPIView.as_view(), name='cart-clear'),
+    path('cart/reserve/', CartReserveAPIView.as_view(), name='cart-reserve'),
     path('cart/update/<int:item_id>/', CartUpdateAPIView.as_view(), name='cart-update'),
 
     # Заказы
     path('orders/', OrderListAPIView.as_view(), name='order-list'),
     path('orders/<int:pk>/', OrderDetailAPIView.as_view(), name='order-detail'),
     path('orders/checkout/', OrderCheckoutAPIView.as_view(), name='order-checkout'),
-]
\ No newline at end of file
+    path('orders/export/', OrderExportAPIView.as_view(), name='order-export'),
+    path('reports/sales/', SalesReportAPIView.as_view(), name='sales-report'),
+]
+
+urlpatterns += router.urls
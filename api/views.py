@@ -1,10 +1,15 @@
-import requests
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
 from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.db.models import F, Func, IntegerField, Prefetch, Sum, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from django.db.migrations import serializer
 from django.shortcuts import render
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status, permissions, viewsets, generics
 from rest_framework.authentication import TokenAuthentication
@@ -13,23 +18,43 @@ from rest_framework.decorators import api_view, action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from myapp.models import Product, OrderItem, Category, Order, Cart, CartItem
+from myapp.models import (ArchivedOrder, Product, OrderItem, Category, Order, Cart, CartItem, DailyCategorySales,
+                          DailyProductSales, ImportJob)
+from myapp.exports import (EXPORT_FORMATS, ORDER_EXPORT_FIELDS, PRODUCT_EXPORT_FIELDS,
+                           order_rows, product_rows, stream_export)
+from myapp.changes import CHANGES_MAX_PAGE_SIZE, CHANGES_PAGE_SIZE, changes_since, current_change_cursor
+from myapp.cart import (apply_cart_operations, cart_summary, clear_cart, invalidate_cart_summary,
+                         remove_cart_items, upsert_cart_items, user_cart_id)
+from myapp.outbox import enqueue_telegram
+from myapp.stock import OutOfStock, commit_cart_stock, reserve_cart
+from myapp.facets import apply_filters, get_facets, parse_filters
+from myapp.importer import IMPORT_FORMATS
+from myapp.tasks import import_products_task
+from myapp.generations import CATALOG, get_generation, versioned_key
+from myapp.search import search_products, SEARCH_LIMIT
 from rest_framework.views import APIView
 
 from api.serializers import (ProductSerializer, RegisterSerializer, ProductDiscountSerializer,
                              CategorySerializer,CartItemSerializer,OrderSerializer, CheckoutSerializer,
-                             UpdateCartItemSerializer, CartSerializer, AddToCartSerializer)
+                             UpdateCartItemSerializer, CartSerializer, AddToCartSerializer, CartBatchSerializer,
+                             OrderSummarySerializer, ArchivedOrderSerializer, PRODUCT_VALUES_FIELDS,
+                             serialize_product_rows)
 
 
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from api.authentication import StatelessJWTAuthentication
 from api.permissions import IsManager, IsClient
+from api.pagination import KeysetPagination, OrderKeysetPagination
+from api.conditional import conditional_get, generation_validators, object_validators, queryset_validators
+from api.idempotency import idempotent
 
-from django.conf import settings
 
 
 # Create your views here.
 
+PRODUCT_LIST_CACHE_TIMEOUT = 60 * 60
+
 @api_view(['GET'])
 def test_api(request, pk):
     try:
@@ -43,6 +68,7 @@ def test_api(request, pk):
     })
 
 class ProductDetailAPIView(APIView):
+    @conditional_get(lambda view, request, pk: object_validators(Product.objects.filter(pk=pk)))
     def get(self, request, pk):
         try:
             product = Product.objects.get(pk=pk)
@@ -57,7 +83,7 @@ class ProductDetailAPIView(APIView):
 
 
 class ProductListAPIView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated, IsManager]
 
     @swagger_auto_schema(
@@ -70,12 +96,186 @@ class ProductListAPIView(APIView):
     )
 
 
-    @method_decorator(cache_page(60*60))
     def get(self, request):
-        print(">>>>>>>get")
-        products = Product.objects.all()
+        # Ключ содержит поколение каталога: после любой записи старые ответы просто не читаются
+        cache_key = versioned_key(CATALOG, 'product-list', request.get_full_path())
+        data = cache.get(cache_key)
+        if data is None:
+            rows = Product.objects.order_by('id').values(*PRODUCT_VALUES_FIELDS)
+            data = serialize_product_rows(rows)
+            cache.set(cache_key, data, PRODUCT_LIST_CACHE_TIMEOUT)
+        return Response(data)
+
+
+class ProductSearchAPIView(APIView):
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        operation_summary="Поиск продуктов",
+        operation_description="Ранжированный поиск по названию и описанию: ?q=строка&limit=20",
+        responses={200: ProductSerializer(many=True)}
+    )
+    def get(self, request):
+        q = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), SEARCH_LIMIT)
+        except ValueError:
+            return Response({'error': 'limit должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = search_products(q, limit=max(limit, 1))
         serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        return Response({'query': q, 'results': serializer.data})
+
+
+def streaming_export_response(rows, fields, export_format, filename):
+    response = StreamingHttpResponse(stream_export(rows, fields, export_format),
+                                     content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+class ProductExportAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    @swagger_auto_schema(
+        operation_summary="Экспорт каталога",
+        operation_description="Потоковая выгрузка товаров с категорией и ценой со скидкой: ?fmt=csv|ndjson",
+    )
+    def get(self, request):
+        export_format = request.query_params.get('fmt', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': 'fmt должен быть csv или ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+        return streaming_export_response(product_rows(), PRODUCT_EXPORT_FIELDS, export_format, 'products')
+
+
+class ProductChangesAPIView(APIView):
+    """
+    Лента изменений каталога для синхронизации внешних систем (myapp/changes.py):
+    ?cursor=<next из прошлого ответа>&limit=100. Без курсора - с начала журнала,
+    ?cursor=now - курсор текущего момента без изменений (после полной выгрузки каталога).
+    ?since= - синоним cursor для клиентов, написанных по исходному описанию ленты.
+    Удаленный товар приходит с action=deleted и product=null.
+    """
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    @swagger_auto_schema(
+        operation_summary="Лента изменений товаров",
+        operation_description="Созданные, измененные и удаленные товары после курсора в порядке фиксации",
+    )
+    def get(self, request):
+        cursor = request.query_params.get('cursor', request.query_params.get('since'))
+        if cursor == 'now':
+            return Response({'results': [], 'next': current_change_cursor(), 'has_more': False})
+        try:
+            limit = min(max(int(request.query_params.get('limit', CHANGES_PAGE_SIZE)), 1), CHANGES_MAX_PAGE_SIZE)
+            changes, next_cursor, has_more = changes_since(cursor, limit)
+        except ValueError:
+            return Response({'error': 'Некорректный cursor или limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Текущее состояние товара - одним запросом на страницу; несколько изменений товара дают одну карточку
+        alive = {change.product_id for change in changes if change.action != 'deleted'}
+        products = {
+            row['id']: row for row in serialize_product_rows(
+                Product.objects.filter(id__in=alive).values(*PRODUCT_VALUES_FIELDS), {'request': request}
+            )
+        }
+        results = [
+            {
+                'change_id': change.id,
+                'product_id': change.product_id,
+                'action': change.action,
+                'changed_at': change.changed_at,
+                'product': products.get(change.product_id),
+            }
+            for change in changes
+        ]
+        return Response({'results': results, 'next': next_cursor, 'has_more': has_more})
+
+
+class ProductImportAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    @swagger_auto_schema(
+        operation_summary="Импорт каталога",
+        operation_description="Загрузка CSV/NDJSON (поле file) для фонового upsert по артикулу. "
+                              "Возвращает job_id для проверки статуса",
+    )
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Файл не передан'}, status=status.HTTP_400_BAD_REQUEST)
+
+        import_format = request.data.get('fmt') or upload.name.rsplit('.', 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            return Response({'error': 'fmt должен быть csv или ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+
+        job_id = uuid.uuid4().hex
+        path = default_storage.save(f'imports/{job_id}.{import_format}', upload)
+        ImportJob.objects.create(job_id=job_id)
+        import_products_task.delay(job_id, path, import_format)
+        return Response({'job_id': job_id, 'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
+
+
+class ProductImportStatusAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def get(self, request, job_id):
+        job = ImportJob.objects.filter(job_id=job_id).first()
+        if job is None:
+            return Response({'error': 'Задача импорта не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        data = {'job_id': job_id, 'status': job.status, **job.stats}
+        if job.error:
+            data['error'] = job.error
+        return Response(data)
+
+
+class SalesReportAPIView(APIView):
+    """
+    Продажи из агрегатов по дням (myapp/rollups.py), без GROUP BY по заказам:
+    ?group=product|category&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD&daily=1&limit=100.
+    Без daily - итоги за период, по убыванию выручки; с daily=1 - строки по дням.
+    """
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    GROUPS = {'product': (DailyProductSales, Product), 'category': (DailyCategorySales, Category)}
+    DEFAULT_DAYS = 30
+    MAX_LIMIT = 1000
+
+    def get(self, request):
+        group = request.query_params.get('group', 'category')
+        if group not in self.GROUPS:
+            return Response({'error': 'group должен быть product или category'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date_to = date.fromisoformat(request.query_params['date_to']) \
+                if 'date_to' in request.query_params else timezone.localdate()
+            date_from = date.fromisoformat(request.query_params['date_from']) \
+                if 'date_from' in request.query_params else date_to - timedelta(days=self.DEFAULT_DAYS - 1)
+            limit = max(min(int(request.query_params.get('limit', 100)), self.MAX_LIMIT), 1)
+        except ValueError:
+            return Response({'error': 'Даты в формате YYYY-MM-DD, limit - число'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        model, target = self.GROUPS[group]
+        key = f'{group}_id'
+        daily = request.query_params.get('daily') in ('1', 'true')
+        fields = ['day', key] if daily else [key]
+        ordering = ['day', '-revenue', key] if daily else ['-revenue', key]
+        rows = list(
+            model.objects.filter(day__gte=date_from, day__lte=date_to)
+            .values(*fields)
+            .annotate(revenue=Sum('revenue'), units=Sum('units'), orders=Sum('orders'))
+            .order_by(*ordering)[:limit]
+        )
+        names = dict(target.objects.filter(id__in={row[key] for row in rows}).values_list('id', 'name'))
+        for row in rows:
+            row['name'] = names.get(row[key])
+
+        return Response({'group': group, 'date_from': date_from, 'date_to': date_to, 'results': rows})
 
 
 class ProductCreateAPIView(APIView):
@@ -107,17 +307,12 @@ class ProductCreateAPIView(APIView):
     def post(self, request):
         serializer = ProductSerializer(data=request.data)
         if serializer.is_valid():
+            # Кэш списка инвалидируется сигналом post_save (смена поколения каталога)
             serializer.save()
-            self.clear_product_list_cache()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         print(serializer.errors)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def clear_product_list_cache(self):
-        cache_key = 'products_list_cache'
-        cache.delete(cache_key)
-        print(">>>>>>> Кэш очищен")
-
 
 class ProductDeleteAPIView(APIView):
     @swagger_auto_schema(
@@ -292,37 +487,87 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
 
+    @conditional_get(lambda view, request: generation_validators(CATALOG, 'categories'))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(lambda view, request, pk: object_validators(Category.objects.filter(pk=pk)))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Каталог с фасетной фильтрацией:
+    ?category=&price_min=&price_max=&in_stock=1&has_discount=1
+    Список дополнительно возвращает счетчики фасетов и гистограмму цен.
+    """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        queryset = Product.objects.all()
-        category_id = self.request.query_params.get('category')
-        if category_id:
-            queryset = queryset.filter(category_id=category_id)
+        queryset = Product.objects.with_images()
+        if self.action == 'list':
+            queryset = apply_filters(queryset, parse_filters(self.request.query_params))
         return queryset
 
+    def _list_validators(self, request):
+        # Список и фасеты зависят от всего каталога: ETag - поколение каталога и параметры запроса,
+        # без агрегата по отфильтрованным товарам
+        return generation_validators(CATALOG, request.get_full_path())
+
+    def _detail_validators(self, request, pk):
+        return object_validators(Product.objects.filter(pk=pk), get_generation(CATALOG))
+
+    @conditional_get(_list_validators)
+    def list(self, request, *args, **kwargs):
+        filters = parse_filters(request.query_params)
+        rows = apply_filters(Product.objects.values(*PRODUCT_VALUES_FIELDS), filters)
+        page = self.paginate_queryset(rows)
+        response = self.get_paginated_response(
+            serialize_product_rows(page, context=self.get_serializer_context())
+        )
+        response.data['facets'] = get_facets(filters)
+        return response
+
+    @conditional_get(_detail_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class CartDetailAPIView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         """Получить содержимое корзины"""
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart, created = Cart.objects.get_or_create(user_id=request.user.pk)
 
-        if not cart.items.exists():
+        # Итоги - из кэша или одним агрегатом; позиции с товарами - одним JOIN
+        if not cart.summary['items']:
             return Response({'cart_items': [], 'total': 0, 'total_quantity': 0})
 
+        items = CartItem.objects.with_prices().prefetch_related('product__images').order_by('id')
+        prefetch_related_objects([cart], Prefetch('items', queryset=items))
         serializer = CartSerializer(cart)
         return Response(serializer.data)
 
 
+class CartSummaryAPIView(APIView):
+    """Счетчик корзины для бейджа: постоянная стоимость независимо от размера корзины"""
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(cart_summary(user_cart_id(request.user, create=False)))
+
+
 class CartAddAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         """Добавить товар в корзину"""
         serializer = AddToCartSerializer(data=request.data)
@@ -330,28 +575,13 @@ class CartAddAPIView(APIView):
             product_id = serializer.validated_data['product_id']
             quantity = serializer.validated_data['quantity']
 
-            try:
-                product = Product.objects.get(id=product_id)
-            except Product.DoesNotExist:
+            # Один INSERT ... ON CONFLICT: параллельные нажатия не теряют количество
+            if not upsert_cart_items(user_cart_id(request.user), {product_id: quantity}):
                 return Response(
                     {'error': 'Товар не найден'},
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            cart, created = Cart.objects.get_or_create(user=request.user)
-
-            # Проверяем есть ли товар уже в корзине
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                defaults={'quantity': quantity}
-            )
-
-            if not created:
-                # Если товар уже есть, увеличиваем количество
-                cart_item.quantity += quantity
-                cart_item.save()
-
             return Response({'message': 'Товар добавлен в корзину'})
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -360,6 +590,7 @@ class CartAddAPIView(APIView):
 class CartRemoveAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         """Удалить товар из корзины"""
         serializer = AddToCartSerializer(data=request.data)
@@ -367,89 +598,199 @@ class CartRemoveAPIView(APIView):
             product_id = serializer.validated_data['product_id']
             quantity = serializer.validated_data.get('quantity', 1)
 
-            cart = get_object_or_404(Cart, user=request.user)
-
-            try:
-                cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
-
-                if cart_item.quantity <= quantity:
-                    # Удаляем полностью если количество меньше или равно
-                    cart_item.delete()
-                    message = 'Товар удален из корзины'
-                else:
-                    # Уменьшаем количество
-                    cart_item.quantity -= quantity
-                    cart_item.save()
-                    message = f'Количество товара уменьшено на {quantity}'
+            cart_id = user_cart_id(request.user, create=False)
+            if cart_id is None:
+                return Response({'error': 'Корзина не найдена'}, status=status.HTTP_404_NOT_FOUND)
 
-                return Response({'message': message})
-
-            except CartItem.DoesNotExist:
+            result = remove_cart_items(cart_id, {product_id: quantity}).get(product_id)
+            if result is None:
                 return Response(
                     {'error': 'Товар не найден в корзине'},
                     status=status.HTTP_404_NOT_FOUND
                 )
 
+            if result == 'deleted':
+                message = 'Товар удален из корзины'
+            else:
+                message = f'Количество товара уменьшено на {quantity}'
+            return Response({'message': message})
+
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 class CartClearAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def delete(self, request):
         """Очистить корзину"""
-        cart = get_object_or_404(Cart, user=request.user)
-        cart.items.all().delete()
+        cart_id = user_cart_id(request.user, create=False)
+        if cart_id is None:
+            return Response({'error': 'Корзина не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        clear_cart(cart_id)
         return Response({'message': 'Корзина очищена'})
 
 
 class CartUpdateAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def put(self, request, item_id):
         """Обновить количество товара в корзине"""
         serializer = UpdateCartItemSerializer(data=request.data)
         if serializer.is_valid():
             quantity = serializer.validated_data['quantity']
 
-            cart = get_object_or_404(Cart, user=request.user)
-
-            try:
-                cart_item = CartItem.objects.get(id=item_id, cart=cart)
-                cart_item.quantity = quantity
-                cart_item.save()
-
-                return Response({'message': 'Количество обновлено'})
-
-            except CartItem.DoesNotExist:
+            cart_id = user_cart_id(request.user, create=False)
+            # UPDATE без предварительного чтения позиции
+            if not cart_id or not CartItem.objects.filter(id=item_id, cart_id=cart_id).update(quantity=quantity):
                 return Response(
                     {'error': 'Элемент корзины не найден'},
                     status=status.HTTP_404_NOT_FOUND
                 )
 
+            invalidate_cart_summary(cart_id)
+            return Response({'message': 'Количество обновлено'})
+
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CartBatchAPIView(APIView):
+    """
+    Несколько изменений корзины одним запросом и одной транзакцией
+    (повтор заказа, набор товаров):
+    {"clear": false, "operations": [{"op": "add"|"remove"|"set", "product_id": 1, "quantity": 2}]}
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(request_body=CartBatchSerializer)
+    @idempotent
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        operations = serializer.validated_data['operations']
+
+        # Все или ничего: неизвестные товары отклоняют весь пакет
+        product_ids = {operation['product_id'] for operation in operations if operation['op'] != 'remove'}
+        missing = product_ids - set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        if missing:
+            return Response({'error': 'Товары не найдены', 'product_ids': sorted(missing)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        cart_id = user_cart_id(request.user)
+        with transaction.atomic():
+            apply_cart_operations(cart_id, operations, clear=serializer.validated_data['clear'])
+        return Response(cart_summary(cart_id))
+
+
+class CartReserveAPIView(APIView):
+    """
+    Резерв остатков под корзину перед оформлением (RESERVATION_TTL). Повторный вызов
+    приводит резерв к текущему содержимому корзины и продлевает его.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @idempotent
+    def post(self, request):
+        cart_id = user_cart_id(request.user, create=False)
+        if cart_id is None:
+            return Response({'error': 'Корзина пуста'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            expires_at = reserve_cart(cart_id)
+        except OutOfStock as e:
+            return Response({'error': 'Недостаточно товара на складе', 'product_ids': e.product_ids},
+                            status=status.HTTP_409_CONFLICT)
+        return Response({'reserved_until': expires_at})
+
+
+def archived_requested(request):
+    # Архив (myapp/archive.py) читается только по явному ?archived=1 - горячий путь его не касается
+    return request.query_params.get('archived') in ('1', 'true')
+
+
 class OrderListAPIView(generics.ListAPIView):
-    """Список заказов пользователя"""
-    serializer_class = OrderSerializer
+    """
+    История заказов пользователя, новые сверху, с курсором по (created_at, id):
+    ?cursor=...&page_size=...; ?view=summary - только id, статус, сумма и число позиций;
+    ?archived=1 - заказы, перенесенные в архив
+    """
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderKeysetPagination
+
+    def summary_mode(self):
+        return self.request.query_params.get('view') == 'summary'
+
+    def get_serializer_class(self):
+        if self.summary_mode():
+            return OrderSummarySerializer
+        return ArchivedOrderSerializer if archived_requested(self.request) else OrderSerializer
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).prefetch_related('items').order_by('-created_at')
+        if archived_requested(self.request):
+            queryset = ArchivedOrder.objects.filter(user_id=self.request.user.pk)
+            if self.summary_mode():
+                queryset = queryset.annotate(
+                    item_count=Func(F('items'), function='jsonb_array_length', output_field=IntegerField())
+                )
+            return queryset
+        queryset = Order.objects.filter(user_id=self.request.user.pk)
+        if self.summary_mode():
+            return queryset.with_item_count()
+        return queryset.with_items()
+
+    def _validators(self, request):
+        model = ArchivedOrder if archived_requested(request) else Order
+        # В заказы вложены данные товаров, поэтому учитываем и поколение каталога
+        return queryset_validators(model.objects.filter(user_id=request.user.pk), request.get_full_path(),
+                                   get_generation(CATALOG))
+
+    @conditional_get(_validators)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 class OrderDetailAPIView(generics.RetrieveAPIView):
-    """Детали заказа"""
-    serializer_class = OrderSerializer
+    """Детали заказа; ?archived=1 - заказ из архива"""
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
+    def get_serializer_class(self):
+        return ArchivedOrderSerializer if archived_requested(self.request) else OrderSerializer
+
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).prefetch_related('items')
+        if archived_requested(self.request):
+            return ArchivedOrder.objects.filter(user_id=self.request.user.pk)
+        return Order.objects.filter(user_id=self.request.user.pk).with_items()
+
+    def _validators(self, request, pk):
+        model = ArchivedOrder if archived_requested(request) else Order
+        return object_validators(model.objects.filter(user_id=request.user.pk, pk=pk), get_generation(CATALOG))
+
+    @conditional_get(_validators)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class OrderExportAPIView(APIView):
+    """Потоковая выгрузка заказов: менеджер получает все, клиент - свои"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        export_format = request.query_params.get('fmt', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': 'fmt должен быть csv или ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = OrderItem.objects.all()
+        if not IsManager().has_permission(request, self):
+            items = items.filter(order__user=request.user)
+        return streaming_export_response(order_rows(items), ORDER_EXPORT_FIELDS, export_format, 'orders')
 
 
 class OrderCheckoutAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         """Оформление заказа из корзины"""
         cart = get_object_or_404(Cart, user=request.user)
@@ -466,18 +807,21 @@ class OrderCheckoutAPIView(APIView):
 
         try:
             with transaction.atomic():
-                # Создание заказа
+                # Сумма - из тех же строк, что и позиции заказа, а не из кэшированных итогов корзины
+                cart_items = list(cart.items.with_prices())
                 order = Order.objects.create(
                     user=request.user,
                     phone_number=serializer.validated_data['phone_number'],
                     customer_name=serializer.validated_data.get('customer_name', ''),
-                    total_amount=cart.total_price
+                    total_amount=sum((item.price_per_item * item.quantity for item in cart_items), Decimal('0.00'))
                 )
 
                 # Создание элементов заказа из корзины
-                for cart_item in cart.items.all():
+                quantities = {}
+                for cart_item in cart_items:
                     # Используем цену с учетом скидки
                     item_price = cart_item.price_per_item
+                    quantities[cart_item.product_id] = cart_item.quantity
 
                     OrderItem.objects.create(
                         order=order,
@@ -486,22 +830,30 @@ class OrderCheckoutAPIView(APIView):
                         price=item_price
                     )
 
-                # Отправка в Telegram
-                telegram_message = self.create_order_message(order, order.items.all())
-                telegram_sent = self.send_telegram_notification(telegram_message)
+                # Уведомление в Telegram - строка outbox в этой же транзакции;
+                # отправляет ее dispatch_outbox после коммита, заказ не ждет Telegram
+                enqueue_telegram(self.create_order_message(order, order.items.select_related('product')))
 
                 # Очистка корзины после оформления заказа
-                cart.items.all().delete()
+                clear_cart(cart.id)
+
+                # Списание остатков - последним шагом: строки товаров заблокированы только до коммита
+                commit_cart_stock(cart.id, quantities)
 
                 response_data = {
                     'order_id': order.id,
                     'message': 'Заказ успешно оформлен',
                     'total_amount': float(order.total_amount),
-                    'telegram_notification_sent': telegram_sent
+                    'notification_queued': True
                 }
 
                 return Response(response_data, status=status.HTTP_201_CREATED)
 
+        except OutOfStock as e:
+            return Response(
+                {'error': 'Недостаточно товара на складе', 'product_ids': e.product_ids},
+                status=status.HTTP_409_CONFLICT
+            )
         except Exception as e:
             return Response(
                 {'error': f'Ошибка при оформлении заказа: {str(e)}'},
@@ -528,26 +880,3 @@ class OrderCheckoutAPIView(APIView):
 ⏰ <b>Время заказа:</b> {order.created_at.strftime('%d.%m.%Y в %H:%M')}
         """
         return message
-
-    def send_telegram_notification(self, message):
-        """Отправка сообщения в Telegram"""
-        bot_token = settings.TELEGRAM_BOT_TOKEN
-        chat_id = settings.TELEGRAM_CHAT_ID
-
-        if not bot_token or not chat_id:
-            print("Telegram bot token or chat ID not configured")
-            return False
-
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        payload = {
-            'chat_id': chat_id,
-            'text': message,
-            'parse_mode': 'HTML'
-        }
-
-        try:
-            response = requests.post(url, data=payload, timeout=10)
-            return response.status_code == 200
-        except Exception as e:
-            print(f"Error sending Telegram notification: {e}")
-            return False
\ No newline at end of file
@@ -17,6 +17,30 @@ app.conf.beat_schedule = {
         'task': 'myapp.tasks.fetch_exchange_rates',
         'schedule': crontab(hour=16, minute=0),  # Резервное обновление в 16:00
     },
+    'dispatch-outbox': {
+        'task': 'myapp.tasks.dispatch_outbox',
+        'schedule': 60.0,  # Страховка: повторы и сообщения, чей запуск после коммита не дошел
+    },
+    'release-stock-reservations': {
+        'task': 'myapp.tasks.release_expired_reservations',
+        'schedule': 60.0,  # Резерв корзины живет RESERVATION_TTL, возврат - с точностью до минуты
+    },
+    'purge-idempotency-keys': {
+        'task': 'myapp.tasks.purge_idempotency_keys',
+        'schedule': crontab(minute=30),  # Каждый час
+    },
+    'purge-product-changes': {
+        'task': 'myapp.tasks.purge_product_changes',
+        'schedule': crontab(hour=4, minute=0),  # Журнал хранится CHANGES_RETENTION_DAYS дней
+    },
+    'archive-old-orders': {
+        'task': 'myapp.tasks.archive_old_orders',
+        'schedule': crontab(hour=3, minute=0),  # Ночью, когда заказов мало
+    },
+    'refresh-sales-rollups': {
+        'task': 'myapp.tasks.refresh_sales_rollups',
+        'schedule': 5 * 60.0,  # Отчеты менеджеров отстают не больше чем на 5 минут
+    },
     'send-daily-report': {
         'task': 'myapp.tasks.send_daily_products_report',
         'schedule': crontab(hour=9, minute=0),  # Каждый день в 9:00
@@ -0,0 +1,20 @@
+from myapp.cart import CART_COOKIE_MAX_AGE, CART_COOKIE_NAME, CART_COOKIE_SALT
+
+
+class CartCookieMiddleware:
+    """Записывает или удаляет подписанную cookie корзины, если CookieCartStore ее изменил"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        value = getattr(request, 'cart_cookie', None)
+        if value is None:
+            return response
+        if value == '{}':
+            response.delete_cookie(CART_COOKIE_NAME)
+        else:
+            response.set_signed_cookie(CART_COOKIE_NAME, value, salt=CART_COOKIE_SALT,
+                                       max_age=CART_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+        return response
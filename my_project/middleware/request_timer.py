@@ -1,23 +1,78 @@
+import json
 import time
 from http.client import responses
 import logging
 
+from django.conf import settings
+from django.db import connection
+
 logger = logging.getLogger("api")
 
 
+class QueryCounter:
+    """execute_wrapper: считает SQL-запросы без DEBUG и connection.queries"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
 
 class RequestTimerMiddleware:
+    """
+    Время выполнения и число SQL-запросов на запрос.
+    REQUEST_DIAGNOSTICS_HEADERS = True добавляет их в ответ (X-Query-Count, Server-Timing)
+    для нагрузочного стенда; REQUEST_RECORD_PATH пишет журнал запросов в JSONL,
+    который затем проигрывает manage.py loadtest --replay.
+    """
+
+    # Тела запросов с этими префиксами пути не записываются (пароли, refresh-токены)
+    RECORD_SKIP_BODY_PATHS = ('/api/token/', '/api/register/', '/login/', '/register/')
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.diagnostics_headers = getattr(settings, 'REQUEST_DIAGNOSTICS_HEADERS', False)
+        self.record_path = getattr(settings, 'REQUEST_RECORD_PATH', None)
 
     def __call__(self, request):
         start_time = time.time()
         logger.info(f"Запрос пришел {request.path}")
-        response = self.get_response(request)
+        body = None
+        if self.record_path and request.content_type == 'application/json' and not request.path.startswith(self.RECORD_SKIP_BODY_PATHS):
+            body = request.body
+
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+
         logger.info(f"Ответ готов {response.status_code}")
         end_time = time.time()
         finish_time = end_time - start_time
-        logger.info(f'Время выполнения : {round(finish_time,3)}')
+        logger.info(f'Время выполнения : {round(finish_time,3)}, SQL-запросов: {queries.count}')
+
+        if self.diagnostics_headers:
+            response['X-Query-Count'] = str(queries.count)
+            response['Server-Timing'] = f'app;dur={finish_time * 1000:.1f}'
+        if self.record_path:
+            self.record(request, response, body, finish_time, queries.count)
         return response
 
+    def record(self, request, response, body, duration, query_count):
+        entry = {
+            'ts': round(time.time(), 3),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'ms': round(duration * 1000, 1),
+            'queries': query_count,
+            'auth': bool(getattr(request, 'user', None) and request.user.is_authenticated),
+        }
+        if body:
+            try:
+                entry['body'] = json.loads(body)
+            except ValueError:
+                pass
+        with open(self.record_path, 'a', encoding='utf-8') as log:
+            log.write(json.dumps(entry, ensure_ascii=False) + '\n')
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'myapp',
     'rest_framework',
     'api',
@@ -60,9 +61,18 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'my_project.middleware.request_timer.RequestTimerMiddleware'
+    'my_project.middleware.request_timer.RequestTimerMiddleware',
+    'my_project.middleware.cart_cookie.CartCookieMiddleware',
 ]
 
+# Корзина анонимного посетителя: 'cookie' (подписанная cookie) или 'session'
+CART_ANONYMOUS_STORAGE = 'cookie'
+
+# Сессии - в кэше с отложенной записью в БД (myapp/sessions.py); сообщения - только в cookie,
+# чтобы messages не переписывал сессию
+SESSION_ENGINE = 'myapp.sessions'
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
 ROOT_URLCONF = 'my_project.urls'
 
 TEMPLATES = [
@@ -75,6 +85,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'myapp.context_processors.cart_badge',
             ],
         },
     },
@@ -165,6 +176,10 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': True,
     'ALGORITHM': 'HS256',
+    # Имя, роли и эпоха в claims - для StatelessJWTAuthentication (api/authentication.py)
+    'TOKEN_OBTAIN_SERIALIZER': 'api.authentication.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.authentication.ClaimsTokenRefreshSerializer',
+    'TOKEN_USER_CLASS': 'api.authentication.StatelessUser',
 }
 
 # CACHES = {
@@ -187,13 +202,20 @@ SIMPLE_JWT = {
 #     }
 # }
 
+# Общий кэш веб-процессов и воркеров Celery: в нем сессии, очереди окон событий, роли и эпохи токенов.
+# Кэш в памяти процесса (LocMemCache) для этого не годится - у каждого процесса своя копия
 CACHES = {
     'default': {
-        'BACKEND': "django.core.cache.backends.locmem.LocMemCache",
+        'BACKEND': "django.core.cache.backends.redis.RedisCache",
+        'LOCATION': os.getenv('CACHE_URL', 'redis://localhost:6379/1'),
     }
 }
 
 LOG_DIR = os.path.join(BASE_DIR, "logs")
+
+# Диагностика запросов (my_project/middleware/request_timer.py), включается в settings_loadtest
+REQUEST_DIAGNOSTICS_HEADERS = False
+REQUEST_RECORD_PATH = None
 os.makedirs(LOG_DIR, exist_ok=True)
 
 LOGGING = {
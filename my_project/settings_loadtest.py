@@ -0,0 +1,26 @@
+"""
+Настройки локального сервера для нагрузочных прогонов (manage.py loadtest):
+внешние вызовы заглушены, в ответах есть число SQL-запросов и время обработки.
+
+    DJANGO_SETTINGS_MODULE=my_project.settings_loadtest python manage.py runserver --noreload
+"""
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+
+# Telegram: без токена outbox помечает уведомления как неотправленные без сетевых вызовов
+TELEGRAM_BOT_TOKEN = ''
+TELEGRAM_CHAT_ID = ''
+
+# SMTP не вызывается, задачи Celery выполняются в процессе без брокера
+EMAIL_BACKEND = 'django.core.mail.backends.dummy.EmailBackend'
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_BROKER_URL = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+# Один процесс runserver и задачи в нем же - кэш в памяти процесса достаточен
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+REQUEST_DIAGNOSTICS_HEADERS = True
+# Запись журнала для последующего --replay: REQUEST_RECORD_PATH=logs/requests.jsonl
+REQUEST_RECORD_PATH = os.environ.get('REQUEST_RECORD_PATH')
@@ -1,6 +1,9 @@
 from django.contrib import admin
+from django.contrib.postgres.search import SearchQuery
+from django.db.models import Q
 from django.utils.html import format_html
-from .models import Product, Category, ProductImage
+from .models import Product, Category, ProductImage, OutboxMessage, StockReservation
+from .search import SEARCH_CONFIG
 
 
 class ProductImageInline(admin.TabularInline):
@@ -18,13 +21,23 @@ class ProductImageInline(admin.TabularInline):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'in_stock', 'category', 'has_main_image')
+    list_display = ('name', 'price', 'in_stock', 'stock', 'category', 'has_main_image')
     list_filter = ('in_stock', 'category')
     search_fields = ('name', 'description')
     inlines = [ProductImageInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_images()
+
+    def get_search_results(self, request, queryset, search_term):
+        # Вместо ILIKE '%x%' по search_fields - полнотекстовый и триграммный поиск по индексам
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        query = SearchQuery(search_term, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(Q(search_vector=query) | Q(name__trigram_word_similar=search_term)), False
+
     def has_main_image(self, obj):
-        return obj.images.filter(is_main=True).exists()
+        return any(image.is_main for image in obj.images.all())
 
     has_main_image.boolean = True
     has_main_image.short_description = 'Главное фото'
@@ -50,4 +63,24 @@ class ProductImageAdmin(admin.ModelAdmin):
                                'border: 2px solid green;' if obj.is_main else '')
         return "Нет изображения"
 
-    image_preview.short_description = 'Превью'
\ No newline at end of file
+    image_preview.short_description = 'Превью'
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'available_at', 'created_at', 'sent_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('created_at', 'sent_at')
+    actions = ['retry']
+
+    @admin.action(description='Отправить повторно')
+    def retry(self, request, queryset):
+        from django.utils import timezone
+        queryset.exclude(status='sent').update(status='pending', attempts=0, available_at=timezone.now())
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    # Удаление резерва здесь возвращает товар на склад (сигнал post_delete)
+    list_display = ('cart', 'product', 'quantity', 'expires_at')
+    list_select_related = ('cart__user', 'product')
+    raw_id_fields = ('cart', 'product')
@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, OrderItem
+
+# Заказы в этих статусах больше не меняются - их можно убирать из горячих таблиц
+ARCHIVE_STATUSES = ('completed', 'cancelled')
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 1000
+
+ARCHIVED_ORDER_FIELDS = ['id', 'user_id', 'phone_number', 'customer_name', 'total_amount', 'status',
+                         'created_at', 'updated_at', 'archived_at', 'items']
+
+
+def archive_orders(before=None, statuses=ARCHIVE_STATUSES, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    """
+    Переносит заказы старше before (по умолчанию ARCHIVE_AFTER_DAYS дней) из Order/OrderItem
+    в ArchivedOrder пачками: каждая пачка - отдельная короткая транзакция
+    (SKIP LOCKED - не мешает заказам, которые сейчас меняются). Возвращает число заказов.
+    """
+    before = before or timezone.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    total = 0
+    while True:
+        with transaction.atomic():
+            orders = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(status__in=statuses, created_at__lt=before)
+                .order_by('id')[:batch_size]
+            )
+            if not orders:
+                break
+
+            items = {}
+            rows = (OrderItem.objects.filter(order__in=orders).order_by('id')
+                    .values_list('order_id', 'product_id', 'product__name', 'quantity', 'price'))
+            for order_id, product_id, name, quantity, price in rows:
+                items.setdefault(order_id, []).append(
+                    {'product_id': product_id, 'name': name, 'quantity': quantity, 'price': price}
+                )
+
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(id=order.id, user_id=order.user_id, phone_number=order.phone_number,
+                              customer_name=order.customer_name, total_amount=order.total_amount,
+                              status=order.status, created_at=order.created_at, updated_at=order.updated_at,
+                              items=items.get(order.id, []))
+                for order in orders
+            ])
+            OrderItem.objects.filter(order__in=orders).delete()
+            Order.objects.filter(id__in=[order.id for order in orders]).delete()
+
+        total += len(orders)
+        if progress:
+            progress(total)
+        if len(orders) < batch_size:
+            break
+    return total
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def archive_path(directory, month):
+    return os.path.join(directory, f'orders-{month:%Y-%m}.ndjson.gz')
+
+
+def export_archive(directory, before, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    """
+    Выгружает архивные заказы, созданные до начала месяца before, в сжатые файлы
+    orders-YYYY-MM.ndjson.gz (по строке JSON на заказ) и удаляет их из базы.
+    Файлы дописываются новыми gzip-членами, поэтому повторный запуск безопасен;
+    при сбое между записью и удалением пачка попадет в файл дважды (одинаковые id).
+    Возвращает число выгруженных заказов.
+    """
+    before = month_start(timezone.localtime(before))
+    os.makedirs(directory, exist_ok=True)
+    total = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                ArchivedOrder.objects.filter(created_at__lt=before)
+                .order_by('created_at', 'id').values(*ARCHIVED_ORDER_FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(month_start(timezone.localtime(row['created_at'])), []).append(row)
+            for month, month_rows in by_month.items():
+                with gzip.open(archive_path(directory, month), 'at', encoding='utf-8') as archive:
+                    for row in month_rows:
+                        archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+
+            ArchivedOrder.objects.filter(id__in=[row['id'] for row in rows]).delete()
+
+        total += len(rows)
+        if progress:
+            progress(total)
+        if len(rows) < batch_size:
+            break
+    return total
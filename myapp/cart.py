@@ -0,0 +1,361 @@
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .generations import CATALOG, versioned_key
+from .models import Cart, CartItem, Product
+
+CART_SESSION_KEY = 'cart'
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SALT = 'myapp.cart'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Подписанная cookie ограничена ~4 КБ: столько разных товаров в ней помещается с запасом
+CART_COOKIE_MAX_ITEMS = 100
+MAX_ITEM_QUANTITY = 999
+CART_SUMMARY_TIMEOUT = 60 * 60
+EMPTY_SUMMARY = {'items': 0, 'total_quantity': 0, 'total_price': Decimal('0.00')}
+
+
+def _normalize(raw):
+    """
+    {product_id: qty} из хранилища. Старый формат сессии - список id,
+    где товар повторяется по числу единиц - переводится в словарь.
+    """
+    items = {}
+    if isinstance(raw, list):
+        for product_id in raw:
+            items[int(product_id)] = items.get(int(product_id), 0) + 1
+    elif isinstance(raw, dict):
+        for product_id, quantity in raw.items():
+            try:
+                product_id, quantity = int(product_id), int(quantity)
+            except (TypeError, ValueError):
+                continue
+            if quantity > 0:
+                items[product_id] = min(quantity, MAX_ITEM_QUANTITY)
+    return items
+
+
+class BaseCartStore:
+    """Корзина как {product_id: qty}; хранилище определяется подклассом"""
+
+    def items(self):
+        raise NotImplementedError
+
+    def add(self, product_id, quantity=1):
+        raise NotImplementedError
+
+    def remove(self, product_id, quantity=1):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    @property
+    def total_quantity(self):
+        # Корзина в сессии/cookie уже в памяти - считать нечего
+        return sum(self.items().values())
+
+    def __bool__(self):
+        return bool(self.items())
+
+
+class DictCartStore(BaseCartStore):
+    """Общая логика для сессии и cookie: словарь целиком в памяти, запись одним значением"""
+
+    def __init__(self, request):
+        self.request = request
+        self._items = _normalize(self.load())
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self):
+        raise NotImplementedError
+
+    def items(self):
+        return dict(self._items)
+
+    def add(self, product_id, quantity=1):
+        self._items[product_id] = min(self._items.get(product_id, 0) + quantity, MAX_ITEM_QUANTITY)
+        self.save()
+
+    def remove(self, product_id, quantity=1):
+        if product_id not in self._items:
+            return False
+        self._items[product_id] -= quantity
+        if self._items[product_id] <= 0:
+            del self._items[product_id]
+        self.save()
+        return True
+
+    def clear(self):
+        self._items = {}
+        self.save()
+
+
+class SessionCartStore(DictCartStore):
+    def load(self):
+        return self.request.session.get(CART_SESSION_KEY)
+
+    def save(self):
+        # Ключи JSON-сессии - строки; храним только {id: qty}, без повторов
+        if self._items:
+            self.request.session[CART_SESSION_KEY] = {str(k): v for k, v in self._items.items()}
+        else:
+            self.request.session.pop(CART_SESSION_KEY, None)
+
+
+class CookieCartStore(DictCartStore):
+    """
+    Корзина анонимного посетителя в подписанной cookie: ни строки сессии в БД,
+    ни записи на сервере. Cookie выставляет CartCookieMiddleware по request.cart_cookie.
+    """
+
+    def load(self):
+        value = self.request.get_signed_cookie(CART_COOKIE_NAME, default=None, salt=CART_COOKIE_SALT,
+                                               max_age=CART_COOKIE_MAX_AGE)
+        try:
+            return json.loads(value) if value else None
+        except ValueError:
+            return None
+
+    def add(self, product_id, quantity=1):
+        if product_id not in self._items and len(self._items) >= CART_COOKIE_MAX_ITEMS:
+            return
+        super().add(product_id, quantity)
+
+    def save(self):
+        self.request.cart_cookie = json.dumps({str(k): v for k, v in self._items.items()}, separators=(',', ':'))
+
+
+class DBCartStore(BaseCartStore):
+    """Корзина пользователя в Cart/CartItem - та же, что у API"""
+
+    def __init__(self, user):
+        self.user = user
+
+    def _cart_id(self, create=True):
+        return user_cart_id(self.user, create)
+
+    def items(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def add(self, product_id, quantity=1):
+        upsert_cart_items(self._cart_id(), {product_id: quantity})
+
+    def remove(self, product_id, quantity=1):
+        cart_id = self._cart_id(create=False)
+        return bool(cart_id and remove_cart_items(cart_id, {product_id: quantity}))
+
+    def clear(self):
+        cart_id = self._cart_id(create=False)
+        if cart_id:
+            clear_cart(cart_id)
+
+    @property
+    def summary(self):
+        return cart_summary(self._cart_id(create=False))
+
+    @property
+    def total_quantity(self):
+        return self.summary['total_quantity']
+
+
+def _upsert(cart_id, items, on_conflict):
+    # Позиция с нулевым или отрицательным количеством не создается и не меняется
+    items = {product_id: quantity for product_id, quantity in items.items() if quantity > 0}
+    if not items:
+        return set()
+    table = CartItem._meta.db_table
+    product_table = Product._meta.db_table
+    product_ids, quantities = zip(*items.items())
+    with connection.cursor() as cursor:
+        # JOIN с товарами отбрасывает несуществующие id вместо ошибки внешнего ключа
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (cart_id, product_id, quantity, added_at)
+            SELECT %s, p.id, LEAST(rows.quantity, %s), %s
+            FROM unnest(%s::bigint[], %s::integer[]) AS rows(product_id, quantity)
+            JOIN {product_table} p ON p.id = rows.product_id
+            ON CONFLICT (cart_id, product_id)
+            DO UPDATE SET quantity = {on_conflict.format(table=table)}
+            RETURNING product_id
+            """,
+            [cart_id, MAX_ITEM_QUANTITY, timezone.now(), list(product_ids), list(quantities), MAX_ITEM_QUANTITY],
+        )
+        applied = {row[0] for row in cursor.fetchall()}
+    # Сырой SQL не шлет сигналов - сбрасываем итоги явно
+    invalidate_cart_summary(cart_id)
+    return applied
+
+
+def upsert_cart_items(cart_id, items):
+    """
+    Прибавляет количества к позициям корзины одним INSERT ... ON CONFLICT
+    по уникальному (cart, product): и новые, и существующие позиции за один запрос,
+    без чтения и потерянных обновлений при параллельных нажатиях.
+    Возвращает id товаров, которые действительно существуют и добавлены.
+    """
+    return _upsert(cart_id, items, 'LEAST({table}.quantity + EXCLUDED.quantity, %s)')
+
+
+def set_cart_items(cart_id, items):
+    """Устанавливает количества; 0 удаляет позицию"""
+    to_delete = [product_id for product_id, quantity in items.items() if quantity <= 0]
+    applied = _upsert(cart_id, {k: v for k, v in items.items() if v > 0}, 'LEAST(EXCLUDED.quantity, %s)')
+    if to_delete:
+        _delete_items(cart_id, to_delete)
+        applied.update(to_delete)
+    return applied
+
+
+def remove_cart_items(cart_id, items):
+    """
+    Уменьшает количества одним запросом: позиции, где остаток <= 0, удаляются,
+    остальные уменьшаются. Возвращает {product_id: 'deleted' | 'updated'}.
+    """
+    if not items:
+        return {}
+    table = CartItem._meta.db_table
+    product_ids, quantities = zip(*items.items())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH rows(product_id, quantity) AS (
+                SELECT * FROM unnest(%s::bigint[], %s::integer[])
+            ), deleted AS (
+                DELETE FROM {table} item USING rows
+                WHERE item.cart_id = %s AND item.product_id = rows.product_id AND item.quantity <= rows.quantity
+                RETURNING item.product_id
+            ), updated AS (
+                UPDATE {table} item SET quantity = item.quantity - rows.quantity FROM rows
+                WHERE item.cart_id = %s AND item.product_id = rows.product_id AND item.quantity > rows.quantity
+                RETURNING item.product_id
+            )
+            SELECT product_id, 'deleted' FROM deleted
+            UNION ALL
+            SELECT product_id, 'updated' FROM updated
+            """,
+            [list(product_ids), list(quantities), cart_id, cart_id],
+        )
+        result = dict(cursor.fetchall())
+    invalidate_cart_summary(cart_id)
+    return result
+
+
+def _delete_items(cart_id, product_ids=None):
+    # Один DELETE: QuerySet.delete() из-за подписчиков post_delete сначала выбирает строки
+    table = CartItem._meta.db_table
+    sql, params = f'DELETE FROM {table} WHERE cart_id = %s', [cart_id]
+    if product_ids is not None:
+        sql, params = sql + ' AND product_id = ANY(%s::bigint[])', params + [list(product_ids)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+    invalidate_cart_summary(cart_id)
+
+
+def clear_cart(cart_id):
+    _delete_items(cart_id)
+
+
+CART_OPERATIONS = {'add': upsert_cart_items, 'set': set_cart_items, 'remove': remove_cart_items}
+
+
+def apply_cart_operations(cart_id, operations, clear=False):
+    """
+    Пакет операций [{'op': 'add'|'remove'|'set', 'product_id', 'quantity'}] в исходном порядке.
+    Подряд идущие операции одного типа сливаются в один запрос: пакет из одних
+    add (повтор заказа, набор товаров) - один INSERT ... ON CONFLICT.
+    Вызывать внутри transaction.atomic().
+    """
+    if clear:
+        clear_cart(cart_id)
+
+    run_op, run = None, {}
+    for operation in [*operations, {'op': None}]:
+        op = operation['op']
+        if op != run_op and run:
+            CART_OPERATIONS[run_op](cart_id, run)
+            run = {}
+        run_op = op
+        if op is None:
+            break
+        product_id, quantity = operation['product_id'], operation['quantity']
+        if op == 'set':
+            run[product_id] = quantity
+        else:
+            run[product_id] = run.get(product_id, 0) + quantity
+
+
+def user_cart_id(user, create=True):
+    """id корзины пользователя; корзина создается при первом обращении"""
+    cart_id = Cart.objects.filter(user_id=user.pk).values_list('id', flat=True).first()
+    if cart_id is None and create:
+        cart_id = Cart.objects.get_or_create(user_id=user.pk)[0].id
+    return cart_id
+
+
+def _summary_key(cart_id):
+    # Поколение каталога в ключе: смена цены или скидки товара делает итоги всех корзин устаревшими
+    return versioned_key(CATALOG, 'cart_summary', cart_id)
+
+
+def cart_summary(cart_id):
+    """
+    {'items', 'total_quantity', 'total_price'} корзины: из кэша, иначе одним
+    агрегатным запросом. Стоимость не зависит от числа позиций.
+    """
+    if cart_id is None:
+        return dict(EMPTY_SUMMARY)
+    key = _summary_key(cart_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = CartItem.objects.filter(cart_id=cart_id).summary()
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_cart_summary(cart_id):
+    # Сразу - для чтения в той же транзакции, после коммита - от гонки с параллельным чтением
+    key = _summary_key(cart_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def anonymous_store(request):
+    if getattr(settings, 'CART_ANONYMOUS_STORAGE', 'cookie') == 'session':
+        return SessionCartStore(request)
+    return CookieCartStore(request)
+
+
+def get_cart(request):
+    """Вошедший пользователь - корзина в БД (общая с API), аноним - сессия или подписанная cookie"""
+    if request.user.is_authenticated:
+        # Корзина, оставшаяся в сессии или cookie (вход до появления слияния), переносится при первом обращении
+        if CART_SESSION_KEY in request.session or CART_COOKIE_NAME in request.COOKIES:
+            merge_anonymous_cart(request, request.user)
+        return DBCartStore(request.user)
+    return anonymous_store(request)
+
+
+def merge_anonymous_cart(request, user):
+    """
+    При входе переносит корзину из сессии и cookie в Cart пользователя
+    одним upsert и очищает анонимные хранилища.
+    """
+    items = {}
+    for store in (SessionCartStore(request), CookieCartStore(request)):
+        for product_id, quantity in store.items().items():
+            items[product_id] = items.get(product_id, 0) + quantity
+        if store:
+            store.clear()
+
+    if items:
+        cart, _ = Cart.objects.get_or_create(user=user)
+        upsert_cart_items(cart.id, items)
+    return items
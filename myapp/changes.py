@@ -0,0 +1,125 @@
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Product, ProductChange
+
+CHANGES_PAGE_SIZE = 100
+CHANGES_MAX_PAGE_SIZE = 1000
+# Сколько дней хранится журнал; потребитель, отставший сильнее, перечитывает каталог целиком
+CHANGES_RETENTION_DAYS = 30
+MAX_ID = 2 ** 63 - 1
+
+TRIGGER_FUNCTION = 'myapp_product_change'
+# Поля карточки в ленте: их смена пишется в журнал, даже если updated_at не сдвинут
+# (queryset.update(), сырой SQL). Остатка здесь нет - в ленту он не входит, а переход
+# через ноль виден по in_stock
+CHANGE_FIELDS = ('sku', 'name', 'description', 'price', 'discount_percent', 'in_stock', 'category')
+
+
+def install_change_trigger(using=DEFAULT_DB_ALIAS):
+    """
+    Триггер журнала изменений товаров. Пишет строку на INSERT, на UPDATE со сдвигом
+    updated_at (любое сохранение модели, импорт, смена изображений) или со сменой полей
+    CHANGE_FIELDS (queryset.update() и сырой SQL updated_at не трогают) и надгробие на DELETE.
+    Списание остатка без смены наличия и пересчет поискового вектора журнал не засоряют.
+    Вызывается после migrate (signals.py), идемпотентен.
+    """
+    product = Product._meta.db_table
+    change = ProductChange._meta.db_table
+    changed = ' OR '.join(
+        f'OLD.{column} IS DISTINCT FROM NEW.{column}'
+        for column in ['updated_at', *(Product._meta.get_field(field).column for field in CHANGE_FIELDS)]
+    )
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {TRIGGER_FUNCTION}() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO {change} (product_id, action, changed_at, txid)
+                VALUES (
+                    CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END,
+                    CASE TG_OP WHEN 'INSERT' THEN 'created' WHEN 'UPDATE' THEN 'updated' ELSE 'deleted' END,
+                    clock_timestamp(),
+                    pg_current_xact_id()::text::bigint
+                );
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute(f'DROP TRIGGER IF EXISTS {TRIGGER_FUNCTION} ON {product}')
+        cursor.execute(f'DROP TRIGGER IF EXISTS {TRIGGER_FUNCTION}_update ON {product}')
+        cursor.execute(f"""
+            CREATE TRIGGER {TRIGGER_FUNCTION} AFTER INSERT OR DELETE ON {product}
+            FOR EACH ROW EXECUTE FUNCTION {TRIGGER_FUNCTION}()
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER {TRIGGER_FUNCTION}_update AFTER UPDATE ON {product}
+            FOR EACH ROW WHEN ({changed})
+            EXECUTE FUNCTION {TRIGGER_FUNCTION}()
+        """)
+
+
+def encode_change_cursor(txid, change_id):
+    return f'{txid}.{change_id}'
+
+
+def decode_change_cursor(cursor):
+    """(txid, id) или None для пустого курсора; битый курсор - ValueError"""
+    if not cursor:
+        return None
+    txid, change_id = cursor.split('.')
+    return int(txid), int(change_id)
+
+
+def _visible_horizon():
+    """
+    Самая старая еще не завершенная транзакция. Все транзакции с меньшим номером
+    уже закоммичены или откатились, поэтому строки с txid ниже горизонта больше не появятся.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+        return cursor.fetchone()[0]
+
+
+def current_change_cursor():
+    """Курсор "сейчас": с него начинает потребитель, только что прочитавший каталог целиком"""
+    return encode_change_cursor(_visible_horizon() - 1, MAX_ID)
+
+
+def changes_since(cursor=None, limit=CHANGES_PAGE_SIZE):
+    """
+    Страница журнала после курсора в порядке (txid, id).
+    Порядок по одному id ненадежен: номер из последовательности берется до коммита,
+    и долгая транзакция может закоммитить меньший id уже после того, как потребитель
+    ушел дальше. Поэтому отдаются только строки транзакций ниже горизонта
+    _visible_horizon(), а курсор - пара (txid, id).
+    Возвращает (изменения, следующий курсор, есть ли еще).
+    """
+    position = decode_change_cursor(cursor)
+    horizon = _visible_horizon()
+    changes = ProductChange.objects.filter(txid__lt=horizon)
+    if position:
+        txid, change_id = position
+        changes = changes.filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=change_id))
+    rows = list(changes.order_by('txid', 'id')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_change_cursor(rows[-1].txid, rows[-1].id) if rows else cursor
+    return rows, next_cursor, has_more
+
+
+def change_counts(since):
+    """Сколько товаров создано, изменено и удалено с момента since: {action: число товаров}"""
+    return dict(
+        ProductChange.objects.filter(changed_at__gte=since)
+        .values('action').annotate(products=Count('product_id', distinct=True))
+        .values_list('action', 'products')
+    )
+
+
+def purge_product_changes(days=CHANGES_RETENTION_DAYS):
+    """Удаляет записи журнала старше days дней. Возвращает число удаленных"""
+    deleted, _ = ProductChange.objects.filter(changed_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
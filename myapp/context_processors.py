@@ -0,0 +1,18 @@
+from django.utils.functional import cached_property
+
+from .cart import get_cart
+
+
+class CartBadge:
+    """Счетчик корзины в шапке; считается, только если шаблон к нему обратился"""
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def total_quantity(self):
+        return get_cart(self.request).total_quantity
+
+
+def cart_badge(request):
+    return {'cart_badge': CartBadge(request)}
@@ -0,0 +1,319 @@
+import io
+import logging
+import random
+import time
+from array import array
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .facets import invalidate_facets
+from .generations import CATALOG, bump_generation
+from .models import Cart, CartItem, Category, Order, OrderItem, Product, ProductImage
+from .search import refresh_search_vector
+
+logger = logging.getLogger("api")
+
+COPY_BATCH_SIZE = 20000
+
+# Пресеты размеров: товары, пользователи, заказы, категории
+SCALES = {
+    '10k': {'products': 10_000, 'users': 1_000, 'orders': 5_000, 'categories': 20},
+    '1m': {'products': 1_000_000, 'users': 100_000, 'orders': 500_000, 'categories': 200},
+    '10m': {'products': 10_000_000, 'users': 1_000_000, 'orders': 5_000_000, 'categories': 1000},
+}
+
+# Степень перекоса: индекс = n * random() ** power. При 3 на 1% самых
+# популярных товаров приходится ~20% позиций корзин и заказов.
+HOT_PRODUCT_POWER = 3.0
+POWER_USER_POWER = 2.0
+
+BRANDS = ['Asus', 'Lenovo', 'HP', 'Dell', 'Apple', 'Samsung', 'Xiaomi', 'Sony', 'Huawei', 'Anker']
+MODELS = ['Ultra', 'Pro', 'Air', 'Max', 'Lite', 'Plus', 'Gaming', 'Studio', 'Mini', 'Elite']
+DESCRIPTIONS = [
+    'Высокое качество сборки и современный дизайн.',
+    'Продолжительное время работы от аккумулятора.',
+    'Энергоэффективность и простота в использовании.',
+    'Гарантия производителя, экологичные материалы.',
+]
+CUSTOMER_NAMES = ['Иван', 'Мария', 'Алексей', 'Ольга', 'Дмитрий', 'Анна', 'Сергей', 'Елена', '']
+ORDER_STATUSES = (['completed', 'processing', 'new', 'cancelled'], [70, 10, 15, 5])
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def copy_rows(model, fields, rows):
+    """
+    Загружает кортежи через COPY FROM STDIN (текстовый формат).
+    Ни save(), ни сигналы не вызываются; значения auto_now должны быть в строках.
+    """
+    table = model._meta.db_table
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(f).column) for f in fields)
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(map(_copy_value, row)))
+        buffer.write('\n')
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN', buffer)
+
+
+def next_id(model):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {model._meta.db_table}')
+        return cursor.fetchone()[0]
+
+
+def sync_sequence(model):
+    """После COPY с явными id сдвигаем identity-последовательность за максимум"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT MAX(id) FROM {table}))", [table]
+        )
+
+
+class DatasetGenerator:
+    """
+    Детерминированный по seed синтетический набор данных: категории, товары с
+    метаданными изображений, пользователи, корзины, заказы и позиции заказов.
+    Популярность товаров и активность пользователей распределены по степенному
+    закону (горячие SKU, активные покупатели).
+
+    Строки пишутся пачками через COPY с явными id, поэтому генератор рассчитан
+    на отдельную базу для нагрузочных тестов без параллельной записи.
+    """
+
+    def __init__(self, products, users, orders, categories, seed=0, days=365, end_date=None,
+                 batch_size=COPY_BATCH_SIZE, progress=None):
+        self.counts = {'products': products, 'users': users, 'orders': orders, 'categories': categories}
+        self.seed = seed
+        self.days = days
+        self.batch_size = batch_size
+        self.progress = progress
+        end_date = end_date or timezone.localdate()
+        self.end = timezone.make_aware(datetime.combine(end_date, dt_time.min))
+        self.stats = {}
+
+    def _rng(self, table):
+        # У каждой таблицы свой поток случайных чисел: состав одной таблицы
+        # не зависит от размеров остальных
+        return random.Random(f'{self.seed}:{table}')
+
+    @staticmethod
+    def skewed(rng, n, power):
+        return min(int(n * rng.random() ** power), n - 1)
+
+    def _moment(self, rng):
+        return self.end - timedelta(seconds=rng.randrange(self.days * 86400))
+
+    def _batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _load(self, model, fields, rows):
+        started = time.perf_counter()
+        total = 0
+        for batch in self._batches(rows):
+            with transaction.atomic():
+                copy_rows(model, fields, batch)
+            total += len(batch)
+            if self.progress:
+                self.progress(model.__name__, total)
+        sync_sequence(model)
+        elapsed = time.perf_counter() - started
+        self.stats[model.__name__] = {'rows': total, 'seconds': round(elapsed, 2)}
+        return total
+
+    # --- строки таблиц ---
+
+    def category_rows(self):
+        now = self.end
+        for i in range(self.counts['categories']):
+            yield self.category_base + i, f'Категория {self.seed}-{i}', now
+
+    def product_rows(self):
+        rng = self._rng('products')
+        self.prices = array('I')  # цена в копейках по индексу товара, для позиций заказов
+        categories = self.counts['categories']
+        for i in range(self.counts['products']):
+            price_cents = int(rng.lognormvariate(9.5, 1.0)) + 100
+            self.prices.append(price_cents)
+            name = f'{rng.choice(BRANDS)} {rng.choice(MODELS)} {i}'
+            category = self.category_base + self.skewed(rng, categories, 1.5)
+            discount = rng.choice((0, 0, 0, 0, 5, 10, 15, 20, 30, 50))
+            description = rng.choice(DESCRIPTIONS)
+            stock = rng.randint(1, 500) if rng.random() < 0.8 else 0
+            yield (
+                self.product_base + i, name, description, Decimal(price_cents) / 100,
+                stock > 0, stock, category, discount, f'GEN{self.seed}-{i}', '', self.end, self.end,
+            )
+
+    def image_rows(self):
+        rng = self._rng('images')
+        pk = self.image_base
+        for i in range(self.counts['products']):
+            for order in range(rng.choice((0, 1, 1, 2, 3, 4))):
+                yield pk, self.product_base + i, f'product_images/gen/{self.seed}/{i}_{order}.jpg', order == 0, order
+                pk += 1
+
+    def user_rows(self):
+        rng = self._rng('users')
+        password = make_password('password')
+        for i in range(self.counts['users']):
+            username = f'gen{self.seed}_user{i}'
+            yield (
+                self.user_base + i, username, password, f'{username}@example.com', '', '',
+                False, False, True, self._moment(rng),
+            )
+
+    def cart_rows(self):
+        # Корзина есть примерно у трети пользователей
+        rng = self._rng('carts')
+        self.cart_owners = [i for i in range(self.counts['users']) if rng.random() < 0.3]
+        for n, user in enumerate(self.cart_owners):
+            moment = self._moment(rng)
+            yield self.cart_base + n, self.user_base + user, moment, moment
+
+    def cart_item_rows(self):
+        rng = self._rng('cart_items')
+        pk = self.cart_item_base
+        for n in range(len(self.cart_owners)):
+            products = {self._hot_product(rng) for _ in range(rng.randint(1, 5))}
+            for product in sorted(products):
+                yield pk, self.cart_base + n, self.product_base + product, rng.randint(1, 3), self.end
+                pk += 1
+
+    def _hot_product(self, rng):
+        index = self.skewed(rng, self.counts['products'], HOT_PRODUCT_POWER)
+        # Разносим горячие товары по всему диапазону id и категориям
+        n = self.counts['products']
+        return (index * 1_000_003) % n if n % 1_000_003 else index
+
+    def order_rows(self):
+        """Заказы и позиции генерируются вместе: сумма заказа равна сумме позиций"""
+        rng = self._rng('orders')
+        statuses, weights = ORDER_STATUSES
+        self.order_items = []
+        item_pk = self.order_item_base
+        for i in range(self.counts['orders']):
+            user = self.skewed(rng, self.counts['users'], POWER_USER_POWER)
+            moment = self._moment(rng)
+            total = 0
+            for product in sorted({self._hot_product(rng) for _ in range(rng.randint(1, 5))}):
+                quantity = rng.choice((1, 1, 1, 2, 3))
+                price = self.prices[product]
+                total += price * quantity
+                self.order_items.append(
+                    (item_pk, self.order_base + i, self.product_base + product, quantity, Decimal(price) / 100)
+                )
+                item_pk += 1
+            yield (
+                self.order_base + i, self.user_base + user, f'+7900{rng.randrange(10**7):07d}',
+                rng.choice(CUSTOMER_NAMES), Decimal(total) / 100,
+                rng.choices(statuses, weights)[0], moment, moment,
+            )
+
+    def _drain_order_items(self):
+        items, self.order_items = self.order_items, []
+        return items
+
+    # --- загрузка ---
+
+    def _order_rows_with_items(self):
+        # Позиции пишутся после каждой пачки заказов, чтобы память не росла с числом заказов
+        for batch in self._batches(self.order_rows()):
+            with transaction.atomic():
+                copy_rows(Order, ORDER_FIELDS, batch)
+                copy_rows(OrderItem, ORDER_ITEM_FIELDS, self._drain_order_items())
+            yield len(batch)
+
+    def run(self):
+        started = time.perf_counter()
+        if not self.counts['products'] or not self.counts['categories']:
+            raise ValueError('Нужны хотя бы одна категория и один товар')
+
+        self.category_base = next_id(Category)
+        self._load(Category, CATEGORY_FIELDS, self.category_rows())
+
+        self.product_base = next_id(Product)
+        self._load(Product, PRODUCT_FIELDS, self.product_rows())
+        self.image_base = next_id(ProductImage)
+        self._load(ProductImage, IMAGE_FIELDS, self.image_rows())
+
+        if self.counts['users']:
+            self.user_base = next_id(User)
+            self._load(User, USER_FIELDS, self.user_rows())
+            self.cart_base = next_id(Cart)
+            self._load(Cart, CART_FIELDS, self.cart_rows())
+            self.cart_item_base = next_id(CartItem)
+            self._load(CartItem, CART_ITEM_FIELDS, self.cart_item_rows())
+
+            self.order_base = next_id(Order)
+            self.order_item_base = next_id(OrderItem)
+            order_started = time.perf_counter()
+            total = 0
+            for count in self._order_rows_with_items():
+                total += count
+                if self.progress:
+                    self.progress(Order.__name__, total)
+            sync_sequence(Order)
+            sync_sequence(OrderItem)
+            self.stats[Order.__name__] = {'rows': total, 'seconds': round(time.perf_counter() - order_started, 2)}
+            self.stats[OrderItem.__name__] = {'rows': OrderItem.objects.filter(order_id__gte=self.order_base).count()}
+
+        self._finish()
+        self.stats['seconds'] = round(time.perf_counter() - started, 2)
+        logger.info(f"Синтетический набор (seed={self.seed}): {self.stats}")
+        return self.stats
+
+    def _finish(self):
+        # Поисковый вектор пересчитываем диапазонами id, затем обновляем статистику планировщика
+        last = self.product_base + self.counts['products']
+        for start in range(self.product_base, last, self.batch_size):
+            refresh_search_vector(Product.objects.filter(id__gte=start, id__lt=min(start + self.batch_size, last)))
+
+        with connection.cursor() as cursor:
+            for model in (Category, Product, ProductImage, User, Cart, CartItem, Order, OrderItem):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+        bump_generation(CATALOG)
+        transaction.on_commit(invalidate_facets)
+
+
+CATEGORY_FIELDS = ['id', 'name', 'updated_at']
+PRODUCT_FIELDS = ['id', 'name', 'description', 'price', 'in_stock', 'stock', 'category', 'discount_percent', 'sku',
+                  'content_hash', 'updated_at', 'created_at']
+IMAGE_FIELDS = ['id', 'product', 'image', 'is_main', 'order']
+USER_FIELDS = ['id', 'username', 'password', 'email', 'first_name', 'last_name', 'is_staff', 'is_superuser',
+               'is_active', 'date_joined']
+CART_FIELDS = ['id', 'user', 'created_at', 'updated_at']
+CART_ITEM_FIELDS = ['id', 'cart', 'product', 'quantity', 'added_at']
+ORDER_FIELDS = ['id', 'user', 'phone_number', 'customer_name', 'total_amount', 'status', 'created_at',
+                'updated_at']
+ORDER_ITEM_FIELDS = ['id', 'order', 'product', 'quantity', 'price']
+
+
+def generate_dataset(scale=None, seed=0, progress=None, **counts):
+    """Размеры берутся из пресета scale и переопределяются явными counts"""
+    sizes = dict(SCALES[scale or '10k'])
+    sizes.update({key: value for key, value in counts.items() if value is not None})
+    return DatasetGenerator(seed=seed, progress=progress, **sizes).run()
@@ -0,0 +1,92 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .generations import cache_is_shared
+from .tasks import DIGEST_MAX_LISTED, flush_product_events, send_new_products_digest
+
+# Окно, за которое одиночные создания товаров собираются в одно письмо
+PRODUCT_EVENT_WINDOW = 30
+
+_bulk_batch = ContextVar('product_events_bulk', default=None)
+
+
+def product_payload(product, created_by="Система"):
+    """JSON-совместимое описание товара для задач Celery"""
+    return {
+        'product_id': product.id,
+        'product_name': product.name,
+        'product_price': str(product.price),
+        'created_by': created_by,
+    }
+
+
+def in_bulk():
+    return _bulk_batch.get() is not None
+
+
+@contextmanager
+def bulk_product_events():
+    """
+    Массовые операции: внутри блока сигналы не ставят задач на каждую строку,
+    по выходу отправляется одно событие со всей пачкой (после коммита).
+
+        with bulk_product_events():
+            for row in rows:
+                Product.objects.create(**row)
+    """
+    batch = []
+    token = _bulk_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _bulk_batch.reset(token)
+    emit_products_created(batch, len(batch))
+
+
+def emit_products_created(payloads, total=None):
+    """
+    Одно событие на пачку созданных товаров. В задачу уходят только первые
+    DIGEST_MAX_LISTED описаний и общее число - сообщение Celery не растет с пачкой.
+    """
+    total = total or len(payloads)
+    payloads = list(payloads[:DIGEST_MAX_LISTED])
+    if payloads:
+        transaction.on_commit(lambda: send_new_products_digest.delay(products=payloads, total=total))
+
+
+def product_created(payload):
+    batch = _bulk_batch.get()
+    if batch is not None:
+        batch.append(payload)
+        return
+    if not cache_is_shared():
+        # Окно в кэше процесса не увидит воркер, выполняющий flush_product_events - письмо сразу
+        transaction.on_commit(lambda: send_new_products_digest.delay(products=[payload]))
+        return
+    transaction.on_commit(lambda: _enqueue(payload))
+
+
+def window_prefix(window):
+    return f'product_events:{window}'
+
+
+def _enqueue(payload):
+    """
+    Одиночные создания копятся в кэше по окнам времени; первое событие окна
+    планирует единственную задачу-дайджест на его конец.
+    """
+    window = int(time.time() // PRODUCT_EVENT_WINDOW)
+    prefix = window_prefix(window)
+    ttl = PRODUCT_EVENT_WINDOW * 10
+
+    cache.add(f'{prefix}:count', 0, ttl)
+    index = cache.incr(f'{prefix}:count')
+    cache.set(f'{prefix}:{index}', payload, ttl)
+
+    if cache.add(f'{prefix}:scheduled', True, ttl):
+        countdown = (window + 1) * PRODUCT_EVENT_WINDOW - time.time() + 1
+        flush_product_events.apply_async(args=[window], countdown=max(countdown, 0))
@@ -0,0 +1,87 @@
+import csv
+import json
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import OrderItem, Product
+
+# Сколько строк за раз забирать с серверного курсора PostgreSQL
+EXPORT_CHUNK_SIZE = 2000
+
+PRODUCT_EXPORT_FIELDS = ['id', 'name', 'category', 'price', 'discount_percent', 'effective_price', 'in_stock']
+ORDER_EXPORT_FIELDS = [
+    'order_id', 'created_at', 'status', 'user_id', 'phone_number', 'customer_name', 'total_amount',
+    'product_id', 'product_name', 'quantity', 'price', 'line_total',
+]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def effective_price(price, discount_percent):
+    """Цена с учетом скидки, округленная до копеек"""
+    if not discount_percent:
+        return price
+    return (price * (100 - discount_percent) / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def product_rows(queryset=None):
+    """Товары с названием категории и ценой со скидкой; память не растет с размером таблицы"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    rows = (queryset.order_by('id')
+            .values_list('id', 'name', 'category__name', 'price', 'discount_percent', 'in_stock')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    for pk, name, category, price, discount, in_stock in rows:
+        yield {
+            'id': pk,
+            'name': name,
+            'category': category,
+            'price': price,
+            'discount_percent': discount,
+            'effective_price': effective_price(price, discount),
+            'in_stock': in_stock,
+        }
+
+
+def order_rows(queryset=None):
+    """Строки заказов: по одной на OrderItem с данными заказа"""
+    if queryset is None:
+        queryset = OrderItem.objects.all()
+    rows = (queryset.order_by('order_id', 'id')
+            .values_list('order_id', 'order__created_at', 'order__status', 'order__user_id',
+                         'order__phone_number', 'order__customer_name', 'order__total_amount',
+                         'product_id', 'product__name', 'quantity', 'price')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    for row in rows:
+        item = dict(zip(ORDER_EXPORT_FIELDS, row))
+        item['line_total'] = item['price'] * item['quantity']
+        yield item
+
+
+class _Echo:
+    """Файлоподобный объект для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+def stream_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def stream_export(rows, fields, export_format):
+    if export_format == 'csv':
+        return stream_csv(rows, fields)
+    return stream_ndjson(rows)
@@ -0,0 +1,234 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .models import Category, Product
+
+# Границы корзин гистограммы цен: [0, 50), [50, 100), ... [5000, +inf)
+PRICE_BUCKET_EDGES = [Decimal(edge) for edge in (0, 50, 100, 500, 1000, 2000, 5000)]
+
+FACETS_CACHE_KEY = 'product_facets_cube'
+# Инкрементальные обновления не атомарны между процессами и не видят queryset.update(),
+# поэтому куб периодически пересобирается целиком
+FACETS_CACHE_TIMEOUT = 60 * 10
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+def _parse_bool(value):
+    if value is None or value == '':
+        return None
+    value = str(value).lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return None
+
+
+def _parse_decimal(value):
+    if value in (None, ''):
+        return None
+    try:
+        value = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    # NaN и Infinity Decimal принимает, а фильтр по полю цены - нет
+    return value if value.is_finite() else None
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_filters(params):
+    """Фильтры каталога из GET-параметров: category, price_min, price_max, in_stock, has_discount"""
+    return {
+        'category': _parse_int(params.get('category')),
+        'price_min': _parse_decimal(params.get('price_min')),
+        'price_max': _parse_decimal(params.get('price_max')),
+        'in_stock': _parse_bool(params.get('in_stock')),
+        'has_discount': _parse_bool(params.get('has_discount')),
+    }
+
+
+def apply_filters(queryset, filters):
+    if filters['category'] is not None:
+        queryset = queryset.filter(category_id=filters['category'])
+    if filters['price_min'] is not None:
+        queryset = queryset.filter(price__gte=filters['price_min'])
+    if filters['price_max'] is not None:
+        queryset = queryset.filter(price__lt=filters['price_max'])
+    if filters['in_stock'] is not None:
+        queryset = queryset.filter(in_stock=filters['in_stock'])
+    if filters['has_discount'] is True:
+        queryset = queryset.filter(discount_percent__gt=0)
+    elif filters['has_discount'] is False:
+        queryset = queryset.filter(discount_percent=0)
+    return queryset
+
+
+def price_bucket(price):
+    """Индекс корзины гистограммы для цены"""
+    index = 0
+    for i, edge in enumerate(PRICE_BUCKET_EDGES):
+        if price >= edge:
+            index = i
+    return index
+
+
+def cell_key(category_id, in_stock, discount_percent, price):
+    return category_id, bool(in_stock), int(discount_percent) > 0, price_bucket(Decimal(str(price)))
+
+
+def _bucket_expression():
+    whens = [
+        When(price__gte=edge, then=Value(i))
+        for i, edge in reversed(list(enumerate(PRICE_BUCKET_EDGES)))
+    ]
+    return Case(*whens, default=Value(0), output_field=IntegerField())
+
+
+def _build_cube(queryset):
+    """
+    Куб счетчиков {(category_id, in_stock, has_discount, price_bucket): count}
+    одним GROUP BY. Все фасеты любой комбинации фильтров считаются из него в Python.
+    """
+    rows = (
+        queryset.order_by()
+        .annotate(
+            has_discount=Case(When(discount_percent__gt=0, then=Value(True)), default=Value(False)),
+            bucket=_bucket_expression(),
+        )
+        .values('category_id', 'in_stock', 'has_discount', 'bucket')
+        .annotate(count=Count('id'))
+    )
+    return {
+        (row['category_id'], row['in_stock'], row['has_discount'], row['bucket']): row['count']
+        for row in rows
+    }
+
+
+def get_cube():
+    cube = cache.get(FACETS_CACHE_KEY)
+    if cube is None:
+        cube = _build_cube(Product.objects.all())
+        cache.set(FACETS_CACHE_KEY, cube, FACETS_CACHE_TIMEOUT)
+    return cube
+
+
+def invalidate_facets():
+    cache.delete(FACETS_CACHE_KEY)
+
+
+def update_cube(old_key=None, new_key=None):
+    """Инкрементально переносит товар из ячейки old_key в new_key (после коммита)"""
+    if old_key == new_key:
+        return
+
+    def apply():
+        cube = cache.get(FACETS_CACHE_KEY)
+        if cube is None:
+            return  # соберется заново при следующем запросе
+        if old_key is not None:
+            cube[old_key] = cube.get(old_key, 0) - 1
+            if cube[old_key] <= 0:
+                del cube[old_key]
+        if new_key is not None:
+            cube[new_key] = cube.get(new_key, 0) + 1
+        cache.set(FACETS_CACHE_KEY, cube, FACETS_CACHE_TIMEOUT)
+
+    transaction.on_commit(apply)
+
+
+def _aligned(filters):
+    """Цена фильтруется по границам корзин - тогда фасеты считаются из куба точно"""
+    return all(
+        filters[name] is None or filters[name] in PRICE_BUCKET_EDGES
+        for name in ('price_min', 'price_max')
+    )
+
+
+def _matches(key, filters, skip):
+    category_id, in_stock, has_discount, bucket = key
+    if skip != 'category' and filters['category'] is not None and category_id != filters['category']:
+        return False
+    if skip != 'in_stock' and filters['in_stock'] is not None and in_stock != filters['in_stock']:
+        return False
+    if skip != 'has_discount' and filters['has_discount'] is not None and has_discount != filters['has_discount']:
+        return False
+    if skip != 'price':
+        low = PRICE_BUCKET_EDGES[bucket]
+        if filters['price_min'] is not None and low < filters['price_min']:
+            return False
+        if filters['price_max'] is not None and low >= filters['price_max']:
+            return False
+    return True
+
+
+def get_facets(filters, base_queryset=None):
+    """
+    Счетчики фасетов для текущих фильтров. Каждый фасет считается с учетом всех
+    фильтров, кроме своего собственного, чтобы показывать альтернативы выбору.
+    base_queryset задается, когда выборка уже сужена (например, поиском) - тогда без кэша.
+    """
+    if base_queryset is None:
+        price_cube = get_cube()
+        if _aligned(filters):
+            return _facets_from_cubes(price_cube, price_cube, filters)
+        queryset = Product.objects.all()
+    else:
+        queryset = base_queryset
+        price_cube = _build_cube(queryset)
+
+    # Произвольные границы цены: куб по корзинам неточен, остальные фасеты
+    # считаются по выборке, уже отфильтрованной по цене
+    only_price = {name: None for name in filters}
+    only_price.update(price_min=filters['price_min'], price_max=filters['price_max'])
+    cube = _build_cube(apply_filters(queryset, only_price))
+    return _facets_from_cubes(cube, price_cube, dict(filters, price_min=None, price_max=None))
+
+
+def _facets_from_cubes(cube, price_cube, filters):
+    categories = {}
+    in_stock = {True: 0, False: 0}
+    has_discount = {True: 0, False: 0}
+    buckets = [0] * len(PRICE_BUCKET_EDGES)
+    total = 0
+
+    for key, count in cube.items():
+        category_id, stock, discount, bucket = key
+        if _matches(key, filters, skip='category'):
+            categories[category_id] = categories.get(category_id, 0) + count
+        if _matches(key, filters, skip='in_stock'):
+            in_stock[stock] += count
+        if _matches(key, filters, skip='has_discount'):
+            has_discount[discount] += count
+        if _matches(key, filters, skip=None):
+            total += count
+
+    for key, count in price_cube.items():
+        if _matches(key, filters, skip='price'):
+            buckets[key[3]] += count
+
+    names = dict(Category.objects.filter(id__in=[c for c in categories if c]).values_list('id', 'name'))
+    edges = PRICE_BUCKET_EDGES + [None]
+    return {
+        'total': total,
+        'category': [
+            {'id': category_id, 'name': names.get(category_id, 'Без категории'), 'count': count}
+            for category_id, count in sorted(categories.items(), key=lambda item: (item[0] is None, item[0] or 0))
+        ],
+        'in_stock': {'true': in_stock[True], 'false': in_stock[False]},
+        'has_discount': {'true': has_discount[True], 'false': has_discount[False]},
+        'price': [
+            {'min': edges[i], 'max': edges[i + 1], 'count': count}
+            for i, count in enumerate(buckets)
+        ],
+    }
@@ -7,7 +7,7 @@ from .models import Product
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ['name', 'description', 'price', 'in_stock', 'category']
+        fields = ['name', 'description', 'price', 'in_stock', 'stock', 'category']
 
 
 class RegisterForm(forms.ModelForm):
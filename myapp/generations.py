@@ -0,0 +1,47 @@
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+# Пространство ключей каталога: товары, категории, изображения
+CATALOG = 'catalog'
+
+
+def _generation_key(namespace):
+    return f'generation:{namespace}'
+
+
+def get_generation(namespace):
+    """
+    Текущее поколение пространства ключей. Начальное значение берется из времени,
+    чтобы после вытеснения ключа из кэша поколение не вернулось к старому номеру.
+    """
+    key = _generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(namespace):
+    """Делает все записи пространства устаревшими без перебора ключей (после коммита)"""
+    def bump():
+        key = _generation_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+
+
+def versioned_key(namespace, *parts):
+    return ':'.join([namespace, str(get_generation(namespace)), *map(str, parts)])
+
+
+def cache_is_shared():
+    """Видят ли все процессы (веб, Celery) одни и те же записи кэша. LocMem и Dummy - нет"""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
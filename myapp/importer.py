@@ -0,0 +1,199 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .events import emit_products_created, product_payload
+from .facets import invalidate_facets
+from .generations import CATALOG, bump_generation
+from .models import Category, Product
+from .search import refresh_search_vector
+from .tasks import DIGEST_MAX_LISTED
+
+logger = logging.getLogger("api")
+
+IMPORT_BATCH_SIZE = 2000
+IMPORT_FORMATS = ('csv', 'ndjson')
+# Поля, которые перезаписываются при совпадении артикула
+UPSERT_FIELDS = ['name', 'description', 'price', 'in_stock', 'category', 'discount_percent',
+                 'content_hash', 'updated_at']
+MAX_REPORTED_ERRORS = 20
+# Пределы колонок: строка за ними отклоняется, а не роняет пачку
+SKU_MAX_LENGTH = Product._meta.get_field('sku').max_length
+CATEGORY_MAX_LENGTH = Category._meta.get_field('name').max_length
+_price_field = Product._meta.get_field('price')
+MAX_PRICE = Decimal(10) ** (_price_field.max_digits - _price_field.decimal_places)
+
+TRUE_VALUES = ('1', 'true', 'yes', 'да', 'y')
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_csv(stream):
+    """Строки CSV с заголовком; stream - текстовый или бинарный файл"""
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    yield from csv.DictReader(stream)
+
+
+def read_ndjson(stream):
+    """Объекты по строке; битая строка отдается как ImportRowError и не прерывает импорт"""
+    for number, line in enumerate(stream, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+        except ValueError:
+            yield ImportRowError(f'строка {number}: некорректный JSON')
+            continue
+        if not isinstance(row, dict):
+            yield ImportRowError(f'строка {number}: ожидался объект')
+            continue
+        yield row
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def content_hash(name, description, price, in_stock, category, discount_percent):
+    payload = '\x1f'.join([name, description, f'{price:f}', str(in_stock), category or '', str(discount_percent)])
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+class ProductImporter:
+    """
+    Потоковый upsert товаров по артикулу (sku) пачками через
+    bulk_create(update_conflicts=True). Строки с неизменным хэшем содержимого
+    пропускаются, категории разрешаются через словарь в памяти.
+    Сигналы post_save не срабатывают: о новых товарах отправляется одно событие на весь импорт.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.stats = {'rows': 0, 'upserted': 0, 'unchanged': 0, 'errors': 0, 'error_messages': []}
+        # Для письма о новых товарах - число и первые DIGEST_MAX_LISTED описаний, а не все строки
+        self.created = []
+        self.created_total = 0
+
+    def _category_id(self, name):
+        if not name:
+            return None
+        if name not in self.categories:
+            self.categories[name] = Category.objects.get_or_create(name=name)[0].id
+        return self.categories[name]
+
+    def _parse(self, raw):
+        sku = str(raw.get('sku') or '').strip()
+        name = str(raw.get('name') or '').strip()
+        if not sku or not name:
+            raise ImportRowError('sku и name обязательны')
+        # Значение, не влезающее в колонку, уронило бы bulk_create всей пачки (DataError)
+        if len(sku) > SKU_MAX_LENGTH:
+            raise ImportRowError(f'{sku[:SKU_MAX_LENGTH]}...: артикул длиннее {SKU_MAX_LENGTH} символов')
+        try:
+            price = Decimal(str(raw.get('price'))).quantize(Decimal('0.01'))
+            discount = int(raw.get('discount_percent') or 0)
+        except (InvalidOperation, TypeError, ValueError):
+            raise ImportRowError(f'{sku}: некорректная цена или скидка')
+        if not price.is_finite() or price <= 0 or not 0 <= discount <= 100:
+            raise ImportRowError(f'{sku}: цена должна быть > 0, скидка 0-100')
+        if price >= MAX_PRICE:
+            raise ImportRowError(f'{sku}: цена должна быть меньше {MAX_PRICE}')
+
+        in_stock = raw.get('in_stock', True)
+        if isinstance(in_stock, str):
+            in_stock = in_stock.strip().lower() in TRUE_VALUES
+        description = str(raw.get('description') or '')
+        category = str(raw.get('category') or '').strip() or None
+        if category and len(category) > CATEGORY_MAX_LENGTH:
+            raise ImportRowError(f'{sku}: название категории длиннее {CATEGORY_MAX_LENGTH} символов')
+
+        # Модель создается только для измененных строк (см. _flush)
+        fields = {
+            'sku': sku,
+            'name': name[:100],
+            'description': description,
+            'price': price,
+            'in_stock': bool(in_stock),
+            'discount_percent': discount,
+            'category_id': self._category_id(category),
+        }
+        fields['content_hash'] = content_hash(fields['name'], description, price, fields['in_stock'],
+                                              category, discount)
+        return fields
+
+    def _error(self, message):
+        self.stats['errors'] += 1
+        if len(self.stats['error_messages']) < MAX_REPORTED_ERRORS:
+            self.stats['error_messages'].append(message)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        existing = dict(Product.objects.filter(sku__in=batch.keys()).values_list('sku', 'content_hash'))
+        changed = [Product(**fields) for sku, fields in batch.items() if existing.get(sku) != fields['content_hash']]
+        self.stats['unchanged'] += len(batch) - len(changed)
+
+        if changed:
+            with transaction.atomic():
+                Product.objects.bulk_create(
+                    changed,
+                    update_conflicts=True,
+                    unique_fields=['sku'],
+                    update_fields=UPSERT_FIELDS,
+                )
+                refresh_search_vector(Product.objects.filter(sku__in=[p.sku for p in changed]))
+            self.stats['upserted'] += len(changed)
+            new = [p for p in changed if p.sku not in existing]
+            self.created_total += len(new)
+            room = DIGEST_MAX_LISTED - len(self.created)
+            self.created.extend(product_payload(p, created_by="Импорт") for p in new[:max(room, 0)])
+
+    def run(self, rows):
+        started = time.perf_counter()
+        batch = {}
+        for raw in rows:
+            self.stats['rows'] += 1
+            try:
+                if isinstance(raw, ImportRowError):
+                    raise raw
+                fields = self._parse(raw)
+            except ImportRowError as e:
+                self._error(str(e))
+                continue
+            batch[fields['sku']] = fields  # повтор артикула в пачке - побеждает последний
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = {}
+                if self.progress:
+                    self.progress(self.stats)
+        self._flush(batch)
+
+        if self.stats['upserted']:
+            bump_generation(CATALOG)
+            transaction.on_commit(invalidate_facets)
+            emit_products_created(self.created, self.created_total)
+
+        elapsed = time.perf_counter() - started
+        self.stats['seconds'] = round(elapsed, 2)
+        self.stats['rows_per_sec'] = round(self.stats['rows'] / elapsed) if elapsed else self.stats['rows']
+        logger.info(f"Импорт товаров: {self.stats['rows']} строк, обновлено {self.stats['upserted']}, "
+                    f"без изменений {self.stats['unchanged']}, ошибок {self.stats['errors']}, "
+                    f"{self.stats['rows_per_sec']} строк/с")
+        return self.stats
+
+
+def import_products(stream, import_format, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    return ProductImporter(batch_size=batch_size, progress=progress).run(READERS[import_format](stream))
@@ -0,0 +1,283 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+# Сценарии горячих путей магазина; каждая итерация - последовательность запросов одного пользователя
+SCENARIOS = ('browse', 'checkout', 'login', 'mixed', 'flash_sale')
+MIXED_WEIGHTS = {'browse': 70, 'checkout': 20, 'login': 10}
+BROWSE_QUERIES = ['', '?sort=price', '?sort=-price', '?sort=discount', '?in_stock=1', '?has_discount=1']
+
+REQUEST_TIMEOUT = 30
+# Вход харнесс выполняет сам под своими пользователями, записанные входы пропускаются
+REPLAY_SKIP_PATHS = ('/login/', '/logout/', '/api/token/', '/api/token/refresh/')
+
+
+def percentile(values, pct):
+    """Процентиль по методу ближайшего ранга; values должны быть отсортированы"""
+    if not values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def load_replay(path):
+    """
+    Журнал запросов в JSONL (пишется RequestTimerMiddleware при REQUEST_RECORD_PATH):
+    {"method": "GET", "path": "/api/cart/", "auth": true, "body": {...}}
+    """
+    entries = []
+    with open(path, encoding='utf-8') as log:
+        for line in log:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry['path'].split('?', 1)[0] not in REPLAY_SKIP_PATHS:
+                entries.append({
+                    'method': entry.get('method', 'GET').upper(),
+                    'path': entry['path'],
+                    'auth': entry.get('auth', False),
+                    'body': entry.get('body'),
+                    'name': entry.get('name'),
+                })
+    return entries
+
+
+def endpoint_name(method, path):
+    """Группировка в отчете: числовые id и query string заменяются шаблоном"""
+    path = re.sub(r'/\d+(?=/|$)', '/{id}', path.split('?', 1)[0])
+    return f'{method} {path}'
+
+
+class RateLimiter:
+    """Общий для всех потоков темп: не более rps запросов в секунду (0 - без ограничения)"""
+
+    def __init__(self, rps):
+        self.interval = 1 / rps if rps else 0
+        self.next_at = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.perf_counter()
+            at = max(self.next_at, now)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class LoadClient:
+    """Виртуальный пользователь: своя HTTP-сессия (cookie, CSRF) и свой JWT"""
+
+    def __init__(self, base_url, limiter, samples, username=None, password=None):
+        self.base_url = base_url.rstrip('/')
+        self.limiter = limiter
+        self.samples = samples
+        self.username = username
+        self.password = password
+        self.session = requests.Session()
+        self.access = None
+        self.logged_in = False
+
+    def call(self, method, path, name=None, auth=False, data=None, json_body=None):
+        self.limiter.wait()
+        headers = {}
+        if auth and self.access:
+            headers['Authorization'] = f'Bearer {self.access}'
+        if data is not None and 'csrftoken' in self.session.cookies:
+            headers['X-CSRFToken'] = self.session.cookies['csrftoken']
+            headers['Referer'] = self.base_url + path
+
+        started = time.perf_counter()
+        error = None
+        try:
+            response = self.session.request(method, self.base_url + path, headers=headers, data=data,
+                                            json=json_body, timeout=REQUEST_TIMEOUT, allow_redirects=False)
+            status = response.status_code
+            queries = response.headers.get('X-Query-Count')
+        except requests.RequestException as e:
+            response, status, queries, error = None, 0, None, type(e).__name__
+        elapsed = time.perf_counter() - started
+
+        self.samples.append({
+            'name': name or endpoint_name(method, path),
+            'status': status,
+            'ms': elapsed * 1000,
+            'queries': int(queries) if queries is not None else None,
+            'error': bool(error) or status >= 400,
+        })
+        return response
+
+    def obtain_token(self):
+        response = self.call('POST', '/api/token/', name='jwt_token',
+                             json_body={'username': self.username, 'password': self.password})
+        if response is not None and response.status_code == 200:
+            self.access = response.json()['access']
+        return self.access
+
+    def session_login(self):
+        # product_detail закрыт login_required - нужен вход через форму с CSRF
+        self.call('GET', '/login/', name='login_form')
+        response = self.call('POST', '/login/', name='login_submit', data={
+            'username': self.username,
+            'password': self.password,
+            'csrfmiddlewaretoken': self.session.cookies.get('csrftoken', ''),
+        })
+        self.logged_in = response is not None and response.status_code == 302
+        return self.logged_in
+
+
+def browse(client, rng, product_ids):
+    if not client.logged_in:
+        client.session_login()
+    client.call('GET', '/' + rng.choice(BROWSE_QUERIES), name='products_view')
+    for _ in range(rng.randint(1, 3)):
+        client.call('GET', f'/product/{rng.choice(product_ids)}/', name='product_detail')
+
+
+def checkout(client, rng, product_ids):
+    if not client.access:
+        client.obtain_token()
+    for _ in range(rng.randint(1, 3)):
+        client.call('POST', '/api/cart/add/', name='cart_add', auth=True,
+                    json_body={'product_id': rng.choice(product_ids), 'quantity': rng.randint(1, 2)})
+    client.call('GET', '/api/cart/', name='cart_detail', auth=True)
+    client.call('POST', '/api/orders/checkout/', name='order_checkout', auth=True,
+                json_body={'phone_number': '+79000000000', 'customer_name': 'Нагрузочный тест'})
+
+
+def login(client, rng, product_ids):
+    client.obtain_token()
+
+
+def flash_sale(client, rng, product_ids):
+    # Все пользователи покупают один и тот же товар: конкуренция за остаток горячей позиции.
+    # Когда остаток кончится, оформление отвечает 409 - это ожидаемый исход, а не сбой
+    if not client.access:
+        client.obtain_token()
+    client.call('POST', '/api/cart/add/', name='cart_add', auth=True,
+                json_body={'product_id': product_ids[0], 'quantity': 1})
+    client.call('POST', '/api/cart/reserve/', name='cart_reserve', auth=True, json_body={})
+    client.call('POST', '/api/orders/checkout/', name='order_checkout', auth=True,
+                json_body={'phone_number': '+79000000000', 'customer_name': 'Нагрузочный тест'})
+
+
+FLOWS = {'browse': browse, 'checkout': checkout, 'login': login, 'flash_sale': flash_sale}
+
+
+def replay(client, entries, position):
+    entry = entries[position % len(entries)]
+    # API авторизуется по JWT, HTML-страницы - по сессии
+    if entry['auth'] and entry['path'].startswith('/api/'):
+        if not client.access:
+            client.obtain_token()
+    elif entry['auth'] and not client.logged_in:
+        client.session_login()
+    client.call(entry['method'], entry['path'], name=entry['name'], auth=entry['auth'], json_body=entry['body'])
+
+
+def discover_products(base_url):
+    """id товаров для сценариев берутся из первой страницы публичного API каталога"""
+    response = requests.get(f"{base_url.rstrip('/')}/api/catalog/products/",
+                            params={'page_size': 100}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return [row['id'] for row in response.json()['results']]
+
+
+def run_load(base_url, scenario='mixed', concurrency=10, rps=0, duration=30, iterations=None,
+             users=None, password='password', replay_entries=None, seed=0, product_ids=None):
+    """
+    Запускает concurrency потоков-пользователей на duration секунд (или iterations итераций
+    на поток). users - список логинов; поток i входит под users[i % len(users)].
+    Возвращает (samples, elapsed).
+    """
+    if replay_entries is None and not product_ids:
+        product_ids = discover_products(base_url)
+        if not product_ids:
+            raise ValueError('В каталоге нет товаров: сначала manage.py generate_dataset')
+
+    limiter = RateLimiter(rps)
+    samples = []  # list.append потокобезопасен в CPython
+    deadline = time.perf_counter() + duration
+    counter = iter(range(10 ** 12))
+    counter_lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(f'{seed}:{index}')
+        username = users[index % len(users)] if users else None
+        client = LoadClient(base_url, limiter, samples, username, password)
+        done = 0
+        while time.perf_counter() < deadline and (iterations is None or done < iterations):
+            if replay_entries is not None:
+                with counter_lock:
+                    position = next(counter)
+                replay(client, replay_entries, position)
+            else:
+                flow = scenario
+                if flow == 'mixed':
+                    flow = rng.choices(list(MIXED_WEIGHTS), list(MIXED_WEIGHTS.values()))[0]
+                FLOWS[flow](client, rng, product_ids)
+            done += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    """Отчет с отсортированными ключами и округленными значениями - удобно сравнивать diff'ом"""
+    groups = defaultdict(list)
+    for sample in samples:
+        groups[sample['name']].append(sample)
+    groups['TOTAL'] = samples
+
+    endpoints = {}
+    for name, items in sorted(groups.items()):
+        latencies = sorted(item['ms'] for item in items)
+        queries = [item['queries'] for item in items if item['queries'] is not None]
+        errors = sum(1 for item in items if item['error'])
+        statuses = defaultdict(int)
+        for item in items:
+            statuses[str(item['status'])] += 1
+        endpoints[name] = {
+            'requests': len(items),
+            'rps': round(len(items) / elapsed, 1) if elapsed else 0,
+            'error_rate': round(errors / len(items), 4) if items else 0,
+            'p50_ms': round(percentile(latencies, 50), 1) if items else None,
+            'p95_ms': round(percentile(latencies, 95), 1) if items else None,
+            'p99_ms': round(percentile(latencies, 99), 1) if items else None,
+            'queries_per_request': round(sum(queries) / len(queries), 1) if queries else None,
+            'statuses': dict(sorted(statuses.items())),
+        }
+    return {'elapsed_s': round(elapsed, 1), 'endpoints': endpoints}
+
+
+def format_report(report, baseline=None):
+    """Текстовая таблица; с baseline - изменение p95 и запросов к БД относительно него"""
+    header = f"{'endpoint':<28} {'req':>7} {'rps':>7} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>5}"
+    if baseline:
+        header += f" {'Δp95':>8} {'Δsql':>6}"
+    lines = [header]
+    for name, row in report['endpoints'].items():
+        line = (f"{name:<28} {row['requests']:>7} {row['rps']:>7} {row['error_rate'] * 100:>6.2f} "
+                f"{row['p50_ms'] or 0:>8} {row['p95_ms'] or 0:>8} {row['p99_ms'] or 0:>8} "
+                f"{'-' if row['queries_per_request'] is None else row['queries_per_request']:>5}")
+        old = (baseline or {}).get('endpoints', {}).get(name)
+        if old:
+            p95 = (row['p95_ms'] or 0) - (old['p95_ms'] or 0)
+            sql = (row['queries_per_request'] or 0) - (old['queries_per_request'] or 0)
+            line += f' {p95:>+8.1f} {sql:>+6.1f}'
+        lines.append(line)
+    return '\n'.join(lines)
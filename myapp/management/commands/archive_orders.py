@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myapp.archive import (ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_STATUSES, archive_orders,
+                           export_archive)
+
+
+class Command(BaseCommand):
+    help = ('Переносит старые завершенные и отмененные заказы из Order/OrderItem в архивную таблицу; '
+            'с --export-dir выгружает самые старые месяцы архива в сжатые файлы и удаляет их из базы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                            help='Архивировать заказы старше стольких дней')
+        parser.add_argument('--status', nargs='+', default=list(ARCHIVE_STATUSES),
+                            help='Статусы заказов, которые можно архивировать')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--export-dir', help='Каталог для файлов orders-YYYY-MM.ndjson.gz')
+        parser.add_argument('--export-days', type=int, default=730,
+                            help='Выгружать из архива в файлы месяцы старше стольких дней')
+
+    def handle(self, *args, **options):
+        if options['export_dir'] and options['export_days'] < options['days']:
+            raise CommandError('--export-days не может быть меньше --days')
+
+        def progress(label):
+            def report(count):
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'  {label}: {count}')
+            return report
+
+        now = timezone.now()
+        archived = archive_orders(before=now - timedelta(days=options['days']), statuses=options['status'],
+                                  batch_size=options['batch_size'], progress=progress('в архиве'))
+        self.stdout.write(f'Перенесено в архив: {archived}')
+
+        if options['export_dir']:
+            exported = export_archive(options['export_dir'], before=now - timedelta(days=options['export_days']),
+                                      batch_size=options['batch_size'], progress=progress('в файлах'))
+            self.stdout.write(f"Выгружено в {options['export_dir']}: {exported}")
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from myapp.exports import (EXPORT_FORMATS, ORDER_EXPORT_FIELDS, PRODUCT_EXPORT_FIELDS,
+                           order_rows, product_rows, stream_export)
+
+EXPORTS = {
+    'products': (product_rows, PRODUCT_EXPORT_FIELDS),
+    'orders': (order_rows, ORDER_EXPORT_FIELDS),
+}
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка товаров или заказов в CSV/NDJSON (серверный курсор, постоянная память)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS))
+        parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='Файл для записи (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        rows, fields = EXPORTS[options['dataset']]
+        chunks = stream_export(rows(), fields, options['export_format'])
+
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        count = -1 if options['export_format'] == 'csv' else 0
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                count += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Выгружено строк: {count} -> {options['output']}"))
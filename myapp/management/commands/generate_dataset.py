@@ -0,0 +1,50 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.datagen import COPY_BATCH_SIZE, SCALES, generate_dataset
+
+
+class Command(BaseCommand):
+    help = ('Генерирует детерминированный синтетический набор данных для нагрузочных тестов: '
+            'категории, товары с изображениями, пользователи, корзины и заказы (COPY пачками, без сигналов)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='10k',
+                            help='Пресет размеров; отдельные размеры переопределяются параметрами ниже')
+        parser.add_argument('--products', type=int)
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--orders', type=int)
+        parser.add_argument('--categories', type=int)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Один seed - одинаковые данные; для повторной загрузки в ту же базу нужен другой seed')
+        parser.add_argument('--days', type=int, default=365, help='Глубина истории заказов в днях')
+        parser.add_argument('--end-date', type=date.fromisoformat,
+                            help='Дата, от которой отсчитывается история (по умолчанию сегодня)')
+        parser.add_argument('--batch-size', type=int, default=COPY_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(table, rows):
+            self.stdout.write(f'  {table}: {rows}')
+
+        try:
+            stats = generate_dataset(
+                scale=options['scale'],
+                seed=options['seed'],
+                progress=progress if options['verbosity'] > 1 else None,
+                products=options['products'],
+                users=options['users'],
+                orders=options['orders'],
+                categories=options['categories'],
+                days=options['days'],
+                end_date=options['end_date'],
+                batch_size=options['batch_size'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for table, table_stats in stats.items():
+            if isinstance(table_stats, dict):
+                seconds = f", {table_stats['seconds']} с" if 'seconds' in table_stats else ''
+                self.stdout.write(f"{table}: {table_stats['rows']} строк{seconds}")
+        self.stdout.write(self.style.SUCCESS(f"Готово за {stats['seconds']} с"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.importer import IMPORT_BATCH_SIZE, IMPORT_FORMATS, import_products
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт товаров из CSV/NDJSON с upsert по артикулу (sku)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='import_format', choices=IMPORT_FORMATS,
+                            help='По умолчанию определяется по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['import_format'] or path.rsplit('.', 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f'Неизвестный формат: {import_format}, укажите --format')
+
+        def progress(stats):
+            self.stdout.write(f"  ...{stats['rows']} строк")
+
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            stats = import_products(stream, import_format, batch_size=options['batch_size'], progress=progress)
+
+        for message in stats['error_messages']:
+            self.stderr.write(message)
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк: {stats['rows']}, обновлено: {stats['upserted']}, без изменений: {stats['unchanged']}, "
+            f"ошибок: {stats['errors']}, {stats['seconds']} с ({stats['rows_per_sec']} строк/с)"
+        ))
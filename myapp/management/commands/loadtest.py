@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.loadtest import SCENARIOS, format_report, load_replay, run_load, summarize
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный прогон по горячим путям магазина (каталог, карточка, корзина, оформление, JWT) '
+            'или по записанному журналу запросов; отчет p50/p95/p99, ошибки и SQL-запросы на запрос. '
+            'Сервер запускается с DJANGO_SETTINGS_MODULE=my_project.settings_loadtest')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--scenario', choices=SCENARIOS, default='mixed')
+        parser.add_argument('--replay', help='JSONL-журнал запросов (REQUEST_RECORD_PATH) вместо сценария')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--rps', type=float, default=0, help='Целевой темп, 0 - без ограничения')
+        parser.add_argument('--duration', type=float, default=30, help='Секунд')
+        parser.add_argument('--iterations', type=int, help='Итераций на поток (вместо/вместе с --duration)')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Сколько пользователей из generate_dataset использовать')
+        parser.add_argument('--username-template', default='gen0_user{n}')
+        parser.add_argument('--password', default='password')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--product-ids', type=int, nargs='+',
+                            help='id товаров для сценариев вместо первой страницы каталога (flash_sale берет первый)')
+        parser.add_argument('--output', '-o', help='Сохранить отчет в JSON')
+        parser.add_argument('--baseline', help='JSON-отчет прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        users = [options['username_template'].format(n=n) for n in range(options['users'])]
+        replay_entries = load_replay(options['replay']) if options['replay'] else None
+        if replay_entries == []:
+            raise CommandError('Журнал запросов пуст')
+
+        try:
+            samples, elapsed = run_load(
+                options['base_url'],
+                scenario=options['scenario'],
+                concurrency=options['concurrency'],
+                rps=options['rps'],
+                duration=options['duration'],
+                iterations=options['iterations'],
+                users=users,
+                password=options['password'],
+                replay_entries=replay_entries,
+                seed=options['seed'],
+                product_ids=options['product_ids'],
+            )
+        except Exception as e:
+            raise CommandError(f'Не удалось запустить прогон: {e}')
+
+        report = summarize(samples, elapsed)
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        self.stdout.write(format_report(report, baseline))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"Отчет сохранен: {options['output']}"))
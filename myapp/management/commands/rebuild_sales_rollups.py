@@ -0,0 +1,24 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from myapp.rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = ('Полностью пересчитывает агрегаты продаж по дням (товары и категории) за период - '
+            'для первичного заполнения и после ручных правок заказов; дальше их ведет задача refresh_sales_rollups')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='Первый день (по умолчанию - первый заказ)')
+        parser.add_argument('--until', type=date.fromisoformat, help='Последний день (по умолчанию - сегодня)')
+
+    def handle(self, *args, **options):
+        def progress(day, rows):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  до {day}: {rows} строк')
+
+        started = time.monotonic()
+        rows = rebuild_sales_rollups(since=options['since'], until=options['until'], progress=progress)
+        self.stdout.write(f'Строк товар-день: {rows}, за {time.monotonic() - started:.2f} с')
@@ -1,19 +1,34 @@
 from decimal import Decimal
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models import ForeignKey
+from django.utils import timezone
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, ForeignKey, Prefetch, Sum, Value
+from django.db.models.functions import Coalesce, Round
 
 
 
 # Create your models here.
 
+class ProductQuerySet(models.QuerySet):
+    def with_images(self):
+        """Подгружает изображения всей выборки одним запросом (главное - первым)"""
+        return self.prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.order_by('-is_main', 'order', 'id'))
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название продукта")
     description = models.TextField(blank=True, verbose_name="Описание")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
     in_stock = models.BooleanField(default=True, verbose_name="В наличии")
+    # Остаток на складе за вычетом резервов (myapp/stock.py); None - остаток не ведется, только флаг in_stock
+    stock = models.PositiveIntegerField(null=True, blank=True, verbose_name="Остаток")
     category = models.ForeignKey(
         'Category',
         on_delete=models.SET_NULL,
@@ -22,21 +37,44 @@ class Product(models.Model):
         verbose_name="Категория"
     )
     discount_percent = models.PositiveIntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
+    # Поддерживается сигналом post_save (myapp/search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Артикул поставщика - ключ upsert при импорте, и хэш содержимого для пропуска неизмененных строк
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name="Артикул")
+    content_hash = models.CharField(max_length=32, blank=True, editable=False)
+    created_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    objects = ProductQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # Ручное изменение: следующий импорт перезапишет товар данными поставщика
+        self.content_hash = ''
+        if self.stock is not None:
+            self.in_stock = self.stock > 0
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # Иначе в базе останется старый хэш и импорт пропустит товар как неизмененный
+            update_fields = set(update_fields) | {'content_hash'}
+            if 'stock' in update_fields:
+                update_fields.add('in_stock')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+    def get_sorted_images(self):
+        """
+        До 4 изображений: главное первым, затем по order, id.
+        Если изображения подгружены через with_images() - без запросов к БД.
+        """
+        if 'images' in getattr(self, '_prefetched_objects_cache', {}):
+            images = sorted(self.images.all(), key=lambda img: (not img.is_main, img.order, img.id))
+            return images[:4]
+        return list(self.images.order_by('-is_main', 'order', 'id')[:4])
 
     def get_images_with_fallback(self):
         """Возвращает 4 изображения с заполнением no-image.png"""
         images = []
-
-        # Получаем главное изображение
-        main_image = self.images.filter(is_main=True).first()
-        # Получаем остальные изображения
-        other_images = self.images.filter(is_main=False).order_by('order', 'id')
-
-        real_images = []
-        if main_image:
-            real_images.append(main_image)
-        real_images.extend(other_images)
-        real_images = real_images[:4]  # Берем максимум 4
+        real_images = self.get_sorted_images()
 
         for i in range(4):
             if i < len(real_images):
@@ -56,12 +94,9 @@ class Product(models.Model):
 
     def get_main_image(self):
         """Возвращает главное изображение или первое доступное"""
-        main_image = self.images.filter(is_main=True).first()
-        if main_image:
-            return main_image.image
-        first_image = self.images.first()
-        if first_image:
-            return first_image.image
+        images = self.get_sorted_images()
+        if images:
+            return images[0].image
         return None
     
     @property
@@ -71,6 +106,55 @@ class Product(models.Model):
     def apply_discount(self, percent):
         return float(self.price) * (1 - percent / 100)
 
+    class Meta:
+        # Составные индексы под keyset-пагинацию каталога (см. myapp/pagination.py):
+        # (поле сортировки, id) - для всего каталога, с category_id впереди - для фильтра по категории
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['discount_percent', 'id'], name='product_discount_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['category', 'id'], name='product_cat_id_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_id_idx'),
+            models.Index(fields=['category', 'discount_percent', 'id'], name='product_cat_discount_id_idx'),
+            models.Index(fields=['category', 'name', 'id'], name='product_cat_name_id_idx'),
+            # max(updated_at) для ETag / Last-Modified списков
+            models.Index(fields=['updated_at'], name='product_updated_at_idx'),
+            # Новые товары за период (ежедневный отчет)
+            models.Index(fields=['created_at'], name='product_created_at_idx'),
+            # Полнотекстовый и триграммный поиск (расширение pg_trgm создается в signals.py)
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(fields=['name'], name='product_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
+
+
+class ProductChange(models.Model):
+    """
+    Журнал изменений товаров для инкрементальной синхронизации (/api/products/changes/).
+    Строки пишет триггер БД (myapp/changes.py), поэтому в журнал попадают и bulk_create,
+    и queryset.update(), и COPY, и сырой SQL - изменение полей карточки (changes.CHANGE_FIELDS)
+    или updated_at. Удаление оставляет запись-надгробие.
+    txid - транзакция записи: лента отдается в порядке (txid, id), см. changes.py.
+    """
+    ACTION_CHOICES = [
+        ('created', 'Создан'),
+        ('updated', 'Изменен'),
+        ('deleted', 'Удален'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    product_id = models.BigIntegerField(verbose_name="Товар")
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name="Действие")
+    changed_at = models.DateTimeField(verbose_name="Время изменения")
+    txid = models.BigIntegerField(verbose_name="Транзакция")
+
+    class Meta:
+        verbose_name = "Изменение товара"
+        verbose_name_plural = "Изменения товаров"
+        indexes = [
+            models.Index(fields=['txid', 'id'], name='product_change_cursor_idx'),
+            models.Index(fields=['changed_at'], name='product_change_time_idx'),
+        ]
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey(
@@ -101,11 +185,30 @@ class ProductImage(models.Model):
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
     def __str__(self):
         return self.name
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        """
+        Позиции с товарами (JOIN) и изображения товаров: три запроса на любую
+        страницу заказов вместо запроса на каждый заказ и товар
+        """
+        items = OrderItem.objects.select_related('product').prefetch_related(
+            Prefetch('product__images', queryset=ProductImage.objects.order_by('-is_main', 'order', 'id'))
+        )
+        return self.prefetch_related(Prefetch('items', queryset=items))
+
+    def with_item_count(self):
+        """Число позиций - подзапросом в той же выборке, без GROUP BY по заказу"""
+        item_count = (OrderItem.objects.filter(order=models.OuterRef('pk')).order_by()
+                      .values('order').annotate(count=Count('id')).values('count'))
+        return self.annotate(item_count=Coalesce(models.Subquery(item_count), 0))
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('new', 'Новый'),
@@ -122,6 +225,17 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # История заказов пользователя: keyset-пагинация по (created_at, id)
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_id_idx'),
+            # Водяной знак инкрементального пересчета продаж и пересчет по дням (myapp/rollups.py)
+            models.Index(fields=['updated_at'], name='order_updated_at_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ]
+
     def __str__(self):
         return f"Заказ #{self.id} - {self.phone_number}"
 
@@ -139,6 +253,83 @@ class OrderItem(models.Model):
         return f"{self.product.name} x {self.quantity}"
 
 
+class ArchivedOrder(models.Model):
+    """
+    Старый завершенный или отмененный заказ, перенесенный из Order/OrderItem
+    (myapp/archive.py), чтобы горячие таблицы и их индексы не росли бесконечно.
+    id совпадает с исходным заказом; позиции - снимок в items:
+    [{"product_id", "name", "quantity", "price"}].
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
+    phone_number = models.CharField(max_length=20, verbose_name="Номер телефона")
+    customer_name = models.CharField(max_length=100, verbose_name="Имя клиента", blank=True)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Общая сумма")
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name="Статус")
+    created_at = models.DateTimeField(verbose_name="Дата создания")
+    updated_at = models.DateTimeField(verbose_name="Дата обновления")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата архивации")
+    items = models.JSONField(encoder=DjangoJSONEncoder, verbose_name="Позиции")
+
+    class Meta:
+        verbose_name = "Архивный заказ"
+        verbose_name_plural = "Архивные заказы"
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='archived_user_created_id_idx'),
+            # Выгрузка в файлы идет по месяцам created_at
+            models.Index(fields=['created_at'], name='archived_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Архивный заказ #{self.id} - {self.phone_number}"
+
+
+class DailyProductSales(models.Model):
+    """
+    Продажи товара за день (отмененные заказы не учитываются). Строки пересчитываются
+    целыми днями в myapp/rollups.py. Товар может быть уже удален, поэтому без внешнего ключа в БД.
+    """
+    day = models.DateField(verbose_name="День")
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name="Товар")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="Выручка")
+    units = models.PositiveIntegerField(verbose_name="Продано единиц")
+    orders = models.PositiveIntegerField(verbose_name="Заказов")
+
+    class Meta:
+        verbose_name = "Продажи товара за день"
+        verbose_name_plural = "Продажи товаров по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='daily_product_sales_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day'], name='product_sales_product_idx'),
+        ]
+
+
+class DailyCategorySales(models.Model):
+    """Продажи категории за день; orders - число разных заказов с товарами категории"""
+    day = models.DateField(verbose_name="День")
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+                                 verbose_name="Категория")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="Выручка")
+    units = models.PositiveIntegerField(verbose_name="Продано единиц")
+    orders = models.PositiveIntegerField(verbose_name="Заказов")
+
+    class Meta:
+        verbose_name = "Продажи категории за день"
+        verbose_name_plural = "Продажи категорий по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='daily_category_sales_unique'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """До какого момента updated_at заказов учтены в агрегатах"""
+    name = models.CharField(max_length=50, primary_key=True)
+    watermark = models.DateTimeField(null=True, verbose_name="Обработано до")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+
 class Cart(models.Model):
     user = models.OneToOneField(
         User,
@@ -152,19 +343,56 @@ class Cart(models.Model):
     def __str__(self):
         return f"Корзина пользователя {self.user.username}"
 
+    @property
+    def summary(self):
+        """Число позиций, единиц и сумма со скидками - из кэша или одним агрегатным запросом"""
+        from .cart import cart_summary
+        return cart_summary(self.pk)
+
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.summary['total_price']
 
     @property
     def total_quantity(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.summary['total_quantity']
 
     class Meta:
         verbose_name = "Корзина"
         verbose_name_plural = "Корзины"
 
 
+def discounted_price_expression(price='price', discount='discount_percent'):
+    """Цена со скидкой в SQL (numeric, округление до копеек) - без float"""
+    return ExpressionWrapper(
+        Round(F(price) * (100 - F(discount)) / Value(Decimal(100)), 2),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_prices(self):
+        """Товар одним JOIN и цены позиций, посчитанные в БД"""
+        return self.select_related('product').annotate(
+            unit_price=discounted_price_expression('product__price', 'product__discount_percent'),
+            line_total=ExpressionWrapper(F('unit_price') * F('quantity'),
+                                         output_field=DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+    def summary(self):
+        """Итоги корзины одним агрегатным запросом"""
+        line_total = ExpressionWrapper(
+            discounted_price_expression('product__price', 'product__discount_percent') * F('quantity'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        return self.aggregate(
+            items=Count('id'),
+            total_quantity=Coalesce(Sum('quantity'), 0),
+            total_price=Coalesce(Sum(line_total), Value(Decimal('0.00')),
+                                 output_field=DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(
         Cart,
@@ -180,6 +408,8 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1, verbose_name="Количество")
     added_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата добавления")
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ['cart', 'product']
         verbose_name = "Элемент корзины"
@@ -189,17 +419,124 @@ class CartItem(models.Model):
         return f"{self.quantity} x {self.product.name}"
 
     @property
-    def total_price(self):
-        # Применяем скидку если есть
-        if self.product.discount_percent > 0:
-            discounted_price = float(self.product.price) * (1 - self.product.discount_percent / 100)
-            return discounted_price * self.quantity
-        return self.product.price * self.quantity
+    def price_per_item(self):
+        # Цена за единицу с учетом скидки: из with_prices() или тем же округлением в Decimal
+        if hasattr(self, 'unit_price'):
+            return self.unit_price
+        from .exports import effective_price
+        return effective_price(self.product.price, self.product.discount_percent)
 
     @property
-    def price_per_item(self):
-        # Цена за единицу с учетом скидки
-        if self.product.discount_percent > 0:
-            return float(self.product.price) * (1 - self.product.discount_percent / 100)
-        return self.product.price
+    def total_price(self):
+        if hasattr(self, 'line_total'):
+            return self.line_total
+        return self.price_per_item * self.quantity
+
+
+class StockReservation(models.Model):
+    """
+    Остаток, удерживаемый под корзину до expires_at. Зарезервированное количество
+    уже вычтено из Product.stock; просроченные резервы возвращает release_expired_reservations.
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations', verbose_name="Корзина")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Товар")
+    quantity = models.PositiveIntegerField(verbose_name="Количество")
+    expires_at = models.DateTimeField(verbose_name="Действует до")
+
+    class Meta:
+        unique_together = ['cart', 'product']
+        verbose_name = "Резерв товара"
+        verbose_name_plural = "Резервы товаров"
+        indexes = [
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} до {self.expires_at:%H:%M}"
+
+
+class OutboxMessage(models.Model):
+    """
+    Побочные эффекты (уведомления в Telegram), записанные в той же транзакции, что и
+    изменение данных. Доставляет их задача dispatch_outbox (myapp/outbox.py).
+    """
+    KIND_CHOICES = [
+        ('telegram', 'Telegram'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает отправки'),
+        ('sent', 'Отправлено'),
+        ('failed', 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Тип")
+    payload = models.JSONField(verbose_name="Данные")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    available_at = models.DateTimeField(default=timezone.now, verbose_name="Отправить не раньше")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата отправки")
+
+    class Meta:
+        verbose_name = "Исходящее сообщение"
+        verbose_name_plural = "Исходящие сообщения"
+        indexes = [
+            # Очередь диспетчера: только ожидающие, в порядке готовности
+            models.Index(fields=['available_at', 'id'], condition=models.Q(status='pending'),
+                         name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.id} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Первый ответ на запрос с заголовком Idempotency-Key (api/idempotency.py).
+    key - хэш пользователя, метода, пути и самого ключа; повтор получает сохраненный ответ.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    request_hash = models.CharField(max_length=64, verbose_name="Хэш тела запроса")
+    status_code = models.PositiveSmallIntegerField(null=True, verbose_name="Код ответа")
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder, verbose_name="Ответ")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    expires_at = models.DateTimeField(verbose_name="Действует до")
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key[:12]} ({self.status_code})"
+
+
+class ImportJob(models.Model):
+    """
+    Фоновый импорт каталога (myapp/importer.py): статус и статистика для
+    ProductImportStatusAPIView. Строка в базе, а не запись кэша - ее видят и воркер,
+    и любой веб-процесс, и она не пропадает при вытеснении или очистке кэша.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Завершен'),
+        ('failed', 'Ошибка'),
+    ]
 
+    job_id = models.CharField(max_length=32, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', verbose_name="Статус")
+    stats = models.JSONField(default=dict, verbose_name="Статистика")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Импорт каталога"
+        verbose_name_plural = "Импорты каталога"
+
+    def __str__(self):
+        return f"{self.job_id} ({self.status})"
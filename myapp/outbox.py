@@ -0,0 +1,216 @@
+import logging
+import re
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+logger = logging.getLogger("api")
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+# Пауза перед повтором: 30 с, 1 мин, 2 мин ... не больше часа
+OUTBOX_RETRY_BASE = 30
+OUTBOX_RETRY_MAX = 60 * 60
+TELEGRAM_TIMEOUT = 10
+# Ограничение Telegram на длину сообщения
+TELEGRAM_MAX_LENGTH = 4096
+# Теги и сущности parse_mode=HTML - при делении длинного сообщения они не разрываются
+HTML_TOKEN_RE = re.compile(r'(<[^<>]*>|&#?\w+;)')
+HTML_TAG_RE = re.compile(r'<(/?)([a-zA-Z][\w-]*)')
+
+
+class OutboxDeliveryError(Exception):
+    pass
+
+
+class OutboxNotConfigured(OutboxDeliveryError):
+    """Повтор не поможет: канал не настроен"""
+
+
+def enqueue(kind, payload):
+    """
+    Записывает сообщение в outbox текущей транзакции. Если транзакция откатится,
+    сообщения не будет; после коммита диспетчер запускается сразу, не дожидаясь beat.
+    """
+    message = OutboxMessage.objects.create(kind=kind, payload=payload)
+    transaction.on_commit(_kick_dispatcher)
+    return message
+
+
+def enqueue_telegram(text):
+    return enqueue('telegram', {'text': text})
+
+
+def _kick_dispatcher():
+    from .tasks import dispatch_outbox
+    try:
+        dispatch_outbox.delay()
+    except Exception as e:
+        # Брокер недоступен - сообщения заберет периодический запуск
+        logger.warning(f"Не удалось запустить dispatch_outbox: {e}")
+
+
+def _tag_stack(stack, token):
+    """Открытые теги после token: (имя, открывающий тег), внешние первыми"""
+    match = HTML_TAG_RE.match(token)
+    if match is None:
+        return stack
+    closing, name = match.group(1), match.group(2).lower()
+    if not closing:
+        return stack + [(name, token)]
+    for index in range(len(stack) - 1, -1, -1):
+        if stack[index][0] == name:
+            return stack[:index]
+    return stack
+
+
+def _closers(stack):
+    return ''.join(f'</{name}>' for name, _ in reversed(stack))
+
+
+def _split_text(text, limit=TELEGRAM_MAX_LENGTH):
+    """
+    Части текста для parse_mode=HTML не длиннее limit. Режется по границам строк;
+    строка длиннее лимита - между тегами и сущностями, не внутри них. Теги, открытые
+    на границе, закрываются в конце части и открываются заново в начале следующей.
+    """
+    parts, part, stack = [], '', []
+    prefix_length = 0
+
+    def flush():
+        nonlocal part, prefix_length
+        parts.append(part + _closers(stack))
+        part = ''.join(tag for _, tag in stack)
+        prefix_length = len(part)
+
+    for line in text.splitlines(keepends=True):
+        tokens = HTML_TOKEN_RE.split(line)
+        after = stack
+        for token in tokens[1::2]:
+            after = _tag_stack(after, token)
+        if len(part) > prefix_length and len(part) + len(line) + len(_closers(after)) > limit:
+            flush()
+        for index, token in enumerate(tokens):
+            if index % 2:
+                # Тег или сущность не делятся
+                new_stack = _tag_stack(stack, token)
+                if len(part) > prefix_length and len(part) + len(token) + len(_closers(new_stack)) > limit:
+                    flush()
+                part += token
+                stack = new_stack
+                continue
+            while token:
+                room = limit - len(part) - len(_closers(stack))
+                if room <= 0 and len(part) > prefix_length:
+                    flush()
+                    continue
+                room = max(room, 1)
+                part += token[:room]
+                token = token[room:]
+    if len(part) > prefix_length:
+        parts.append(part + _closers(stack))
+    return parts
+
+
+def _telegram_chunks(messages):
+    """
+    Несколько сообщений склеиваются в одно, пока помещаются в лимит Telegram.
+    Отдает пары (сообщения, тексты для отправки); сообщение длиннее лимита
+    уходит отдельно, несколькими частями.
+    """
+    chunk, length = [], 0
+    for message in messages:
+        text = message.payload['text']
+        size = len(text) + 2
+        if chunk and length + size > TELEGRAM_MAX_LENGTH:
+            yield chunk, ['\n\n'.join(m.payload['text'] for m in chunk)]
+            chunk, length = [], 0
+        if len(text) > TELEGRAM_MAX_LENGTH:
+            yield [message], _split_text(text)
+            continue
+        chunk.append(message)
+        length += size
+    if chunk:
+        yield chunk, ['\n\n'.join(m.payload['text'] for m in chunk)]
+
+
+def send_telegram(text):
+    bot_token = settings.TELEGRAM_BOT_TOKEN
+    chat_id = settings.TELEGRAM_CHAT_ID
+    if not bot_token or not chat_id:
+        raise OutboxNotConfigured("Telegram bot token or chat ID not configured")
+
+    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+    try:
+        response = requests.post(url, data={'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'},
+                                 timeout=TELEGRAM_TIMEOUT)
+    except requests.RequestException as e:
+        raise OutboxDeliveryError(str(e))
+    if response.status_code != 200:
+        raise OutboxDeliveryError(f"Telegram {response.status_code}: {response.text[:200]}")
+
+
+def deliver_telegram(messages):
+    for chunk, texts in _telegram_chunks(messages):
+        try:
+            # При ошибке на середине длинного сообщения повтор отправит его заново целиком
+            for text in texts:
+                send_telegram(text)
+        except OutboxDeliveryError as e:
+            for message in chunk:
+                _failed(message, e)
+        else:
+            for message in chunk:
+                _sent(message)
+
+
+DELIVERERS = {'telegram': deliver_telegram}
+
+
+def _sent(message):
+    message.status = 'sent'
+    message.sent_at = timezone.now()
+    message.attempts += 1
+    message.last_error = ''
+
+
+def _failed(message, error):
+    message.attempts += 1
+    message.last_error = str(error)[:1000]
+    if isinstance(error, OutboxNotConfigured) or message.attempts >= OUTBOX_MAX_ATTEMPTS:
+        message.status = 'failed'
+        logger.error(f"❌ Outbox: сообщение {message.id} не доставлено: {error}")
+    else:
+        delay = min(OUTBOX_RETRY_BASE * 2 ** (message.attempts - 1), OUTBOX_RETRY_MAX)
+        message.available_at = timezone.now() + timedelta(seconds=delay)
+
+
+def dispatch(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Доставляет одну пачку готовых сообщений. SKIP LOCKED позволяет нескольким
+    воркерам разбирать очередь параллельно без двойной отправки.
+    Возвращает число обработанных сообщений.
+    """
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', available_at__lte=timezone.now())
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        by_kind = {}
+        for message in messages:
+            by_kind.setdefault(message.kind, []).append(message)
+        for kind, group in by_kind.items():
+            DELIVERERS[kind](group)
+
+        OutboxMessage.objects.bulk_update(messages, ['status', 'sent_at', 'attempts', 'last_error', 'available_at'])
+
+    sent = sum(1 for message in messages if message.status == 'sent')
+    if messages:
+        logger.info(f"Outbox: обработано {len(messages)}, отправлено {sent}")
+    return len(messages)
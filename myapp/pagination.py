@@ -0,0 +1,148 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Допустимые ключи сортировки каталога -> поле модели Product.
+# Каждый ключ дополняется id, чтобы порядок был строго однозначным.
+PRODUCT_SORT_FIELDS = {
+    'id': 'id',
+    'price': 'price',
+    'discount': 'discount_percent',
+    'name': 'name',
+}
+DEFAULT_SORT = 'id'
+CURSOR_SALT = 'myapp.pagination.cursor'
+
+
+def parse_sort(sort, sort_fields=PRODUCT_SORT_FIELDS, default=DEFAULT_SORT):
+    """Возвращает (ключ, поле, по убыванию) для параметра ?sort=price / ?sort=-price"""
+    sort = (sort or default).strip()
+    descending = sort.startswith('-')
+    key = sort.lstrip('-')
+    if key not in sort_fields:
+        descending = default.startswith('-')
+        key = default.lstrip('-')
+    return key, sort_fields[key], descending
+
+
+def encode_cursor(sort, value, pk, reverse=False):
+    """sort - сортировка, для которой выдан курсор (например, '-price')"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+    # Курсор подписан SECRET_KEY: клиент не может подставить свое значение или сортировку
+    return signing.dumps([sort, value, pk, int(reverse)], salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor):
+    """
+    Возвращает (сортировка, значение, id, назад) или None для пустого, битого
+    или неподписанного курсора. Значение дополнительно приводит к типу поля KeysetPaginator.
+    """
+    if not cursor:
+        return None
+    try:
+        sort, value, pk, reverse = signing.loads(cursor, salt=CURSOR_SALT)
+        return str(sort), value, int(pk), bool(reverse)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Пагинация по курсору (keyset) вместо OFFSET/COUNT.
+    Страница выбирается условием (поле, id) > (значение, id) по составному индексу,
+    поэтому страница N стоит столько же, сколько первая.
+    sort_fields/default_sort задают допустимые сортировки (по умолчанию - каталога).
+    """
+
+    def __init__(self, queryset, sort=None, per_page=10, sort_fields=PRODUCT_SORT_FIELDS, default_sort=DEFAULT_SORT):
+        self.queryset = queryset
+        self.sort_key, self.field, self.descending = parse_sort(sort, sort_fields, default_sort)
+        self.sort = f"{'-' if self.descending else ''}{self.sort_key}"
+        self.per_page = per_page
+
+    def _position(self, cursor):
+        """
+        (значение, id, назад) из курсора. Курсор другой сортировки, значение не того типа
+        или NULL считаются битым курсором - отдается первая страница.
+        """
+        position = decode_cursor(cursor)
+        if position is None:
+            return None
+        sort, value, pk, reverse = position
+        if sort != self.sort or value is None:
+            return None
+        try:
+            value = self.queryset.model._meta.get_field(self.field).to_python(value)
+        except (ValidationError, ValueError, TypeError):
+            return None
+        return value, pk, reverse
+
+    def _ordering(self, reverse):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        return [f'{prefix}{self.field}', f'{prefix}id'], descending
+
+    def _after(self, value, pk, descending):
+        op = 'lt' if descending else 'gt'
+        if self.field == 'id':
+            return Q(**{f'id__{op}': pk})
+        return Q(**{f'{self.field}__{op}': value}) | Q(**{self.field: value, f'id__{op}': pk})
+
+    def _key(self, obj):
+        # Поддерживаются и модели, и строки .values()
+        if isinstance(obj, dict):
+            return obj[self.field], obj['id']
+        return getattr(obj, self.field), obj.pk
+
+    def get_page(self, cursor=None):
+        position = self._position(cursor)
+        reverse = bool(position and position[2])
+
+        ordering, descending = self._ordering(reverse)
+        queryset = self.queryset.order_by(*ordering)
+        if position:
+            queryset = queryset.filter(self._after(position[0], position[1], descending))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            first, last = rows[0], rows[-1]
+            # Движемся назад: "ещё" означает наличие предыдущей страницы
+            if (has_more and not reverse) or (reverse and position):
+                next_cursor = encode_cursor(self.sort, *self._key(last))
+            if (has_more and reverse) or (position and not reverse):
+                previous_cursor = encode_cursor(self.sort, *self._key(first), reverse=True)
+
+        return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,88 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.crypto import salted_hmac
+
+from .generations import cache_is_shared, versioned_key
+
+# Пространство ключей ролей: поколение меняется при переименовании и удалении групп
+ROLES = 'roles'
+# Сброс идет через общий кэш (settings.CACHES); TTL - страховка от гонки чтения со сбросом
+# и от пропущенного сброса: устаревшие роли и эпоха живут не дольше нескольких минут
+ROLES_TTL = 2 * 60
+AUTH_STATE_TTL = 5 * 60
+
+MANAGER = 'manager'
+CLIENT = 'client'
+
+
+def _roles_key(user_id):
+    return versioned_key(ROLES, user_id)
+
+
+def _auth_state_key(user_id):
+    return versioned_key(ROLES, 'auth', user_id)
+
+
+def user_roles(user):
+    """
+    Имена групп пользователя. Запоминаются на объекте пользователя (несколько проверок
+    за запрос) и в общем кэше; в базу - только при промахе. Сброс - invalidate_roles (signals.py).
+    С кэшем в памяти процесса между запросами роли не кэшируются: сброс увидел бы
+    только процесс, изменивший группы.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        shared = cache_is_shared()
+        key = _roles_key(user.pk)
+        roles = cache.get(key) if shared else None
+        if roles is None:
+            roles = frozenset(Group.objects.filter(user=user.pk).values_list('name', flat=True))
+            if shared:
+                cache.set(key, roles, ROLES_TTL)
+        user._roles = roles
+    return roles
+
+
+def has_role(user, role):
+    return role in user_roles(user)
+
+
+def _compute_auth_state(user_id):
+    row = get_user_model().objects.filter(pk=user_id).values_list('is_active', 'password').first()
+    if row is None:
+        return False, '', []
+    is_active, password = row
+    roles = sorted(Group.objects.filter(user=user_id).values_list('name', flat=True))
+    # Эпоха выводится из строки пользователя: вытеснение из кэша не отзывает токены,
+    # и во всех процессах она одинакова
+    epoch = salted_hmac('auth-epoch', f'{user_id}:{is_active}:{password}:{",".join(roles)}').hexdigest()[:16]
+    return is_active, epoch, roles
+
+
+def auth_state(user_id):
+    """
+    (активен ли, эпоха, роли) для токенов без запроса пользователя (api/authentication.py).
+    Эпоха меняется при блокировке, смене пароля и ролей. Из кэша, при промахе - двумя запросами.
+    Кэш в памяти процесса не годится: сброс после блокировки увидел бы только процесс,
+    сохранивший пользователя, - тогда состояние каждый раз читается из базы.
+    """
+    if not cache_is_shared():
+        return _compute_auth_state(user_id)
+    key = _auth_state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = _compute_auth_state(user_id)
+        cache.set(key, state, AUTH_STATE_TTL)
+    return state
+
+
+def invalidate_roles(user_ids):
+    """Сбрасывает роли и эпохи пользователей после коммита изменения их групп или учетной записи"""
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: cache.delete_many(
+        [_roles_key(user_id) for user_id in user_ids] + [_auth_state_key(user_id) for user_id in user_ids]
+    ))
@@ -0,0 +1,168 @@
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (ArchivedOrder, DailyCategorySales, DailyProductSales, Order, OrderItem, Product,
+                     RollupWatermark)
+
+SALES_ROLLUP = 'sales'
+# Заказ, сохраненный чуть раньше водяного знака, но закоммиченный после него, не теряется:
+# изменения перечитываются с перекрытием (пересчет дня идемпотентен)
+ROLLUP_OVERLAP = timedelta(minutes=5)
+# Полный пересчет идет окнами по стольку дней - каждое окно отдельной транзакцией
+REBUILD_CHUNK_DAYS = 31
+# Ключ pg_advisory_lock первичного полного пересчета из refresh_sales_rollups
+REBUILD_LOCK_ID = 0x5A1E5
+
+
+def _lines_sql():
+    """
+    Строки продаж (день, товар, выручка, единицы, заказ) из горячих таблиц и из архива
+    (myapp/archive.py), чтобы перенос заказов в архив не менял агрегаты. Отмененные не учитываются.
+    Параметры: часовой пояс, начало и конец интервала created_at - дважды.
+    """
+    order = Order._meta.db_table
+    item = OrderItem._meta.db_table
+    archived = ArchivedOrder._meta.db_table
+    return f"""
+        SELECT (o.created_at AT TIME ZONE %s)::date AS day, i.product_id,
+               i.price * i.quantity AS revenue, i.quantity AS units, o.id AS order_id
+        FROM {item} i JOIN {order} o ON o.id = i.order_id
+        WHERE o.status <> 'cancelled' AND o.created_at >= %s AND o.created_at < %s
+        UNION ALL
+        SELECT (a.created_at AT TIME ZONE %s)::date, x.product_id,
+               x.price * x.quantity, x.quantity, a.id
+        FROM {archived} a CROSS JOIN jsonb_to_recordset(a.items) AS x(product_id bigint, quantity integer, price numeric)
+        WHERE a.status <> 'cancelled' AND a.created_at >= %s AND a.created_at < %s
+    """
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _day_ranges(days):
+    """Отсортированные дни -> непрерывные отрезки [(первый, последний), ...]"""
+    ranges = []
+    for day in days:
+        if ranges and day - ranges[-1][1] == timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return ranges
+
+
+def recompute_days(days):
+    """
+    Пересчитывает агрегаты целиком за указанные дни: DELETE и два INSERT ... SELECT
+    по интервалу created_at (индекс по заказам). Разрозненные дни пересчитываются
+    отрезками подряд идущих дней, поэтому стоимость - объем продаж этих дней, а не
+    всего промежутка между ними (поздно измененный старый заказ не тянет за собой месяцы).
+    """
+    days = sorted(set(days))
+    if not days:
+        return 0
+    tz = timezone.get_current_timezone_name()
+    lines = _lines_sql()
+    product_table = DailyProductSales._meta.db_table
+    category_table = DailyCategorySales._meta.db_table
+
+    rows = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for first, last in _day_ranges(days):
+            start, end = _day_bounds(first)[0], _day_bounds(last)[1]
+            params = [tz, start, end, tz, start, end]
+            cursor.execute(f'DELETE FROM {product_table} WHERE day BETWEEN %s AND %s', [first, last])
+            cursor.execute(f'DELETE FROM {category_table} WHERE day BETWEEN %s AND %s', [first, last])
+            cursor.execute(
+                f"""
+                INSERT INTO {product_table} (day, product_id, revenue, units, orders)
+                SELECT day, product_id, SUM(revenue), SUM(units), COUNT(DISTINCT order_id)
+                FROM ({lines}) lines
+                WHERE day BETWEEN %s AND %s
+                GROUP BY day, product_id
+                """,
+                params + [first, last],
+            )
+            rows += cursor.rowcount
+            # Категория - текущая категория товара; товары, удаленные из каталога, попадают в NULL
+            cursor.execute(
+                f"""
+                INSERT INTO {category_table} (day, category_id, revenue, units, orders)
+                SELECT lines.day, p.category_id, SUM(lines.revenue), SUM(lines.units), COUNT(DISTINCT lines.order_id)
+                FROM ({lines}) lines LEFT JOIN {Product._meta.db_table} p ON p.id = lines.product_id
+                WHERE lines.day BETWEEN %s AND %s
+                GROUP BY lines.day, p.category_id
+                """,
+                params + [first, last],
+            )
+    return rows
+
+
+def refresh_sales_rollups():
+    """
+    Инкрементальное обновление: пересчитываются только дни, в которых есть заказы,
+    созданные или измененные после водяного знака. Строка водяного знака блокируется,
+    поэтому два запуска одновременно не идут. Возвращает пересчитанные дни
+    (None - был или уже идет полный пересчет).
+    """
+    with transaction.atomic():
+        state, _ = RollupWatermark.objects.select_for_update().get_or_create(name=SALES_ROLLUP)
+        if state.watermark is not None:
+            now = timezone.now()
+            days = list(
+                Order.objects.filter(updated_at__gte=state.watermark - ROLLUP_OVERLAP)
+                .annotate(day=TruncDate('created_at')).order_by('day').values_list('day', flat=True).distinct()
+            )
+            recompute_days(days)
+            state.watermark = now
+            state.save(update_fields=['watermark', 'updated_at'])
+            return days
+
+    # Первый запуск - полный пересчет истории. Он идет окнами по отдельным транзакциям,
+    # а не под блокировкой строки водяного знака; второй такой же запуск, пока первый
+    # не закончил, ничего не делает
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [REBUILD_LOCK_ID])
+        if not cursor.fetchone()[0]:
+            return None
+    try:
+        rebuild_sales_rollups()
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [REBUILD_LOCK_ID])
+    return None
+
+
+def rebuild_sales_rollups(since=None, until=None, progress=None):
+    """
+    Полный пересчет за период (по умолчанию - вся история, включая архив) окнами
+    по REBUILD_CHUNK_DAYS дней; в конце водяной знак ставится на момент начала пересчета.
+    Возвращает число строк товар-день.
+    """
+    started = timezone.now()
+    until = until or timezone.localdate(started)
+    if since is None:
+        first = [
+            moment for moment in (
+                Order.objects.order_by('created_at').values_list('created_at', flat=True).first(),
+                ArchivedOrder.objects.order_by('created_at').values_list('created_at', flat=True).first(),
+            ) if moment is not None
+        ]
+        since = timezone.localdate(min(first)) if first else until
+
+    total = 0
+    day = since
+    while day <= until:
+        chunk = [day + timedelta(days=offset) for offset in range(REBUILD_CHUNK_DAYS)
+                 if day + timedelta(days=offset) <= until]
+        total += recompute_days(chunk)
+        if progress:
+            progress(chunk[-1], total)
+        day = chunk[-1] + timedelta(days=1)
+
+    RollupWatermark.objects.update_or_create(name=SALES_ROLLUP, defaults={'watermark': started})
+    return total
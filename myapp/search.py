@@ -0,0 +1,46 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db.models import F
+
+from .models import Product
+
+SEARCH_CONFIG = 'russian'
+SEARCH_LIMIT = 50
+
+
+def product_search_vector():
+    """Выражение tsvector: название весомее описания"""
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('description', weight='B', config=SEARCH_CONFIG))
+
+
+def refresh_search_vector(queryset):
+    """Пересчитывает search_vector одним UPDATE для всей выборки"""
+    return queryset.update(search_vector=product_search_vector())
+
+
+def search_products(q, queryset=None, limit=SEARCH_LIMIT):
+    """
+    Ранжированный поиск по названию и описанию.
+    Сначала полнотекстовый (GIN по search_vector, русская морфология),
+    если ничего не найдено - по триграммам названия (опечатки, GIN gin_trgm_ops).
+    """
+    q = (q or '').strip()
+    if not q:
+        return []
+    if queryset is None:
+        queryset = Product.objects.with_images()
+
+    query = SearchQuery(q, config=SEARCH_CONFIG, search_type='websearch')
+    results = list(
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', 'id')[:limit]
+    )
+    if results:
+        return results
+
+    return list(
+        queryset.filter(name__trigram_word_similar=q)
+        .annotate(rank=TrigramWordSimilarity(q, 'name'))
+        .order_by('-rank', 'id')[:limit]
+    )
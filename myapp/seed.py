@@ -1,5 +1,6 @@
 from faker import Faker
 import random
+from .events import bulk_product_events
 from .models import Product, Category
 
 fake = Faker('ru_RU')
@@ -42,84 +43,85 @@ def run():
         categories.append(cat)
         print(f"Категория '{cat_name}' создана")
 
-    # Создаём тематические продукты
-    for _ in range(100):  # Увеличим количество товаров
-        cat = random.choice(categories)
-        cat_info = category_data[cat.name]
+    # Создаём тематические продукты одним событием вместо письма на каждый товар
+    with bulk_product_events():
+        for _ in range(100):  # Увеличим количество товаров
+            cat = random.choice(categories)
+            cat_info = category_data[cat.name]
 
-        brand = random.choice(cat_info['brands'])
-        model = random.choice(cat_info['models'])
-        suffix = random.choice(cat_info['suffixes'])
+            brand = random.choice(cat_info['brands'])
+            model = random.choice(cat_info['models'])
+            suffix = random.choice(cat_info['suffixes'])
 
-        # Формируем реалистичное название
-        product_name = f"{brand} {model} {suffix}"
+            # Формируем реалистичное название
+            product_name = f"{brand} {model} {suffix}"
 
-        # Генерируем реалистичные цены в зависимости от категории
-        if cat.name == 'Ноутбуки':
-            price = round(random.uniform(1500, 4000), 2)
-        elif cat.name == 'Смартфоны':
-            price = round(random.uniform(800, 5000), 2)
-        elif cat.name == 'Планшеты':
-            price = round(random.uniform(800, 5000), 2)
-        elif cat.name == 'Наушники':
-            price = round(random.uniform(20, 250), 2)
-        else:  # Аксессуары
-            price = round(random.uniform(5, 60), 2)
+            # Генерируем реалистичные цены в зависимости от категории
+            if cat.name == 'Ноутбуки':
+                price = round(random.uniform(1500, 4000), 2)
+            elif cat.name == 'Смартфоны':
+                price = round(random.uniform(800, 5000), 2)
+            elif cat.name == 'Планшеты':
+                price = round(random.uniform(800, 5000), 2)
+            elif cat.name == 'Наушники':
+                price = round(random.uniform(20, 250), 2)
+            else:  # Аксессуары
+                price = round(random.uniform(5, 60), 2)
 
-        # Генерируем тематическое описание
-        descriptions = {
-            'Ноутбуки': [
-                f"Мощный {brand} {model} для работы и игр",
-                f"Производительный ноутбук с отличной автономностью",
-                f"Игровой ноутбук с современной видеокартой",
-                f"Ультрабук для мобильных профессионалов"
-            ],
-            'Смартфоны': [
-                f"Смартфон {brand} {model} с продвинутой камерой",
-                f"Мощный флагман с большим временем работы",
-                f"Стильный дизайн и высокая производительность",
-                f"Инновационные функции и премиальная сборка"
-            ],
-            'Планшеты': [
-                f"Универсальный планшет для работы и развлечений",
-                f"Идеален для просмотра контента и творчества",
-                f"Мощный процессор и яркий дисплей",
-                f"Компактный и производительный"
-            ],
-            'Наушники': [
-                f"Качественный звук и комфортная посадка",
-                f"Продолжительное время работы от аккумулятора",
-                f"Превосходное шумоподавление и чистота звука",
-                f"Стильный дизайн и премиальные материалы"
-            ],
-            'Аксессуары': [
-                f"Высокое качество и надежность",
-                f"Совместимость с большинством устройств",
-                f"Быстрая зарядка и безопасность",
-                f"Стильный дизайн и практичность"
-            ]
-        }
+            # Генерируем тематическое описание
+            descriptions = {
+                'Ноутбуки': [
+                    f"Мощный {brand} {model} для работы и игр",
+                    f"Производительный ноутбук с отличной автономностью",
+                    f"Игровой ноутбук с современной видеокартой",
+                    f"Ультрабук для мобильных профессионалов"
+                ],
+                'Смартфоны': [
+                    f"Смартфон {brand} {model} с продвинутой камерой",
+                    f"Мощный флагман с большим временем работы",
+                    f"Стильный дизайн и высокая производительность",
+                    f"Инновационные функции и премиальная сборка"
+                ],
+                'Планшеты': [
+                    f"Универсальный планшет для работы и развлечений",
+                    f"Идеален для просмотра контента и творчества",
+                    f"Мощный процессор и яркий дисплей",
+                    f"Компактный и производительный"
+                ],
+                'Наушники': [
+                    f"Качественный звук и комфортная посадка",
+                    f"Продолжительное время работы от аккумулятора",
+                    f"Превосходное шумоподавление и чистота звука",
+                    f"Стильный дизайн и премиальные материалы"
+                ],
+                'Аксессуары': [
+                    f"Высокое качество и надежность",
+                    f"Совместимость с большинством устройств",
+                    f"Быстрая зарядка и безопасность",
+                    f"Стильный дизайн и практичность"
+                ]
+            }
 
-        description = random.choice(descriptions[cat.name])
+            description = random.choice(descriptions[cat.name])
 
-        # Добавляем детали к описанию
-        features = [
-            "Высокое качество сборки.",
-            "Современный дизайн.",
-            "Энергоэффективность.",
-            "Простота в использовании.",
-            "Гарантия производителя.",
-            "Экологичные материалы."
-        ]
+            # Добавляем детали к описанию
+            features = [
+                "Высокое качество сборки.",
+                "Современный дизайн.",
+                "Энергоэффективность.",
+                "Простота в использовании.",
+                "Гарантия производителя.",
+                "Экологичные материалы."
+            ]
 
-        full_description = f"{description} {random.choice(features)}"
+            full_description = f"{description} {random.choice(features)}"
 
-        # Создаем продукт
-        Product.objects.create(
-            name=product_name,
-            description=full_description,
-            price=price,
-            in_stock=random.choice([True, True, True, False]),  # 75% chance in stock
-            category=cat
-        )
+            # Создаем продукт
+            Product.objects.create(
+                name=product_name,
+                description=full_description,
+                price=price,
+                in_stock=random.choice([True, True, True, False]),  # 75% chance in stock
+                category=cat
+            )
 
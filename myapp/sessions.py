@@ -0,0 +1,156 @@
+"""
+Сессии витрины: SESSION_ENGINE = 'myapp.sessions'.
+
+Горячие сессии живут в кэше (Redis в продакшене) в том же сжатом подписанном виде,
+что и в django_session, а в базу попадают пачкой задачей flush_sessions раз в окно
+SESSION_FLUSH_WINDOW. Сессия, которую запрос не изменил, не пишется ни в кэш, ни в базу.
+Создание сессии (новый ключ) сразу пишется в базу - уникальность ключа проверяет она.
+Если общий кэш потерян, теряются изменения последнего окна: в сессии лежат только
+корзина гостя и служебные данные входа, поэтому это допустимо.
+
+Отложенная запись возможна только с общим кэшем (settings.CACHES - Redis). С кэшем
+в памяти процесса (LocMemCache) воркер Celery не видит очередь, а другие веб-процессы -
+свежую копию сессии, поэтому тогда движок читает и пишет сразу базу, как стандартный db.
+"""
+import logging
+import time
+
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import cache
+from django.utils import timezone
+
+from .generations import cache_is_shared
+
+logger = logging.getLogger("api")
+
+# Сколько секунд изменения сессий копятся в кэше до записи в базу
+SESSION_FLUSH_WINDOW = 30
+
+KEY_PREFIX = 'sessions:'
+
+
+def dirty_prefix(window):
+    return f'sessions_dirty:{window}'
+
+
+class SessionStore(DBStore):
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        # Сериализованное содержимое на момент загрузки - для проверки "изменилось ли"
+        self._clean = None
+        self._write_behind = cache_is_shared()
+
+    @property
+    def cache_key(self):
+        return KEY_PREFIX + self._get_or_create_session_key()
+
+    def _remember(self, data):
+        self._clean = self.serializer().dumps(data)
+
+    def load(self):
+        if not self._write_behind:
+            data = super().load()
+            self._remember(data)
+            return data
+        try:
+            cached = cache.get(self.cache_key)
+        except Exception:
+            cached = None
+        if cached is not None:
+            session_data, expire_date = cached
+            if expire_date > timezone.now():
+                data = self.decode(session_data)
+                self._remember(data)
+                return data
+
+        session = self._get_session_from_db()
+        if session is None:
+            return {}
+        cache.set(self.cache_key, (session.session_data, session.expire_date),
+                  self.get_expiry_age(expiry=session.expire_date))
+        data = self.decode(session.session_data)
+        self._remember(data)
+        return data
+
+    def exists(self, session_key):
+        if not self._write_behind:
+            return super().exists(session_key)
+        return cache.get(KEY_PREFIX + session_key) is not None or super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        if not must_create and self._clean is not None and self.serializer().dumps(data) == self._clean:
+            # modified выставляется и на запись того же значения - такую сессию не переписываем
+            return
+        if not self._write_behind:
+            super().save(must_create=must_create)
+        else:
+            if must_create:
+                super().save(must_create=True)
+            cache.set(self.cache_key, (self.encode(data), self.get_expiry_date()), self.get_expiry_age())
+            if not must_create and not _mark_dirty(self.session_key):
+                super().save()
+        self._remember(data)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is None:
+            return
+        if self._write_behind:
+            cache.delete(KEY_PREFIX + session_key)
+        super().delete(session_key)
+
+
+def _mark_dirty(session_key):
+    """
+    Ставит сессию в очередь записи текущего окна: одна отметка на сессию за окно,
+    первая отметка окна планирует flush_sessions на его конец. False - задачу
+    поставить не удалось, запись нужно сделать сразу.
+    """
+    from .tasks import flush_sessions
+
+    window = int(time.time() // SESSION_FLUSH_WINDOW)
+    prefix = dirty_prefix(window)
+    ttl = SESSION_FLUSH_WINDOW * 10
+    if not cache.add(f'{prefix}:key:{session_key}', True, ttl):
+        return True
+
+    cache.add(f'{prefix}:count', 0, ttl)
+    index = cache.incr(f'{prefix}:count')
+    cache.set(f'{prefix}:{index}', session_key, ttl)
+    if cache.add(f'{prefix}:scheduled', True, ttl):
+        countdown = (window + 1) * SESSION_FLUSH_WINDOW - time.time() + 1
+        try:
+            flush_sessions.apply_async(args=[window], countdown=max(countdown, 0))
+        except Exception as e:
+            logger.error(f"Не удалось запланировать запись сессий: {e}")
+            cache.delete_many([f'{prefix}:scheduled', f'{prefix}:key:{session_key}'])
+            return False
+    return True
+
+
+def flush_dirty_sessions(window):
+    """
+    Пишет сессии окна из кэша в django_session одним upsert. Отметки окна снимаются,
+    поэтому изменение, пришедшее после записи (часы другого процесса, eager-режим),
+    запланирует запись заново. Возвращает число записанных сессий.
+    """
+    model = SessionStore.get_model_class()
+    prefix = dirty_prefix(window)
+    count = cache.get(f'{prefix}:count') or 0
+    slots = [f'{prefix}:{index}' for index in range(1, count + 1)]
+    session_keys = set(cache.get_many(slots).values())
+    markers = [f'{prefix}:key:{session_key}' for session_key in session_keys]
+    cache.delete_many(slots + markers + [f'{prefix}:scheduled'])
+
+    cached = cache.get_many([KEY_PREFIX + session_key for session_key in session_keys])
+    rows = [
+        model(session_key=key[len(KEY_PREFIX):], session_data=session_data, expire_date=expire_date)
+        for key, (session_data, expire_date) in cached.items()
+    ]
+    # Сессии, удаленные после отметки (выход), в кэше уже отсутствуют и не воскресают
+    model.objects.bulk_create(rows, update_conflicts=True, unique_fields=['session_key'],
+                              update_fields=['session_data', 'expire_date'])
+    return len(rows)
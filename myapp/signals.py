@@ -1,27 +1,152 @@
-from django.db.models.signals import post_save
+from django.db import connections
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_migrate, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from .models import Product
-from .tasks import send_new_product_email
+from django.contrib.auth.models import Group
+from django.contrib.auth.signals import user_logged_in
+from .cart import invalidate_cart_summary, merge_anonymous_cart
+from .changes import install_change_trigger
+from .events import in_bulk, product_created, product_payload
+from .facets import cell_key, update_cube
+from .generations import CATALOG, bump_generation
+from .models import CartItem, Category, Product, ProductImage, StockReservation
+from .roles import ROLES, invalidate_roles
+from .search import refresh_search_vector
+from .stock import release_stock
+
+
+@receiver(pre_migrate)
+def create_postgres_extensions(sender, using, **kwargs):
+    """pg_trgm нужен для триграммного индекса и поиска по названию"""
+    if sender.name != 'myapp':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+@receiver(post_migrate)
+def create_product_change_trigger(sender, using, **kwargs):
+    """Триггер журнала изменений товаров (myapp/changes.py) - таблицы к этому моменту уже есть"""
+    if sender.name != 'myapp':
+        return
+    install_change_trigger(using)
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    # Корзина анонимного посетителя становится корзиной пользователя (общей с API)
+    if request is not None:
+        merge_anonymous_cart(request, user)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def roles_membership_signal(sender, instance, action, reverse, pk_set, **kwargs):
+    """Пользователя добавили в группу или убрали из нее - роли в кэше устарели"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # Объект пользователя мог уже запомнить роли (user_roles)
+        instance.__dict__.pop('_roles', None)
+        invalidate_roles([instance.pk])
+    elif action == 'post_clear':
+        # group.user_set.clear(): участники уже неизвестны - сбрасываем все роли
+        bump_generation(ROLES)
+    else:
+        invalidate_roles(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def roles_group_signal(sender, **kwargs):
+    bump_generation(ROLES)
+
+
+@receiver(post_save, sender=get_user_model())
+def auth_state_user_signal(sender, instance, created, update_fields=None, **kwargs):
+    """Блокировка или смена пароля меняют эпоху токенов; вход (last_login) - нет"""
+    if created or (update_fields is not None and set(update_fields) == {'last_login'}):
+        return
+    invalidate_roles([instance.pk])
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def cart_summary_signal(sender, instance, **kwargs):
+    invalidate_cart_summary(instance.cart_id)
+
+
+@receiver(post_delete, sender=StockReservation)
+def reservation_delete_signal(sender, instance, **kwargs):
+    # Резерв удален через ORM (админка, каскад при удалении корзины) - товар возвращается на склад.
+    # Резервы, снятые SQL в myapp/stock.py, сигналов не шлют и возвращаются там же
+    release_stock({instance.product_id: instance.quantity})
+
+
+@receiver(post_save, sender=Product)
+def product_search_vector_signal(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    refresh_search_vector(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def catalog_generation_signal(sender, **kwargs):
+    # Любое изменение каталога (API, админка, shell) делает кэш ответов каталога устаревшим
+    bump_generation(CATALOG)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_touch_signal(sender, instance, **kwargs):
+    # Изображение входит в представление товара - сдвигаем updated_at для ETag/Last-Modified
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+def _facet_key(product):
+    return cell_key(product.category_id, product.in_stock, product.discount_percent, product.price)
+
+
+@receiver(pre_save, sender=Product)
+def product_facets_pre_save(sender, instance, **kwargs):
+    # Запоминаем старую ячейку куба фасетов, чтобы перенести товар инкрементально
+    instance._facet_old_key = None
+    if instance.pk and not instance._state.adding:
+        old = (Product.objects.filter(pk=instance.pk)
+               .values('category_id', 'in_stock', 'discount_percent', 'price').first())
+        if old:
+            instance._facet_old_key = cell_key(**old)
+
+
+@receiver(post_save, sender=Product)
+def product_facets_post_save(sender, instance, **kwargs):
+    update_cube(old_key=getattr(instance, '_facet_old_key', None), new_key=_facet_key(instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_facets_post_delete(sender, instance, **kwargs):
+    update_cube(old_key=_facet_key(instance))
 
 
 @receiver(post_save, sender=Product)
 def product_create_signal(sender, instance, created, **kwargs):
     if created:
-        print(f"Создан новый продукт: {instance.name}")
-
         created_by = "Система"
         if hasattr(instance, 'created_by') and instance.created_by:
             created_by = f"{instance.created_by.username} ({instance.created_by.email})"
         elif hasattr(instance, 'user') and instance.user:
             created_by = f"{instance.user.username} ({instance.user.email})"
 
-        send_new_product_email.delay(
-            product_id=instance.id,
-            product_name=instance.name,
-            product_price=getattr(instance, 'price', 'Не указана'),
-            created_by=created_by
-        )
+        # Письмо не отправляется на каждую строку: в bulk_product_events() товар
+        # попадает в общую пачку, иначе - в дайджест за короткое окно времени
+        if not in_bulk():
+            print(f"Создан новый продукт: {instance.name}")
+        product_created(product_payload(instance, created_by))
 
-    else:
-        print(f"Обновлен продукт: {instance.name}")
\ No newline at end of file
+    elif not in_bulk():
+        print(f"Обновлен продукт: {instance.name}")
@@ -0,0 +1,137 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .facets import invalidate_facets
+from .generations import CATALOG, bump_generation
+from .models import CartItem, Product, StockReservation
+
+# Сколько корзина держит товар после перехода к оформлению
+RESERVATION_TTL = 15 * 60
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Недостаточно товара на складе: {', '.join(map(str, self.product_ids))}")
+
+
+def adjust_stock(deltas):
+    """
+    Меняет остатки на {product_id: n}: n > 0 списывает, n < 0 возвращает на склад.
+    Строки блокируются в порядке id (без взаимных блокировок между корзинами) и
+    обновляются одним UPDATE с условием stock >= n, поэтому блокировка держится
+    только до конца текущей транзакции - вызывать как можно ближе к коммиту.
+    Нехватка хотя бы одного товара - OutOfStock, ничего не списывается.
+    Товары без учета остатка (stock IS NULL) пропускаются.
+    Возвращает id товаров, чей остаток изменен.
+    """
+    deltas = {product_id: n for product_id, n in deltas.items() if n}
+    if not deltas:
+        return set()
+    table = Product._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT id, stock, in_stock FROM {table} '
+            f'WHERE id = ANY(%s::bigint[]) AND stock IS NOT NULL ORDER BY id FOR UPDATE',
+            [list(deltas)],
+        )
+        rows = cursor.fetchall()
+        short = [product_id for product_id, stock, _ in rows if stock < deltas[product_id]]
+        if short:
+            raise OutOfStock(short)
+        if not rows:
+            return set()
+
+        product_ids = [row[0] for row in rows]
+        cursor.execute(
+            f"""
+            UPDATE {table} p
+            SET stock = p.stock - rows.quantity,
+                in_stock = p.stock - rows.quantity > 0,
+                updated_at = CASE WHEN (p.stock - rows.quantity > 0) <> p.in_stock THEN %s ELSE p.updated_at END
+            FROM unnest(%s::bigint[], %s::integer[]) AS rows(product_id, quantity)
+            WHERE p.id = rows.product_id AND p.stock >= rows.quantity
+            RETURNING p.id, p.in_stock
+            """,
+            [timezone.now(), product_ids, [deltas[product_id] for product_id in product_ids]],
+        )
+        updated = dict(cursor.fetchall())
+
+    was_in_stock = {product_id: in_stock for product_id, _, in_stock in rows}
+    if any(updated[product_id] != was_in_stock[product_id] for product_id in updated):
+        # Товар закончился или вернулся в продажу - меняются фильтр "в наличии" и карточка
+        transaction.on_commit(invalidate_facets)
+        bump_generation(CATALOG)
+    return set(updated)
+
+
+def _take_reservations(cart_id):
+    """Забирает резервы корзины (DELETE ... RETURNING): параллельный возврат просроченных их уже не увидит"""
+    table = StockReservation._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE cart_id = %s RETURNING product_id, quantity', [cart_id])
+        return dict(cursor.fetchall())
+
+
+def _sync_stock(cart_id, items):
+    held = _take_reservations(cart_id)
+    changed = adjust_stock({
+        product_id: items.get(product_id, 0) - held.get(product_id, 0)
+        for product_id in items.keys() | held.keys()
+    })
+    # Товары, которые корзина теперь держит; резерв без изменения количества тоже остается за ней
+    return {product_id for product_id in changed | held.keys() if items.get(product_id)}
+
+
+def reserve_cart(cart_id, ttl=RESERVATION_TTL):
+    """
+    Резервирует остатки под текущее содержимое корзины на ttl секунд: докупленное
+    списывается, убранное из корзины возвращается, срок резерва продлевается.
+    Короткая отдельная транзакция; при нехватке - OutOfStock.
+    Возвращает время окончания резерва.
+    """
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+    with transaction.atomic():
+        items = dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+        reserved = _sync_stock(cart_id, items)
+        StockReservation.objects.bulk_create([
+            StockReservation(cart_id=cart_id, product_id=product_id, quantity=items[product_id],
+                             expires_at=expires_at)
+            for product_id in sorted(reserved)
+        ])
+    return expires_at
+
+
+def commit_cart_stock(cart_id, items):
+    """
+    Списание при оформлении заказа {product_id: qty}: резервы корзины становятся
+    продажей, недостающее списывается условным UPDATE. Вызывать последним шагом
+    транзакции заказа - блокировка строк товаров длится только до ее коммита.
+    """
+    _sync_stock(cart_id, items)
+
+
+def release_expired_reservations():
+    """Возвращает на склад просроченные резервы одним DELETE и одним UPDATE. Возвращает число резервов"""
+    table = StockReservation._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH expired AS (
+                    DELETE FROM {table} WHERE expires_at <= %s RETURNING product_id, quantity
+                )
+                SELECT product_id, SUM(quantity), COUNT(*) FROM expired GROUP BY product_id
+                """,
+                [timezone.now()],
+            )
+            rows = cursor.fetchall()
+        adjust_stock({product_id: -quantity for product_id, quantity, _ in rows})
+    return sum(count for _, _, count in rows)
+
+
+def release_stock(items):
+    """Возврат на склад {product_id: qty} (отмена заказа, удаление резерва вручную)"""
+    adjust_stock({product_id: -quantity for product_id, quantity in items.items()})
@@ -11,6 +11,9 @@ import json
 
 logger = logging.getLogger("api")
 
+# Сколько продуктов перечислять в письме-дайджесте
+DIGEST_MAX_LISTED = 50
+
 
 @shared_task
 def add(x, y):
@@ -55,28 +58,86 @@ def send_new_product_email(product_id, product_name, product_price, created_by):
         return False
 
 
+@shared_task
+def send_new_products_digest(products, total=None):
+    """
+    Одно письмо на пачку созданных продуктов (массовая загрузка или окно одиночных созданий).
+    products - описания (для больших пачек - первые DIGEST_MAX_LISTED), total - сколько создано всего
+    """
+    if not products:
+        return False
+    total = total or len(products)
+    if total == 1:
+        return send_new_product_email(**products[0])
+
+    try:
+        subject = f'🎉 Создано новых продуктов: {total}'
+
+        listed = products[:DIGEST_MAX_LISTED]
+        html_message = render_to_string('emails/new_products_digest.html', {
+            'products': listed,
+            'total': total,
+            'not_listed': max(total - len(listed), 0),
+        })
+
+        send_mail(
+            subject=subject,
+            message=strip_tags(html_message),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            recipient_list=settings.ADMIN_EMAILS,
+            html_message=html_message,
+            fail_silently=False,
+        )
+
+        logger.info(f"✅ Email о создании {total} продуктов отправлен на {settings.ADMIN_EMAILS}")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки email о создании продуктов: {e}")
+        return False
+
+
+@shared_task
+def flush_product_events(window):
+    """Собирает одиночные создания продуктов за окно времени и отправляет один дайджест"""
+    from .events import window_prefix
+
+    prefix = window_prefix(window)
+    count = cache.get(f'{prefix}:count') or 0
+    keys = [f'{prefix}:{index}' for index in range(1, count + 1)]
+    payloads = cache.get_many(keys)
+    cache.delete_many(keys + [f'{prefix}:count'])
+
+    products = [payloads[key] for key in keys if key in payloads]
+    return send_new_products_digest(products)
+
+
 @shared_task
 def send_daily_products_report():
     """
-    Ежедневный отчет о созданных продуктах
+    Ежедневный отчет о созданных продуктах; сводка изменений и удалений - по журналу (myapp/changes.py)
     """
     try:
         from django.utils import timezone
+        from .changes import change_counts
         from .models import Product
         from datetime import timedelta
 
         yesterday = timezone.now() - timedelta(days=1)
-        new_products = Product.objects.filter(created_at__gte=yesterday)
+        new_products = list(Product.objects.filter(created_at__gte=yesterday).order_by('id').values_list('id', 'name'))
+        counts = change_counts(yesterday)
 
         subject = f'📊 Ежедневный отчет по продуктам ({yesterday.strftime("%d.%m.%Y")})'
 
         message = f"""
         Ежедневный отчет по новым продуктам:
 
-        Всего новых продуктов за день: {new_products.count()}
+        Всего новых продуктов за день: {len(new_products)}
+        Изменено продуктов: {counts.get('updated', 0)}
+        Удалено продуктов: {counts.get('deleted', 0)}
 
         Список новых продуктов:
-        {chr(10).join([f"- {product.name} (ID: {product.id})" for product in new_products])}
+        {chr(10).join([f"- {name} (ID: {product_id})" for product_id, name in new_products])}
 
         ---
         Отчет сгенерирован автоматически.
@@ -90,7 +151,7 @@ def send_daily_products_report():
             fail_silently=False,
         )
 
-        logger.info(f"✅ Ежедневный отчет отправлен. Новых продуктов: {new_products.count()}")
+        logger.info(f"✅ Ежедневный отчет отправлен. Новых продуктов: {len(new_products)}")
         return True
 
     except Exception as e:
@@ -98,3 +159,98 @@ def send_daily_products_report():
         return False
 
 
+@shared_task
+def import_products_task(job_id, path, import_format):
+    """Фоновый импорт загруженного файла; прогресс и итог - в строке ImportJob"""
+    from django.core.files.storage import default_storage
+    from django.utils import timezone
+    from .importer import import_products
+    from .models import ImportJob
+
+    def update_job(**fields):
+        ImportJob.objects.filter(job_id=job_id).update(updated_at=timezone.now(), **fields)
+
+    def progress(stats):
+        update_job(status='running', stats=stats)
+
+    try:
+        with default_storage.open(path, 'rb') as stream:
+            stats = import_products(stream, import_format, progress=progress)
+        update_job(status='done', stats=stats)
+        return stats
+    except Exception as e:
+        logger.error(f"❌ Ошибка импорта товаров {path}: {e}")
+        update_job(status='failed', error=str(e))
+        return False
+    finally:
+        default_storage.delete(path)
+
+
+@shared_task
+def dispatch_outbox(max_batches=20):
+    """Доставка сообщений outbox пачками; запускается после коммита и периодически из beat"""
+    from .outbox import OUTBOX_BATCH_SIZE, dispatch
+
+    total = 0
+    for _ in range(max_batches):
+        processed = dispatch()
+        total += processed
+        if processed < OUTBOX_BATCH_SIZE:
+            break
+    return total
+
+
+@shared_task
+def release_expired_reservations():
+    """Возвращает на склад резервы корзин с истекшим сроком"""
+    from .stock import release_expired_reservations as release
+
+    released = release()
+    if released:
+        logger.info(f"Возвращено на склад резервов: {released}")
+    return released
+
+
+@shared_task
+def purge_idempotency_keys():
+    """Удаляет просроченные ключи идемпотентности (api/idempotency.py)"""
+    from django.utils import timezone
+    from .models import IdempotencyKey
+
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+@shared_task
+def flush_sessions(window):
+    """Пишет сессии витрины, измененные за окно, из кэша в базу (myapp/sessions.py)"""
+    from .sessions import flush_dirty_sessions
+
+    return flush_dirty_sessions(window)
+
+
+@shared_task
+def purge_product_changes():
+    """Удаляет старые записи журнала изменений товаров (myapp/changes.py)"""
+    from .changes import purge_product_changes as purge
+
+    return purge()
+
+
+@shared_task
+def archive_old_orders():
+    """Ночной перенос старых завершенных и отмененных заказов в архив (manage.py archive_orders)"""
+    from .archive import archive_orders
+
+    archived = archive_orders()
+    logger.info(f"Перенесено в архив заказов: {archived}")
+    return archived
+
+
+@shared_task
+def refresh_sales_rollups():
+    """Дозаполняет агрегаты продаж по заказам, измененным после водяного знака"""
+    from .rollups import refresh_sales_rollups as refresh
+
+    days = refresh()
+    return [day.isoformat() for day in days] if days is not None else None
@@ -1,3 +1,534 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core import mail
+from django.test import LiveServerTestCase, TestCase, override_settings
+
+from . import events
+from .facets import apply_filters, get_facets, parse_filters
+from .models import Category, Product, ProductImage
+from .pagination import KeysetPaginator
+
+
+class KeysetPaginatorTest(TestCase):
+    def setUp(self):
+        # Повторяющиеся цены проверяют добивку ключа сортировки по id
+        for i in range(7):
+            Product.objects.create(name=f'P{i}', price=Decimal('10.00') + i // 2)
+
+    def walk(self, sort):
+        paginator = KeysetPaginator(Product.objects.all(), sort=sort, per_page=3)
+        page = paginator.get_page()
+        pages = [page]
+        while page.has_next:
+            page = paginator.get_page(page.next_cursor)
+            pages.append(page)
+        return paginator, pages
+
+    def test_forward_walk_covers_all_rows_once(self):
+        _, pages = self.walk('-price')
+        ids = [p.id for page in pages for p in page]
+        expected = list(Product.objects.order_by('-price', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertFalse(pages[0].has_previous)
+
+    def test_previous_cursor_returns_previous_page(self):
+        paginator, pages = self.walk('price')
+        back = paginator.get_page(pages[2].previous_cursor)
+        self.assertEqual([p.id for p in back], [p.id for p in pages[1]])
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), sort='unknown', per_page=3)
+        page = paginator.get_page('not-a-cursor')
+        self.assertEqual([p.id for p in page], list(Product.objects.order_by('id').values_list('id', flat=True)[:3]))
+
+    def test_forged_or_foreign_cursor_falls_back_to_first_page(self):
+        from .pagination import encode_cursor
+        first = list(Product.objects.order_by('price', 'id').values_list('id', flat=True)[:3])
+        paginator, pages = self.walk('-price')
+        cursors = [
+            encode_cursor('price', 'abc', 1),
+            encode_cursor('price', None, 1),
+            pages[0].next_cursor,  # выдан для ?sort=-price
+            pages[0].next_cursor.replace(':', ':x', 1),  # подпись не сходится
+        ]
+        paginator = KeysetPaginator(Product.objects.all(), sort='price', per_page=3)
+        for cursor in cursors:
+            self.assertEqual([p.id for p in paginator.get_page(cursor)], first)
+
+        response = self.client.get('/api/catalog/products/', {'sort': 'price', 'cursor': cursors[0]})
+        self.assertEqual(response.status_code, 200)
+
+
+class ProductImagesQueryTest(TestCase):
+    def test_main_image_uses_prefetched_images(self):
+        for i in range(3):
+            product = Product.objects.create(name=f'P{i}', price=Decimal('1.00'))
+            ProductImage.objects.create(product=product, image=f'product_images/{i}-a.png', order=1)
+            ProductImage.objects.create(product=product, image=f'product_images/{i}-main.png', is_main=True, order=2)
+
+        products = list(Product.objects.with_images())
+        with self.assertNumQueries(0):
+            for product in products:
+                self.assertTrue(product.get_main_image().name.endswith('-main.png'))
+                self.assertEqual(len(product.get_images_with_fallback()), 4)
+
+
+class FacetsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phones = Category.objects.create(name='Phones')
+        self.laptops = Category.objects.create(name='Laptops')
+        Product.objects.create(name='A', price='30.00', category=self.phones)
+        Product.objects.create(name='B', price='700.00', category=self.phones, discount_percent=10)
+        Product.objects.create(name='C', price='1500.00', category=self.laptops, in_stock=False)
+
+    def assertFacetsMatchDatabase(self, params):
+        filters = parse_filters(params)
+        facets = get_facets(filters)
+        self.assertEqual(facets['total'], apply_filters(Product.objects.all(), filters).count())
+        return facets
+
+    def test_disjunctive_counts(self):
+        facets = self.assertFacetsMatchDatabase({'category': str(self.phones.id), 'has_discount': '1'})
+        self.assertEqual(facets['total'], 1)
+        # Счетчик категорий не сужается выбранной категорией
+        self.assertEqual({f['id']: f['count'] for f in facets['category']}, {self.phones.id: 1})
+        self.assertEqual(facets['has_discount'], {'true': 1, 'false': 1})
+
+    def test_non_finite_price_is_ignored(self):
+        for value in ('NaN', 'sNaN', 'Infinity', '-inf'):
+            filters = parse_filters({'price_min': value, 'price_max': value})
+            self.assertEqual(apply_filters(Product.objects.all(), filters).count(), 3)
+        self.assertEqual(self.client.get('/api/catalog/products/', {'price_min': 'NaN'}).status_code, 200)
+        self.assertEqual(self.client.get('/', {'price_max': 'Infinity'}).status_code, 200)
+
+    def test_unaligned_price_range_is_exact(self):
+        facets = self.assertFacetsMatchDatabase({'price_min': '20', 'price_max': '800'})
+        self.assertEqual(facets['total'], 2)
+
+    def test_cached_cube_is_updated_incrementally(self):
+        get_facets(parse_filters({}))
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='D', price='60.00', category=self.laptops)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.in_stock = False
+            product.save()
+        with self.assertNumQueries(1):  # только названия категорий
+            get_facets(parse_filters({'in_stock': '0'}))
+        facets = self.assertFacetsMatchDatabase({'in_stock': '0'})
+        self.assertEqual(facets['total'], 2)
+
+
+class ProductImportTest(TestCase):
+    CSV = (
+        'sku,name,description,price,in_stock,category,discount_percent\n'
+        'A-1,Phone,Камера,100.00,true,Phones,0\n'
+        'A-2,Laptop,,900,false,Laptops,10\n'
+        'A-3,Broken,,-5,true,,0\n'
+    )
+
+    def run_import(self, text):
+        import io
+        from .importer import import_products
+        return import_products(io.StringIO(text), 'csv', batch_size=2)
+
+    def test_upsert_and_skip_unchanged(self):
+        stats = self.run_import(self.CSV)
+        self.assertEqual((stats['upserted'], stats['errors']), (2, 1))
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Product.objects.get(sku='A-2').discount_percent, 10)
+
+        stats = self.run_import(self.CSV)
+        self.assertEqual((stats['upserted'], stats['unchanged']), (0, 2))
+
+        stats = self.run_import(self.CSV.replace('100.00', '120.00'))
+        self.assertEqual((stats['upserted'], stats['unchanged']), (1, 1))
+        self.assertEqual(Product.objects.get(sku='A-1').price, Decimal('120.00'))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_bad_ndjson_lines_are_row_errors(self):
+        import io
+        from .importer import import_products
+        text = ('{"sku": "A-1", "name": "Phone", "price": "10"}\n'
+                '{not json\n'
+                '[1, 2]\n'
+                '{"sku": "A-2", "name": "Laptop", "price": "20"}\n')
+        stats = import_products(io.StringIO(text), 'ndjson', batch_size=1)
+        self.assertEqual((stats['rows'], stats['upserted'], stats['errors']), (4, 2, 2))
+        self.assertIn('строка 2', stats['error_messages'][0])
+
+    def test_values_over_column_limits_are_row_errors(self):
+        stats = self.run_import(
+            'sku,name,price,category\n'
+            f'{"S" * 65},Long sku,10,\n'
+            'A-1,Huge price,100000000,\n'
+            'A-2,Not a number,NaN,\n'
+            f'A-3,Long category,10,{"C" * 101}\n'
+            'A-4,Phone,99999999.99,Phones\n'
+        )
+        self.assertEqual((stats['rows'], stats['upserted'], stats['errors']), (5, 1, 4))
+        self.assertEqual(Product.objects.get().sku, 'A-4')
+
+    def test_partial_save_clears_content_hash(self):
+        self.run_import(self.CSV)
+        product = Product.objects.get(sku='A-1')
+        product.price = Decimal('80.00')
+        product.save(update_fields=['price'])
+        self.assertEqual(Product.objects.get(sku='A-1').content_hash, '')
+
+        stats = self.run_import(self.CSV)
+        self.assertEqual(stats['upserted'], 1)
+        self.assertEqual(Product.objects.get(sku='A-1').price, Decimal('100.00'))
+
+
+@override_settings(ADMIN_EMAILS=['admin@example.com'],
+                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class ProductEventsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('myapp.events.flush_product_events')
+    @mock.patch('myapp.events.send_new_products_digest')
+    def test_bulk_block_emits_one_event(self, digest, flush):
+        with self.captureOnCommitCallbacks(execute=True):
+            with events.bulk_product_events():
+                for i in range(5):
+                    Product.objects.create(name=f'P{i}', price=10)
+        digest.delay.assert_called_once()
+        self.assertEqual(len(digest.delay.call_args.kwargs['products']), 5)
+        flush.apply_async.assert_not_called()
+
+    @mock.patch('myapp.events.cache_is_shared', return_value=True)
+    @mock.patch('myapp.events.time.time', return_value=3000.0)
+    def test_single_creates_coalesced_into_digest(self, *_):
+        from .tasks import flush_product_events
+        with mock.patch('myapp.events.flush_product_events') as flush:
+            for i in range(3):
+                with self.captureOnCommitCallbacks(execute=True):
+                    Product.objects.create(name=f'P{i}', price=10)
+        flush.apply_async.assert_called_once_with(args=[100], countdown=31.0)
+
+        flush_product_events(100)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('3', mail.outbox[0].subject)
+        self.assertIsNone(cache.get('product_events:100:count'))
+
+    @mock.patch('myapp.events.send_new_products_digest')
+    def test_process_local_cache_sends_single_creates_directly(self, digest):
+        # Окно в LocMemCache воркер не увидит - событие уходит сразу, как до окон
+        with mock.patch('myapp.events.flush_product_events') as flush:
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.create(name='P', price=10)
+        flush.apply_async.assert_not_called()
+        self.assertEqual(digest.delay.call_args.kwargs['products'][0]['product_name'], 'P')
+
+    @mock.patch('myapp.events.send_new_products_digest')
+    def test_large_import_sends_count_and_capped_sample(self, digest):
+        import io
+        from .importer import import_products
+        from .tasks import DIGEST_MAX_LISTED
+        csv_text = 'sku,name,price\n' + ''.join(f'S-{i},P{i},10\n' for i in range(DIGEST_MAX_LISTED + 30))
+        with self.captureOnCommitCallbacks(execute=True):
+            import_products(io.StringIO(csv_text), 'csv', batch_size=25)
+        kwargs = digest.delay.call_args.kwargs
+        self.assertEqual(kwargs['total'], DIGEST_MAX_LISTED + 30)
+        self.assertEqual(len(kwargs['products']), DIGEST_MAX_LISTED)
+
+    @mock.patch('myapp.events.send_new_products_digest')
+    def test_import_emits_event_only_for_new_products(self, digest):
+        import io
+        from .importer import import_products
+        csv_text = 'sku,name,price\nA-1,Phone,100\nA-2,Laptop,900\n'
+        with self.captureOnCommitCallbacks(execute=True):
+            import_products(io.StringIO(csv_text), 'csv')
+        self.assertEqual(len(digest.delay.call_args.kwargs['products']), 2)
+
+        digest.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            import_products(io.StringIO(csv_text.replace('900', '950')), 'csv')
+        digest.delay.assert_not_called()
+
+
+class DatasetGeneratorTest(TestCase):
+    def test_small_dataset_is_consistent(self):
+        from django.db.models import F, Sum
+        from .datagen import generate_dataset
+        from .models import Order
+
+        stats = generate_dataset(products=50, users=10, orders=20, categories=3, seed=7)
+        self.assertEqual(stats['Product']['rows'], 50)
+        self.assertEqual(Product.objects.filter(sku__startswith='GEN7-').count(), 50)
+        self.assertEqual(Order.objects.count(), 20)
+        self.assertFalse(Order.objects.annotate(items_total=Sum(F('items__price') * F('items__quantity')))
+                         .exclude(total_amount=F('items_total')).exists())
+        # Последовательность id сдвинута за загруженные строки
+        self.assertEqual(Product.objects.create(name='После', price=1).id, Product.objects.latest('id').id)
+
+    def test_rows_are_deterministic(self):
+        from .datagen import DatasetGenerator
+
+        def rows(seed):
+            generator = DatasetGenerator(products=20, users=0, orders=0, categories=2, seed=seed)
+            generator.category_base = generator.product_base = 1
+            return list(generator.product_rows())
+
+        self.assertEqual(rows(1), rows(1))
+        self.assertNotEqual(rows(1), rows(2))
+
+
+class LoadTestReportTest(TestCase):
+    def test_percentiles_and_grouping(self):
+        from .loadtest import endpoint_name, percentile, summarize
+
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(endpoint_name('GET', '/product/15/?x=1'), 'GET /product/{id}/')
+
+        samples = [{'name': 'a', 'status': 200, 'ms': float(ms), 'queries': 3, 'error': False}
+                   for ms in range(1, 100)]
+        samples.append({'name': 'a', 'status': 500, 'ms': 1000.0, 'queries': None, 'error': True})
+        report = summarize(samples, elapsed=10)
+        row = report['endpoints']['a']
+        self.assertEqual((row['requests'], row['rps'], row['error_rate']), (100, 10.0, 0.01))
+        self.assertEqual((row['p50_ms'], row['p99_ms'], row['queries_per_request']), (50.0, 99.0, 3.0))
+        self.assertEqual(row['statuses'], {'200': 99, '500': 1})
+
+
+    def test_recorder_skips_credential_bodies_by_prefix(self):
+        import json
+        import tempfile
+        with tempfile.NamedTemporaryFile('r', suffix='.jsonl') as record:
+            with override_settings(REQUEST_RECORD_PATH=record.name):
+                self.client.post('/api/token/refresh/', {'refresh': 'secret-token'}, content_type='application/json')
+                self.client.post('/api/cart/batch/', {'operations': []}, content_type='application/json')
+            entries = [json.loads(line) for line in record]
+        self.assertNotIn('body', entries[0])
+        self.assertEqual(entries[1]['body'], {'operations': []})
+
+@override_settings(REQUEST_DIAGNOSTICS_HEADERS=True)
+class LoadTestLiveServerTest(LiveServerTestCase):
+    def test_login_scenario_reports_query_counts(self):
+        from django.contrib.auth.models import User
+        from .loadtest import run_load, summarize
+
+        User.objects.create_user('load', password='secret-pass')
+        samples, elapsed = run_load(self.live_server_url, scenario='login', concurrency=2, iterations=2,
+                                    users=['load'], password='secret-pass', product_ids=[1])
+        row = summarize(samples, elapsed)['endpoints']['jwt_token']
+        self.assertEqual((row['requests'], row['error_rate']), (4, 0))
+        self.assertIsNotNone(row['queries_per_request'])
+
+
+class UnifiedCartTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user('buyer', password='secret-pass')
+        self.phone = Product.objects.create(name='Phone', price=100)
+        self.case = Product.objects.create(name='Case', price=10)
+
+    def test_anonymous_cart_lives_in_signed_cookie(self):
+        from django.contrib.sessions.models import Session
+        for _ in range(3):
+            self.client.post(f'/cart/add/{self.phone.id}/')
+        self.client.post(f'/cart/remove/{self.phone.id}/')
+
+        self.assertEqual(Session.objects.count(), 0)
+        response = self.client.get('/cart/')
+        self.assertEqual([(i['product'].id, i['quantity']) for i in response.context['cart_items']],
+                         [(self.phone.id, 2)])
+
+    def test_login_merges_into_db_cart(self):
+        from .models import Cart, CartItem
+        self.client.post(f'/cart/add/{self.phone.id}/')
+        self.client.post(f'/cart/add/{self.case.id}/')
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.phone, quantity=2)
+
+        response = self.client.post('/login/', {'username': 'buyer', 'password': 'secret-pass'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies['cart'].value, '')
+        self.assertEqual(dict(cart.items.values_list('product_id', 'quantity')),
+                         {self.phone.id: 3, self.case.id: 1})
+
+        # HTML-магазин и API видят одну корзину
+        self.client.post(f'/cart/add/{self.case.id}/')
+        self.assertEqual(cart.items.get(product=self.case).quantity, 2)
+
+    def test_html_checkout_charges_discounted_price_like_api(self):
+        from .cart import cart_summary, user_cart_id
+        from .models import Order
+        Product.objects.filter(pk=self.phone.pk).update(discount_percent=15)
+        self.client.post(f'/cart/add/{self.phone.id}/')
+        self.assertEqual(self.client.get('/cart/').context['total'], Decimal('85.00'))  # аноним, cookie
+
+        self.client.force_login(self.user)
+        self.client.post(f'/cart/add/{self.phone.id}/')
+        self.client.post(f'/cart/add/{self.case.id}/')
+        api_total = cart_summary(user_cart_id(self.user))['total_price']
+        self.assertEqual(self.client.get('/cart/').context['total'], api_total)
+
+        self.client.post('/checkout/', {'phone_number': '+7900'})
+        order = Order.objects.get()
+        self.assertEqual(order.total_amount, api_total)
+        self.assertEqual(order.items.get(product=self.phone).price, Decimal('85.00'))
+
+    def test_product_detail_still_requires_login(self):
+        response = self.client.get(f'/product/{self.phone.id}/')
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(f'/product/{self.phone.id}/').status_code, 200)
+
+    def test_legacy_session_list_is_normalized(self):
+        from .cart import _normalize
+        self.assertEqual(_normalize([5, 5, 7]), {5: 2, 7: 1})
+        self.assertEqual(_normalize({'5': 2, 'x': 1, '7': 0}), {5: 2})
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='token', TELEGRAM_CHAT_ID='chat')
+class OutboxTest(TestCase):
+    def ok(self, *args, **kwargs):
+        return mock.Mock(status_code=200)
+
+    def test_rollback_drops_message(self):
+        from django.db import transaction
+        from .models import OutboxMessage
+        from .outbox import enqueue_telegram
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue_telegram('заказ')
+            raise RuntimeError
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_messages_batched_into_one_telegram_call(self):
+        from .models import OutboxMessage
+        from .outbox import dispatch, enqueue_telegram
+
+        for i in range(3):
+            enqueue_telegram(f'заказ {i}')
+        with mock.patch('myapp.outbox.requests.post', side_effect=self.ok) as post:
+            self.assertEqual(dispatch(), 3)
+        post.assert_called_once()
+        self.assertIn('заказ 2', post.call_args.kwargs['data']['text'])
+        self.assertEqual(OutboxMessage.objects.filter(status='sent').count(), 3)
+
+    def test_oversized_message_is_split(self):
+        from .models import OutboxMessage
+        from .outbox import TELEGRAM_MAX_LENGTH, dispatch, enqueue_telegram
+
+        enqueue_telegram('короткое')
+        enqueue_telegram('\n'.join(['строка заказа ' * 20] * 40))
+        enqueue_telegram('x' * (TELEGRAM_MAX_LENGTH + 10))
+        with mock.patch('myapp.outbox.requests.post', side_effect=self.ok) as post:
+            self.assertEqual(dispatch(), 3)
+        texts = [call.kwargs['data']['text'] for call in post.call_args_list]
+        self.assertGreater(len(texts), 3)
+        self.assertTrue(all(len(text) <= TELEGRAM_MAX_LENGTH for text in texts))
+        self.assertEqual(texts[0], 'короткое')
+        self.assertEqual(OutboxMessage.objects.filter(status='sent').count(), 3)
+
+    def test_split_keeps_html_tags_intact(self):
+        import re
+        from .outbox import _split_text
+
+        text = 'Заказ &amp; итог\n<b>' + '<a href="https://shop/p">товар</a> ' * 30 + '</b>\nконец'
+        parts = _split_text(text, limit=200)
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            self.assertLessEqual(len(part), 200)
+            # Каждая часть - законченный HTML: теги не разрезаны и сбалансированы
+            self.assertEqual(re.sub(r'<[^<>]*>|&#?\w+;', '', part).count('<'), 0)
+            self.assertEqual(part.count('<b>'), part.count('</b>'))
+            self.assertEqual(part.count('<a '), part.count('</a>'))
+        self.assertEqual(re.sub(r'<[^<>]*>', '', ''.join(parts)), re.sub(r'<[^<>]*>', '', text))
+
+    def test_failure_is_retried_with_backoff(self):
+        import requests
+        from django.utils import timezone
+        from .outbox import dispatch, enqueue_telegram
+
+        message = enqueue_telegram('заказ')
+        with mock.patch('myapp.outbox.requests.post', side_effect=requests.Timeout('timeout')):
+            dispatch()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('pending', 1))
+        self.assertGreater(message.available_at, timezone.now())
+        # До наступления available_at сообщение не берется
+        with mock.patch('myapp.outbox.requests.post', side_effect=self.ok) as post:
+            self.assertEqual(dispatch(), 0)
+        post.assert_not_called()
+
+    def test_checkout_does_not_call_telegram(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+        from .models import Cart, CartItem, OutboxMessage
+
+        user = User.objects.create_user('buyer', password='secret-pass')
+        product = Product.objects.create(name='Phone', price=100)
+        CartItem.objects.create(cart=Cart.objects.create(user=user), product=product, quantity=2)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with mock.patch('myapp.outbox.requests.post', side_effect=self.ok) as post:
+            response = client.post('/api/orders/checkout/', {'phone_number': '+7900'}, format='json')
+            self.assertEqual(response.status_code, 201)
+            post.assert_not_called()
+            self.assertEqual(OutboxMessage.objects.get().status, 'pending')
+
+            from .outbox import dispatch
+            dispatch()
+        post.assert_called_once()
+        self.assertEqual(OutboxMessage.objects.get().status, 'sent')
+
+
+@override_settings(CART_ANONYMOUS_STORAGE='session')
+class WriteBehindSessionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phone = Product.objects.create(name='Phone', price=100)
+
+    def stored_cart(self):
+        from django.contrib.sessions.models import Session
+        from .cart import CART_SESSION_KEY
+        return Session.objects.get().get_decoded().get(CART_SESSION_KEY)
+
+    @mock.patch('myapp.sessions.cache_is_shared', return_value=True)
+    @mock.patch('myapp.sessions.time.time', return_value=3000.0)
+    def test_changes_reach_db_in_one_flush(self, *_):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .sessions import flush_dirty_sessions
+
+        with mock.patch('myapp.tasks.flush_sessions') as flush:
+            self.client.post(f'/cart/add/{self.phone.id}/')  # создание сессии - сразу в БД
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(f'/cart/add/{self.phone.id}/')
+                self.client.post(f'/cart/add/{self.phone.id}/')
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+        flush.apply_async.assert_called_once_with(args=[100], countdown=31.0)
+        self.assertEqual(self.stored_cart(), {str(self.phone.id): 1})
+
+        self.assertEqual(flush_dirty_sessions(100), 1)
+        self.assertEqual(self.stored_cart(), {str(self.phone.id): 3})
+        self.assertEqual(self.client.get('/cart/').context['cart_items'][0]['quantity'], 3)
+
+    def test_unchanged_session_is_not_rewritten(self):
+        from .sessions import SessionStore
+
+        store = SessionStore()
+        store['cart'] = {'1': 2}
+        store.save(must_create=True)
+
+        store = SessionStore(store.session_key)
+        store['cart'] = {'1': 2}
+        with mock.patch('myapp.sessions._mark_dirty') as mark, self.assertNumQueries(0):
+            store.save()
+        mark.assert_not_called()
+
+    def test_process_local_cache_writes_db_directly(self):
+        # В тестах кэш - LocMemCache: очередь окна была бы видна только этому процессу
+        with mock.patch('myapp.tasks.flush_sessions') as flush:
+            for _ in range(3):
+                self.client.post(f'/cart/add/{self.phone.id}/')
+        flush.apply_async.assert_not_called()
+        self.assertEqual(self.stored_cart(), {str(self.phone.id): 3})
@@ -1,13 +1,19 @@
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
-import requests
-from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
 from django.contrib import messages
 
 from .forms import RegisterForm
-from .models import Product, Category, OrderItem, Order
+from .models import (Product, Category, CartItem, OrderItem, Order, ProductImage,
+                     discounted_price_expression)
+from .cart import DBCartStore, get_cart, user_cart_id
+from .outbox import enqueue_telegram
+from .stock import OutOfStock, commit_cart_stock, reserve_cart
+from .facets import apply_filters, get_facets, parse_filters
+from .pagination import KeysetPaginator
+from .search import search_products
 
 
 def register_view(request):
@@ -24,85 +30,127 @@ def register_view(request):
     return render(request, 'register.html', {'form': form})
 
 
+SORT_CHOICES = [
+    ('id', 'По умолчанию'),
+    ('price', 'Сначала дешевые'),
+    ('-price', 'Сначала дорогие'),
+    ('-discount', 'По размеру скидки'),
+    ('name', 'По названию'),
+]
+
+
 def products_view(request):
     categories = Category.objects.all()
     category_id = request.GET.get('category')
+    sort = request.GET.get('sort', 'id')
+    q = request.GET.get('q', '').strip()
+
+    products = Product.objects.with_images()
+
+    if q:
+        if category_id:
+            products = products.filter(category_id=category_id)
+        # Результаты поиска упорядочены по релевантности, показываем лучшие без пагинации
+        return render(request, 'products.html', {
+            'products': search_products(q, products),
+            'categories': categories,
+            'selected_category': category_id,
+            'query': q,
+        })
+
+    # Фильтры с фасетами: счетчики берутся из кэша, а не из GROUP BY на каждый запрос
+    filters = parse_filters(request.GET)
+    products = apply_filters(products, filters)
+    facets = get_facets(filters)
 
-    products = Product.objects.all()
-    if category_id:
-        products = products.filter(category_id=category_id)
+    # Пагинация по курсору: без COUNT(*) и OFFSET, глубокие страницы не медленнее первой
+    paginator = KeysetPaginator(products, sort=sort, per_page=10)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
-    paginator = Paginator(products, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    filter_params = request.GET.copy()
+    filter_params.pop('cursor', None)
+    price_params = filter_params.copy()
+    price_params.pop('price_min', None)
+    price_params.pop('price_max', None)
 
     return render(request, 'products.html', {
-        'products': page_obj.object_list,  # Берем продукты из page_obj
+        'products': page_obj.object_list,
         'categories': categories,
         'selected_category': category_id,
+        'selected_sort': sort,
+        'sort_choices': SORT_CHOICES,
         'page_obj': page_obj,
+        'facets': facets,
+        'filters': filters,
+        'filter_query': filter_params.urlencode(),
+        'price_query': price_params.urlencode(),
     })
 
 @login_required(login_url='/login/')
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(Product.objects.with_images(), pk=pk)
     return render(request, 'product_detail.html', {'product': product})
 
 
-@login_required(login_url='/login/')
 def add_to_cart(request, product_id):
-    cart = request.session.get('cart', [])
-
-    # Добавляем товар в корзину (может быть несколько одинаковых)
-    cart.append(product_id)
-    request.session['cart'] = cart
-    request.session.modified = True
+    get_object_or_404(Product.objects.only('id'), pk=product_id)
+    # Аноним хранит корзину в подписанной cookie, вошедший - в Cart (общей с API)
+    get_cart(request).add(product_id)
 
     messages.success(request, 'Товар добавлен в корзину')
     return redirect('cart_view')
 
 
-@login_required(login_url='/login/')
 def remove_from_cart(request, product_id):
-    """Удалить товар из корзины."""
-    cart = request.session.get('cart', [])
-
-    # Удаляем только одно вхождение товара
-    if product_id in cart:
-        cart.remove(product_id)
-        request.session['cart'] = cart
-        request.session.modified = True
+    """Удалить одну единицу товара из корзины."""
+    if get_cart(request).remove(product_id):
         messages.success(request, 'Товар удален из корзины')
 
     return redirect('cart_view')
 
-@login_required(login_url='/login/')
-def cart_view(request):
-    """Показать корзину."""
-    cart = request.session.get('cart', [])
-
-    if not cart:
-        return render(request, 'cart.html', {'cart_items': [], 'total': 0})
-
-    # Подсчитываем количество каждого товара
-    from collections import Counter
-    cart_counter = Counter(cart)
-
-    # Получаем товары и формируем корзину
-    products = Product.objects.filter(id__in=cart_counter.keys())
 
-    cart_items = []
+def _cart_lines(cart_store, cart, with_images=False):
+    """
+    Строки корзины и итог по цене со скидкой - той же, что считает API
+    (CartItem.with_prices), чтобы оба интерфейса брали за корзину одну сумму.
+    """
+    if isinstance(cart_store, DBCartStore):
+        rows = CartItem.objects.filter(cart__user=cart_store.user).with_prices().order_by('added_at', 'id')
+        if with_images:
+            rows = rows.prefetch_related(
+                Prefetch('product__images', queryset=ProductImage.objects.order_by('-is_main', 'order', 'id'))
+            )
+        priced = [(row.product, row.quantity, row.unit_price, row.line_total) for row in rows]
+    else:
+        # Аноним: товары из cookie с той же ценой со скидкой, посчитанной в SQL
+        products = Product.objects.filter(id__in=cart.keys()).annotate(unit_price=discounted_price_expression())
+        if with_images:
+            products = products.with_images()
+        priced = [(product, cart[product.id], product.unit_price, product.unit_price * cart[product.id])
+                  for product in products]
+
+    lines = []
     total = 0
-
-    for product in products:
-        quantity = cart_counter[product.id]
-        item_total = product.price * quantity
-        cart_items.append({
+    for product, quantity, price, item_total in priced:
+        lines.append({
             'product': product,
             'quantity': quantity,
+            'price': price,
             'total': item_total
         })
         total += item_total
+    return lines, total
+
+
+def cart_view(request):
+    """Показать корзину."""
+    cart_store = get_cart(request)
+    cart = cart_store.items()
+
+    if not cart:
+        return render(request, 'cart.html', {'cart_items': [], 'total': 0})
+
+    cart_items, total = _cart_lines(cart_store, cart, with_images=True)
 
     return render(request, 'cart.html', {
         'cart_items': cart_items,
@@ -113,30 +161,15 @@ def cart_view(request):
 @login_required(login_url='/login/')
 def checkout_view(request):
     """Оформление заказа с отправкой в Telegram"""
-    cart = request.session.get('cart', [])
+    cart_store = get_cart(request)
+    cart = cart_store.items()
 
     if not cart:
         messages.error(request, 'Корзина пуста')
         return redirect('cart_view')
 
-    # Подсчитываем товары и общую сумму
-    product_counts = {}
-    for product_id in cart:
-        product_counts[product_id] = product_counts.get(product_id, 0) + 1
-
-    products = Product.objects.filter(id__in=cart)
-    cart_items = []
-    total = 0
-
-    for product in products:
-        quantity = product_counts[product.id]
-        item_total = product.price * quantity
-        cart_items.append({
-            'product': product,
-            'quantity': quantity,
-            'total': item_total
-        })
-        total += item_total
+    cart_items, total = _cart_lines(cart_store, cart)
+    cart_id = user_cart_id(request.user, create=False)
 
     if request.method == 'POST':
         phone_number = request.POST.get('phone_number')
@@ -152,39 +185,43 @@ def checkout_view(request):
             })
 
         try:
-            # Создаем заказ
-            order = Order.objects.create(
-                user=request.user,
-                phone_number=phone_number,
-                customer_name=customer_name,
-                total_amount=total
-            )
-
-            # Создаем элементы заказа
-            for item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item['product'],
-                    quantity=item['quantity'],
-                    price=item['product'].price
+            with transaction.atomic():
+                # Создаем заказ
+                order = Order.objects.create(
+                    user=request.user,
+                    phone_number=phone_number,
+                    customer_name=customer_name,
+                    total_amount=total
                 )
 
-            # Отправляем уведомление в Telegram
-            order_items = OrderItem.objects.filter(order=order)
-            telegram_message = create_order_message(order, order_items)
-            telegram_sent = send_telegram_notification(telegram_message)
-
-            # Очищаем корзину
-            request.session['cart'] = []
-            request.session.modified = True
-
-            if telegram_sent:
-                messages.success(request, f'Заказ #{order.id} успешно оформлен! Уведомление отправлено.')
-            else:
-                messages.success(request, f'Заказ #{order.id} успешно оформлен! (Уведомление не отправлено)')
-
+                # Создаем элементы заказа
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order=order,
+                        product=item['product'],
+                        quantity=item['quantity'],
+                        price=item['price']
+                    )
+                    for item in cart_items
+                ])
+
+                # Уведомление в Telegram пишется в outbox той же транзакции и отправляется
+                # фоновой задачей: оформление не ждет Telegram
+                order_items = OrderItem.objects.filter(order=order).select_related('product')
+                enqueue_telegram(create_order_message(order, order_items))
+
+                # Очищаем корзину
+                cart_store.clear()
+
+                # Остатки списываются последним шагом: строки товаров заблокированы только до коммита
+                commit_cart_stock(cart_id, cart)
+
+            messages.success(request, f'Заказ #{order.id} успешно оформлен!')
             return redirect('order_success', order_id=order.id)
 
+        except OutOfStock:
+            messages.error(request, 'Некоторых товаров из корзины уже нет в нужном количестве')
+            return redirect('cart_view')
         except Exception as e:
             messages.error(request, f'Ошибка при оформлении заказа: {str(e)}')
             return render(request, 'checkout.html', {
@@ -194,9 +231,17 @@ def checkout_view(request):
                 'customer_name': customer_name,
             })
 
+    # Пока покупатель заполняет форму, товары закреплены за его корзиной
+    try:
+        reserved_until = reserve_cart(cart_id)
+    except OutOfStock:
+        messages.error(request, 'Некоторых товаров из корзины уже нет в нужном количестве')
+        return redirect('cart_view')
+
     return render(request, 'checkout.html', {
         'cart_items': cart_items,
         'total': total,
+        'reserved_until': reserved_until,
     })
 
 
@@ -212,31 +257,6 @@ def order_success(request, order_id):
     })
 
 
-def send_telegram_notification(message):
-    """Отправка сообщения в Telegram"""
-    bot_token = settings.TELEGRAM_BOT_TOKEN
-    chat_id = settings.TELEGRAM_CHAT_ID
-
-    if not bot_token or not chat_id:
-        print("Telegram bot token or chat ID not configured")
-        return False
-
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-
-    payload = {
-        'chat_id': chat_id,
-        'text': message,
-        'parse_mode': 'HTML'
-    }
-
-    try:
-        response = requests.post(url, data=payload, timeout=10)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"Error sending Telegram notification: {e}")
-        return False
-
-
 def create_order_message(order, items):
     """Формирует сообщение о заказе для Telegram"""
     items_text = "\n".join([